@@ -10,6 +10,18 @@ from flask_wtf import CSRFProtect
 from flask_pagedown import PageDown
 from config import config
 from app.decorators import timeout
+from app.common.tag_cache import tag_cache
+from app.common.id_allocator import id_allocator
+from app.common.suggestion_index import suggestion_index
+from app.common.suggestion_vectors import suggestion_vectors
+from app.common.suggestion_choices import suggestion_choices
+from app.common.tokens import token_cache
+from app.common.principal_cache import principal_cache
+from app.common.logging_module import configure_logging
+from app.common.metrics import request_metrics
+from app.common.slow_queries import slow_query_log
+from app.common.fragment_cache import fragment_cache
+from app.common.static_assets import static_assets
 
 db = MongoEngine()
 moment = Moment()
@@ -41,15 +53,28 @@ def create_app(config_name):
 
     # Initialize the application
     config[config_name].init_app(app)
+    configure_logging(app)
 
     # setup the plugins
     # FIXME: check if mongod is running before launching the app.
+    # Command listeners have to be registered before the client exists
+    request_metrics.init_app(app)
+    slow_query_log.init_app(app)
     db.init_app(app)
     moment.init_app(app)
     login_manager.init_app(app, add_context_processor=True)
     bootstrap.init_app(app)
     csrf.init_app(app)
     pagedown.init_app(app)
+    tag_cache.init_app(app)
+    id_allocator.init_app(app)
+    suggestion_index.init_app(app)
+    suggestion_vectors.init_app(app)
+    suggestion_choices.init_app(app)
+    token_cache.init_app(app)
+    principal_cache.init_app(app)
+    fragment_cache.init_app(app)
+    static_assets.init_app(app)
 
     from app.webapp import webapp as webapp_blueprint
     app.register_blueprint(webapp_blueprint)
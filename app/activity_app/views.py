@@ -5,23 +5,26 @@ from datetime import datetime
 from . import activity_app, aa_logger
 from .forms import ActivityForm, CommentForm
 from app.models import Activity, Tag, Comment
+from app.common.user_resolver import prefetch_users
+from app.common.pagination import paginate, use_keyset
+from app.common.tag_cache import tag_cache
+from app.common.conditional import page_etag, is_not_modified, \
+    not_modified, with_validators
 from flask_login import login_required, current_user
 from flask import redirect, url_for, request, current_app, \
-    render_template, abort, flash
+    render_template, abort, flash, jsonify
 
 
 @activity_app.route('/', methods=['GET', 'POST'])
 @activity_app.route('/index', methods=['GET', 'POST'])
 @login_required
 def index():
-    page = request.args.get('page', 1, type=int)
     qs = Activity.objects().order_by('-timestamp')
-    pagination = qs.paginate(page,
-                             per_page=current_app.config['POSTS_PER_PAGE'],
-                             error_out=False)
+    pagination = paginate(qs, current_app.config['POSTS_PER_PAGE'])
     activities = pagination.items
-    aa_logger.info('Index page displaying {0} activity items to user='
-                   '{1}'.format(len(activities), current_user.id))
+    prefetch_users(a.author_id for a in activities)
+    aa_logger.info('Index page displaying %s activity items to user='
+                   '%s', len(activities), current_user.id)
     return render_template('activity/index.html', activities=activities,
                            pagination=pagination)
 
@@ -36,16 +39,7 @@ def add_activity():
         a.description = form.description.data
         a.timestamp = datetime.utcnow()
         a.activity_time = form.activity_time.data
-        tag_data = form.tags.data
-        if tag_data != '':
-            tags = [t.strip() for t in tag_data.split(',')]
-            for tag in tags:
-                if Tag.objects(text=tag.strip()).first() is not None:
-                    a.tags.append(Tag.objects(text=tag).first().id)
-                else:
-                    t = Tag(text=tag).save()
-                    a.tags.append(t.id)
-            a.tags = list(set(a.tags))            # avoid repeated tags
+        a.tags = Tag.resolve_ids(form.tags.data.split(','))
         a.author_id = current_user.id
         a.save()
         flash('Activity is updated')
@@ -59,24 +53,17 @@ def add_activity():
 def edit_activity(a_id):
     a = Activity.objects(id=a_id).get_or_404()
     if a is not None and a.author_id != current_user.id:
-        aa_logger.warn('user={0} tried to edit inaccessible '
-                       'activity={1}'.format(current_user.id, a.id))
+        aa_logger.warn('user=%s tried to edit inaccessible '
+                       'activity=%s', current_user.id, a.id)
         abort(403)
     form = ActivityForm()
     if form.validate_on_submit():
         a.description = form.description.data
         a.timestamp = datetime.utcnow()
         a.activity_time = form.activity_time.data
-        tag_data = form.tags.data
-        if tag_data != '':
-            tags = [t.strip() for t in tag_data.split(',')]
-            for tag in tags:
-                if Tag.objects(text=tag.strip()).first() is not None:
-                    a.tags.append(Tag.objects(text=tag).first().id)
-                else:
-                    t = Tag(text=tag).save()
-                    a.tags.append(t.id)
-            a.tags = list(set(a.tags))               # avoid repeated tags
+        # keep the existing tags, avoid repeated tags
+        a.tags = list(set(a.tags + Tag.resolve_ids(
+            form.tags.data.split(','))))
         a.author_id = current_user.id
         a.save()
         flash('Activity is updated')
@@ -84,47 +71,49 @@ def edit_activity(a_id):
     form.title.data = a.title
     form.description.data = a.description
     form.activity_time.data = a.activity_time
-    form.tags.data = ','.join([Tag.objects(id=i).first().text
-                               for i in a.tags])
+    form.tags.data = ','.join(tag_cache.get_texts(a.tags))
     return render_template('activity/edit_activity.html', form=form)
 
 
 @activity_app.route('/<int:a_id>', methods=['GET', 'POST'])
 @login_required
 def activity_page(a_id):
-    a = Activity.objects(id=a_id).get_or_404()
     cf = CommentForm()
     if cf.validate_on_submit():
+        # RSVPs are single atomic updates, the activity is not loaded.
         if cf.interested.data:
-            if current_user.id not in a.interested:
-                a.interested.append(current_user.id)
-            a.save()
+            if not Activity.rsvp(a_id, current_user.id, 'interested'):
+                abort(404)
             flash('You interested in noted')
         elif cf.going.data:
-            if current_user.id not in a.going:
-                a.going.append(current_user.id)
-            if current_user.id in a.interested:
-                a.interested.remove(current_user.id)
-            a.save()
+            if not Activity.rsvp(a_id, current_user.id, 'going'):
+                abort(404)
             flash('You are marked as going')
         elif cf.cancel.data:
-            if current_user.id in a.going:
-                a.going.remove(current_user.id)
-            if current_user.id in a.interested:
-                a.interested.remove(current_user.id)
-            a.save()
+            if not Activity.rsvp(a_id, current_user.id, None):
+                abort(404)
             flash('Your interest has been removed')
         elif cf.body.data:
+            Activity.objects(id=a_id).only('id').get_or_404()
             comment = Comment(body=cf.body.data,
                               commenter_id=current_user.id,
                               c_type=current_app.config["COMMENT_TYPE"][
                                   "ACTIVITY"],
-                              post_id=a.id)
+                              post_id=a_id)
             comment.save()
+            Comment.update_comment_count(comment.c_type, a_id, 1,
+                                         comment.timestamp)
             flash('Your comment has been posted.')
-        return redirect(url_for('.activity_page', a_id=a.id, page=-1))
+        return redirect(url_for('.activity_page', a_id=a_id, page=-1))
+    a = Activity.objects(id=a_id).get_or_404()
+    last_modified = max(filter(None, (a.timestamp, a.last_comment_at)),
+                        default=None)
+    etag = page_etag('activity', a.id, a.version, a.timestamp,
+                     a.last_comment_at, a.comment_count)
+    if is_not_modified(etag):
+        return not_modified(etag, last_modified)
     page = request.args.get('page', 1, type=int)
-    if page == -1:
+    if page == -1 and not use_keyset():
         page = (Comment.objects(
             c_type=current_app.config["COMMENT_TYPE"]["ACTIVITY"],
             post_id=a.id).count() - 1) // \
@@ -132,24 +121,38 @@ def activity_page(a_id):
     qs = Comment.objects(
         c_type=current_app.config["COMMENT_TYPE"]["ACTIVITY"],
         post_id=a.id).all().order_by('-timestamp')
-    pagination = qs.paginate(
-        page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
+    pagination = paginate(qs, current_app.config['POSTS_PER_PAGE'], page=page)
     comments = pagination.items
-    return render_template('activity/activity.html', activity=a, form=cf,
-                           comments=comments, pagination=pagination)
+    prefetch_users([a.author_id] + a.interested + a.going +
+                   [c.commenter_id for c in comments])
+    return with_validators(
+        render_template('activity/activity.html', activity=a, form=cf,
+                        comments=comments, pagination=pagination),
+        etag, last_modified)
+
+
+@activity_app.route('/<int:a_id>/rsvp')
+@login_required
+def activity_rsvp(a_id):
+    """
+    Returns the number of interested and going users of an activity
+    without loading the member lists.
+    """
+    counts = Activity.rsvp_counts(a_id)
+    if counts is None:
+        abort(404)
+    return jsonify(counts)
 
 
 @activity_app.route('/my_activities', methods=['GET', 'POST'])
 @login_required
 def my_activities():
-    page = request.args.get('page', 1, type=int)
     qs = Activity.objects(author_id=current_user.id).order_by('-timestamp')
-    pagination = qs.paginate(page,
-                             per_page=current_app.config['POSTS_PER_PAGE'],
-                             error_out=False)
+    pagination = paginate(qs, current_app.config['POSTS_PER_PAGE'])
     activities = pagination.items
-    aa_logger.info('Index page displaying {0} personal posts to user='
-                   '{1}'.format(len(activities), current_user.id))
+    prefetch_users(a.author_id for a in activities)
+    aa_logger.info('Index page displaying %s personal posts to user='
+                   '%s', len(activities), current_user.id)
     return render_template('activity/my_activities.html',
                            activities=activities,
                            pagination=pagination)
@@ -157,17 +160,17 @@ def my_activities():
 
 @activity_app.route('/moderate/enable/<int:id>')
 def moderate_enable(id):
-    comment = Comment.objects.first_or_404(id)
-    comment.disabled = False
-    comment.save()
-    return redirect(url_for('.moderate',
+    comment = Comment.set_disabled(id, False)
+    if comment is None:
+        abort(404)
+    return redirect(url_for('.activity_page', a_id=comment.post_id,
                             page=request.args.get('page', 1, type=int)))
 
 
 @activity_app.route('/moderate/disable/<int:id>')
 def moderate_disable(id):
-    comment = Comment.objects.get_or_404(id)
-    comment.disabled = True
-    comment.save()
-    return redirect(url_for('.moderate',
+    comment = Comment.set_disabled(id, True)
+    if comment is None:
+        abort(404)
+    return redirect(url_for('.activity_page', a_id=comment.post_id,
                             page=request.args.get('page', 1, type=int)))
@@ -9,7 +9,7 @@ from app.auth import auth_app, auth_logger
 from app.auth.forms import LoginForm, ConfirmRegistrationForm, \
     ChangePasswordForm, PasswordResetRequestForm, ChangeEmailForm, \
     PasswordResetForm, ChangeLoginForm, ChangeUsernameForm
-from app.models import User
+from app.models import User, CREDENTIAL_FIELDS
 from app.auth.authentication import login_exempt
 
 
@@ -43,10 +43,10 @@ def unconfirmed():
     """
     if not current_user.is_anonymous and current_user.confirmed:
         auth_logger.warning('Confirmed user %d tried to access a page '
-                            'for confirmation.' % current_user.id)
+                            'for confirmation.', current_user.id)
         return redirect(url_for('user_app.index'))
     elif not current_user.is_anonymous:
-        auth_logger.info('Unconfirmed user %d tried to access a page.' %
+        auth_logger.info('Unconfirmed user %d tried to access a page.',
                          current_user.id)
         return render_template('auth/unconfirmed.html')
     else:
@@ -61,8 +61,8 @@ def login():
     """
     form = LoginForm()
     if form.validate_on_submit():
-        user = User.objects(email=form.username_or_email.data).first() or \
-            User.objects(username=form.username_or_email.data).first()
+        user = User.find_by_login(form.username_or_email.data,
+                                  fields=CREDENTIAL_FIELDS)
         if user is not None and user.verify_password(form.password.data):
             login_user(user, form.remember_me.data)
             auth_logger.info('User successfully logged in.')
@@ -99,7 +99,7 @@ def confirm(conf_token):
         user = User.verify_confirmation_token(conf_token)
         if user is not None:
             auth_logger.info('User %d successfully confirmed using '
-                             'confirmation token.' % user.id)
+                             'confirmation token.', user.id)
             flash('Your account has been confirmed.')
             return redirect(url_for('user_app.edit_profile'))
         else:
@@ -158,8 +158,8 @@ def password_reset_request():
         return redirect(url_for('user_app.index'))
     form = PasswordResetRequestForm()
     if form.validate_on_submit():
-        user = User.objects(email=form.username_or_email.data).first() or \
-            User.objects(username=form.username_or_email.data).first()
+        user = User.find_by_login(form.username_or_email.data,
+                                  fields=CREDENTIAL_FIELDS)
         if not user:
             auth_logger.warning('Request to change password for non existing '
                                 'user.')
@@ -168,7 +168,7 @@ def password_reset_request():
             return redirect(url_for('.password_reset_request'))
         pwd_rst_token = user.generate_pwd_reset_token()
         auth_logger.info('Password reset token successfully generated for '
-                         'user: %s' % user.username)
+                         'user: %s', user.username)
         flash('Redirecting to password reset page.')
         auth_logger.info('User redirected to page for resetting password')
         return redirect(url_for('.password_reset',
@@ -200,12 +200,12 @@ def password_reset(password_reset_token):
                   'username or email address.')
             return redirect(url_for('user_app.index'))
         if user.change_password(password_reset_token, form.password.data):
-            auth_logger.info('User: %s password sucessfully updated.' %
+            auth_logger.info('User: %s password sucessfully updated.',
                              user.username)
             flash('Password has been updated.')
             return redirect(url_for('.login'))
         else:
-            auth_logger.warning('Unable to update password for User: %s' %
+            auth_logger.warning('Unable to update password for User: %s',
                                 user.username)
             return redirect(url_for('user_app.index'))
     return render_template('auth/reset_password.html', form=form)
@@ -225,14 +225,14 @@ def change_login_request():
         if current_user.verify_password(form.password.data):
             login_change_token = current_user.generate_login_change_token(
                 username_or_email=form.username_or_email.data)
-            auth_logger.info('user login successfully updated for %s'
-                             % current_user.username)
+            auth_logger.info('user login successfully updated for %s',
+                             current_user.username)
             flash('Your login credentials are being changed.')
             return redirect(url_for('.change_login',
                                     login_change_token=login_change_token))
         auth_logger.warning('Invalid password used to change login '
-                            'credentials for User: %s'
-                            % current_user.username)
+                            'credentials for User: %s',
+                            current_user.username)
         flash('Invalid login credentials.')
     return render_template('auth/change_login.html', form=form)
 
@@ -250,13 +250,13 @@ def change_username_request():
             login_change_token = current_user.generate_login_change_token(
                 username_or_email=form.new_username.data)
             auth_logger.info('Username change token successfully '
-                             'generated for User: %s' %
+                             'generated for User: %s',
                              current_user.username)
             flash('Your username is being changed.')
             return redirect(url_for('.change_login',
                                     login_change_token=login_change_token))
         auth_logger.warning('Invalid password used to request username change '
-                            'token for User: %s' %
+                            'token for User: %s',
                             current_user.username)
         flash('Invalid password.')
     return render_template('auth/change_username.html', form=form)
@@ -275,13 +275,13 @@ def change_email_request():
             login_change_token = current_user.generate_login_change_token(
                 username_or_email=form.new_email.data)
             auth_logger.info('Email change token successfully '
-                             'generated for User: %s' %
+                             'generated for User: %s',
                              current_user.username)
             flash('Your email address is being changed.')
             return redirect(url_for('.change_login',
                                     login_change_token=login_change_token))
         auth_logger.warning('Invalid password used to request email change '
-                            'token for User: %s' %
+                            'token for User: %s',
                             current_user.username)
         flash('Invalid password.')
     return render_template('auth/change_email.html', form=form)
@@ -299,12 +299,12 @@ def change_login(login_change_token):
     """
     if current_user.change_login(login_change_token):
         auth_logger.info('Login credentials successfully updated for '
-                         'User: %s' % current_user.username)
+                         'User: %s', current_user.username)
         logout_user()
         flash('Your login information has been updated, '
               'please login to continue.')
         return redirect(url_for('.login'))
     else:
         auth_logger.error('Unable to change login credentials for User: '
-                          '%s' % current_user.username)
+                          '%s', current_user.username)
     return redirect(url_for('user_app.index'))
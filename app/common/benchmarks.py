@@ -0,0 +1,117 @@
+"""
+Micro benchmarks run from manage.py to compare implementation choices on
+the deployment hardware.
+"""
+
+import time
+import multiprocessing
+from pymongo import MongoClient
+from werkzeug.security import generate_password_hash, check_password_hash
+from app.common.id_allocator import IdBlockAllocator
+
+try:
+    from urllib.parse import quote_plus
+except ImportError:
+    from urllib import quote_plus
+
+
+def mongo_uri(config):
+    """
+    Builds a MongoDB connection uri from the application configuration.
+    :param config: application configuration.
+    :return (uri, db_name): tuple
+    """
+    settings = config.get('MONGODB_SETTINGS') or {}
+    host = settings.get('host') or config.get('MONGODB_HOST') or 'localhost'
+    port = settings.get('port') or config.get('MONGODB_PORT') or 27017
+    db_name = settings.get('db') or config.get('MONGODB_DB') or 'test'
+    username = settings.get('username') or config.get('MONGODB_USERNAME')
+    password = settings.get('password') or config.get('MONGODB_PASSWORD')
+    credentials = '{0}:{1}@'.format(quote_plus(username),
+                                    quote_plus(password)) \
+        if username and password else ''
+    return 'mongodb://{0}{1}:{2}/{3}'.format(credentials, host, port,
+                                             db_name), db_name
+
+
+def _insert_worker(uri, db_name, mode, count, block_size):
+    # Every worker opens its own connection like a gunicorn worker does.
+    db = MongoClient(uri)[db_name]
+    collection = db['benchmark_ids']
+    counters = db['mongo_engine.counters']
+    allocator = IdBlockAllocator(block_size)
+    for _ in range(count):
+        if mode == 'sequence':
+            # What SequenceField does: one findAndModify per document.
+            doc_id = allocator.reserve(counters, 'benchmark_ids.id', 1)[0]
+        else:
+            doc_id = allocator.next_id(counters, 'benchmark_ids.id')
+        collection.insert_one({'_id': doc_id, 'body': 'benchmark'})
+
+
+def benchmark_id_allocation(config, workers=4, inserts=2000, block_size=50):
+    """
+    Measures insert throughput of concurrent worker processes with per
+    document sequence ids and with block reserved ids.
+    :param config: application configuration (for MongoDB connection).
+    :param workers: number of concurrent worker processes.
+    :param inserts: number of inserts per worker.
+    :param block_size: number of ids reserved at once per worker.
+    :return results: dict of mode -> inserts per second.
+    """
+    uri, db_name = mongo_uri(config)
+    db = MongoClient(uri)[db_name]
+    results = {}
+    for mode in ('sequence', 'block'):
+        db['benchmark_ids'].drop()
+        db['mongo_engine.counters'].delete_one({'_id': 'benchmark_ids.id'})
+        processes = [multiprocessing.Process(
+            target=_insert_worker,
+            args=(uri, db_name, mode, inserts, block_size))
+            for _ in range(workers)]
+        start = time.time()
+        for p in processes:
+            p.start()
+        for p in processes:
+            p.join()
+        elapsed = time.time() - start
+        inserted = db['benchmark_ids'].count()
+        results[mode] = inserted / elapsed if elapsed else 0
+    db['benchmark_ids'].drop()
+    db['mongo_engine.counters'].delete_one({'_id': 'benchmark_ids.id'})
+    return results
+
+
+def _login_worker(args):
+    pwhash, password, count = args
+    for _ in range(count):
+        check_password_hash(pwhash, password)
+    return count
+
+
+def benchmark_password_hashing(method, salt_length=8, workers=None,
+                               logins=200):
+    """
+    Measures password checks (i.e. logins) per second with given hash
+    parameters on all cores and per core.
+    :param method: Werkzeug hash method, e.g. 'pbkdf2:sha256:50000'.
+    :param salt_length: length of the salt.
+    :param workers: number of processes (number of cores by default).
+    :param logins: number of password checks per process.
+    :return results: dict with workers, logins, total and per_core
+    (logins/sec).
+    """
+    workers = workers or multiprocessing.cpu_count()
+    pwhash = generate_password_hash('benchmark', method, salt_length)
+    pool = multiprocessing.Pool(workers)
+    try:
+        start = time.time()
+        done = sum(pool.map(_login_worker,
+                            [(pwhash, 'benchmark', logins)] * workers))
+        elapsed = time.time() - start
+    finally:
+        pool.close()
+        pool.join()
+    total = done / elapsed if elapsed else 0
+    return {'workers': workers, 'logins': done, 'total': total,
+            'per_core': total / workers}
@@ -0,0 +1,110 @@
+"""
+This module implements a small thread-safe, bounded in-process cache used
+by the application caches (tags, users, tokens, ...).
+"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class LRUCache(object):
+    """
+    Bounded least-recently-used cache with optional time-to-live for the
+    entries. Keeps hit/miss counters for monitoring.
+    """
+
+    def __init__(self, maxsize=1000, ttl=None):
+        """
+        :param maxsize: maximum number of entries kept in the cache.
+        :param ttl: lifetime of an entry in seconds (None = no expiry).
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Returns the cached value for key.
+        :param key: cache key.
+        :param default: value returned if key is missing or expired.
+        :return value: cached value or default.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and self.ttl is not None and \
+                    entry[1] < time.time():
+                del self._data[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def peek(self, key, default=None):
+        """
+        Returns the cached value for key without counting a hit or miss
+        and without marking the entry as recently used.
+        :param key: cache key.
+        :param default: value returned if key is missing or expired.
+        :return value: cached value or default.
+        """
+        with self._lock:
+            entry = self._data.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            return default
+        return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """
+        Stores a value in the cache, evicting the least recently used entry
+        if the cache is full.
+        :param key: cache key.
+        :param value: value to be cached.
+        :param ttl: lifetime of this entry, overrides the cache ttl.
+        """
+        ttl = ttl if ttl is not None else self.ttl
+        expires = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (value, expires)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        """
+        Removes an entry from the cache.
+        :param key: cache key.
+        :return value: removed value or default.
+        """
+        with self._lock:
+            entry = self._data.pop(key, None)
+        return entry[0] if entry is not None else default
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        """
+        Returns the usage statistics of the cache.
+        :return stats: dict with hits, misses, size and maxsize.
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._data),
+            'maxsize': self.maxsize,
+        }
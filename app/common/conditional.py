@@ -0,0 +1,101 @@
+"""
+Conditional GET helpers. Pages compute a weak ETag from the few fields of
+their document which change the page, and answer 304 Not Modified before
+querying the comments or rendering the template when the client still
+has that version.
+
+Besides the given parts the ETag covers the viewer and his/her
+permissions (moderation links), the query string and the CSRF token of the
+page: forms on a revalidated page carry the token of the first response,
+which belongs to the session's CSRF secret and expires after
+WTF_CSRF_TIME_LIMIT. A new session, e.g. a remember-me login after a
+browser restart, therefore gets a new ETag.
+"""
+
+import time
+import hashlib
+from flask import request, session, current_app, make_response
+from flask_login import current_user
+
+
+def _csrf_period():
+    limit = current_app.config.get('WTF_CSRF_TIME_LIMIT', 3600)
+    if not limit or not current_app.config.get('WTF_CSRF_ENABLED', True):
+        return 0
+    # A token is at least half its lifetime valid on a cached page.
+    return int(time.time() // max(limit // 2, 1))
+
+
+def page_etag(*parts):
+    """
+    Returns the weak ETag of a page.
+    :param parts: values the page depends on, e.g. id, version and
+    timestamps of its document.
+    :return etag: String (without quotes and W/ prefix).
+    """
+    viewer, permissions = '', ''
+    if current_user.is_authenticated:
+        viewer, permissions = current_user.get_id(), current_user.permissions
+    # Flask-WTF keeps the CSRF secret of the session under csrf_token.
+    csrf = hashlib.sha1(str(session.get('csrf_token', '')).encode(
+        'utf-8')).hexdigest()
+    key = '|'.join(str(part) for part in parts + (
+        viewer, permissions, request.full_path, csrf, _csrf_period()))
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def is_not_modified(etag):
+    """
+    Checks the ETag sent by the client. If-Modified-Since alone is not
+    trusted, the ETag covers changes (version, viewer, RSVPs) which do not
+    move the timestamps. Pages with pending flash messages are never
+    answered with 304, rendering them consumes the messages.
+    :param etag: ETag returned by page_etag().
+    :return: True if the client has the current version.
+    """
+    if request.method not in ('GET', 'HEAD') or session.get('_flashes'):
+        return False
+    return bool(request.if_none_match) and \
+        request.if_none_match.contains_weak(etag)
+
+
+def with_validators(response, etag, last_modified=None):
+    """
+    Adds the validators to a response, clients revalidate on every use.
+    :param response: response or return value of a view.
+    :param etag: ETag returned by page_etag().
+    :param last_modified: time the page last changed (UTC datetime).
+    :return response: Response
+    """
+    response = make_response(response)
+    response.set_etag(etag, weak=True)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def not_modified(etag, last_modified=None):
+    """
+    Returns the 304 Not Modified response of a page.
+    """
+    return with_validators(('', 304), etag, last_modified)
+
+
+def conditional_json(response):
+    """
+    after_request hook of JSON APIs: adds a weak ETag derived from the body
+    of successful GET responses and turns the response into 304 Not
+    Modified if the client sent a matching If-None-Match.
+    :param response: response of the view.
+    :return response: Response
+    """
+    if request.method not in ('GET', 'HEAD') or \
+            response.status_code != 200 or response.is_streamed or \
+            response.mimetype != 'application/json':
+        return response
+    response.add_etag(weak=True)
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
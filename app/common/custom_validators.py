@@ -16,9 +16,7 @@ def check_credential_duplication():
     message = 'Invalid username/email address.'
 
     def _validate_credential(form, field):
-        user = User.objects(email=field.data).first() or \
-              User.objects(username=field.data).first()
-        if user is None:
+        if User.find_by_login(field.data, fields=('id', 'email')) is None:
             raise ValidationError(message)
 
     return _validate_credential
@@ -33,7 +31,7 @@ def check_email_duplication():
     message = 'Email address already exists.'
 
     def _check_email_duplication(form, field):
-        if User.objects(email=field.data).first() is not None:
+        if User.find_duplicates(email=field.data)[1]:
             raise ValidationError(message)
 
     return _check_email_duplication
@@ -48,7 +46,7 @@ def check_username_duplication():
     message = 'Username is already registered.'
 
     def _check_username_duplication(form, field):
-        if User.objects(username=field.data).first() is not None:
+        if User.find_duplicates(username=field.data)[0]:
             raise ValidationError(message)
 
     return _check_username_duplication
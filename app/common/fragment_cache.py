@@ -0,0 +1,137 @@
+"""
+Cache of rendered list items (posts, activities). A fragment is keyed by
+the kind and id of the document, the version of the document and whether
+the viewer is its author, the only viewer dependent part of an item.
+Post/Activity.save() and comment counter updates increment the version,
+so a changed document is never served from an old fragment.
+
+Fragments are kept in a bounded in-process LRU cache and, with
+FRAGMENT_CACHE_DIR set, in a directory shared by the worker processes.
+FRAGMENT_CACHE_TTL bounds how long a fragment is served, e.g. after the
+author changed the username.
+"""
+
+import os
+import glob
+import time
+import threading
+import tempfile
+from app.common.caching import LRUCache
+
+
+class FragmentCache(object):
+    """
+    Two level cache of rendered html fragments. The memory cache holds one
+    entry per document, mapping (version, viewer is author) to the html, so
+    dropping a document or evicting it needs no index of its keys.
+    """
+
+    def __init__(self, maxsize=5000, ttl=300, directory=None):
+        """
+        :param maxsize: number of documents kept in memory (0 disables the
+        cache).
+        :param ttl: lifetime of a fragment in seconds.
+        :param directory: directory of the shared fragment files (None for
+        memory only).
+        """
+        self.cache = LRUCache(maxsize, ttl)
+        self.directory = directory
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configures the cache from FRAGMENT_CACHE_SIZE, FRAGMENT_CACHE_TTL
+        and FRAGMENT_CACHE_DIR.
+        :param app: Flask application.
+        """
+        self.cache.maxsize = app.config.get('FRAGMENT_CACHE_SIZE',
+                                            self.cache.maxsize)
+        self.cache.ttl = app.config.get('FRAGMENT_CACHE_TTL', self.cache.ttl)
+        self.directory = app.config.get('FRAGMENT_CACHE_DIR', self.directory)
+
+    @property
+    def enabled(self):
+        return self.cache.maxsize > 0
+
+    @staticmethod
+    def key(kind, doc_id, version, viewer_is_author):
+        return kind, doc_id, version or 0, bool(viewer_is_author)
+
+    def _path(self, key):
+        kind, doc_id, version, viewer_is_author = key
+        return os.path.join(self.directory, kind, '{0}-{1}-{2}.html'.format(
+            doc_id, version, int(viewer_is_author)))
+
+    def get(self, key):
+        """
+        Returns a cached fragment.
+        :param key: key returned by key().
+        :return html: String or None.
+        """
+        variants = self.cache.get(key[:2])
+        html = variants.get(key[2:]) if variants else None
+        if html is not None or not self.directory:
+            return html
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.cache.ttl:
+                return None
+            with open(path, encoding='utf-8') as f:
+                html = f.read()
+        except (IOError, OSError):
+            return None
+        self._remember(key, html)
+        return html
+
+    def set(self, key, html):
+        """
+        Caches a rendered fragment.
+        :param key: key returned by key().
+        :param html: rendered fragment.
+        """
+        self._remember(key, html)
+        if not self.directory:
+            return
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(html)
+            os.replace(tmp, path)
+        except (IOError, OSError):
+            pass
+
+    def _remember(self, key, html):
+        doc, variant = key[:2], key[2:]
+        with self._lock:
+            # Fragments of older versions are never served again.
+            variants = dict((v, h) for v, h in
+                            (self.cache.peek(doc) or {}).items()
+                            if v[0] >= variant[0])
+            variants[variant] = html
+            self.cache.set(doc, variants)
+
+    def invalidate(self, kind, doc_id):
+        """
+        Drops the fragments of a document. Not needed for correctness, the
+        version of the document is part of the key, but frees the memory
+        and files of the outdated fragments.
+        :param kind: kind of the document, e.g. 'post'.
+        :param doc_id: ID of the document.
+        """
+        self.cache.pop((kind, doc_id))
+        if self.directory:
+            pattern = os.path.join(self.directory, kind,
+                                   '{0}-*.html'.format(doc_id))
+            for path in glob.glob(pattern):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def stats(self):
+        return self.cache.stats()
+
+
+fragment_cache = FragmentCache()
@@ -0,0 +1,103 @@
+"""
+Integer id allocation for documents without a findAndModify on the shared
+counter document for every insert. Each worker process reserves a block of
+ids from the `mongo_engine.counters` document with one update and hands
+them out locally. The counters stay compatible with mongoengine's
+SequenceField, so existing integer ids and routes are unaffected.
+"""
+
+import os
+import threading
+from pymongo import ReturnDocument
+from mongoengine.fields import SequenceField
+from mongoengine.connection import get_db
+
+
+class IdBlockAllocator(object):
+    """
+    Hands out ids from blocks reserved per sequence on a counter
+    collection. Blocks are dropped after a fork, so worker processes never
+    share a block.
+    """
+
+    def __init__(self, block_size=50):
+        """
+        :param block_size: number of ids reserved per counter update.
+        """
+        self.block_size = block_size
+        self._blocks = {}
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+
+    def init_app(self, app):
+        """
+        Configures the block size from ID_BLOCK_SIZE.
+        :param app: Flask application.
+        """
+        self.block_size = app.config.get('ID_BLOCK_SIZE', self.block_size)
+
+    @staticmethod
+    def reserve(collection, sequence_id, count):
+        """
+        Reserves `count` consecutive ids with a single findAndModify.
+        :param collection: counter collection.
+        :param sequence_id: _id of the counter document e.g. 'post.id'.
+        :param count: number of ids to reserve.
+        :return (first, last): range of reserved ids (inclusive).
+        """
+        counter = collection.find_one_and_update(
+            {'_id': sequence_id}, {'$inc': {'next': count}}, upsert=True,
+            return_document=ReturnDocument.AFTER)
+        return counter['next'] - count + 1, counter['next']
+
+    def next_id(self, collection, sequence_id):
+        """
+        Returns the next id of a sequence, reserving a new block if the
+        current one is used up.
+        :param collection: counter collection.
+        :param sequence_id: _id of the counter document e.g. 'post.id'.
+        :return id: Integer
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # Forked worker, blocks belong to the parent process.
+                self._blocks.clear()
+                self._pid = os.getpid()
+            block = self._blocks.get(sequence_id)
+            if block is None or block[0] > block[1]:
+                block = list(self.reserve(collection, sequence_id,
+                                          self.block_size))
+                self._blocks[sequence_id] = block
+            value = block[0]
+            block[0] += 1
+            return value
+
+
+id_allocator = IdBlockAllocator()
+
+
+class BlockSequenceField(SequenceField):
+    """
+    SequenceField which takes its values from id blocks reserved by
+    id_allocator instead of incrementing the counter per document.
+    """
+
+    def _counter(self):
+        collection = get_db(self.db_alias)[self.collection_name]
+        sequence_id = '{0}.{1}'.format(self.get_sequence_name(), self.name)
+        return collection, sequence_id
+
+    def generate(self):
+        collection, sequence_id = self._counter()
+        return self.value_decorator(id_allocator.next_id(collection,
+                                                         sequence_id))
+
+    def reserve(self, count):
+        """
+        Reserves a block of ids for bulk inserts.
+        :param count: number of ids to reserve.
+        :return ids: list of reserved ids.
+        """
+        collection, sequence_id = self._counter()
+        first, last = id_allocator.reserve(collection, sequence_id, count)
+        return [self.value_decorator(i) for i in range(first, last + 1)]
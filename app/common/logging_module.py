@@ -1,7 +1,198 @@
 """
 This modules contains helping functionalities for setting up logging mechanism
+
+Blueprint loggers do not write to their files in the request thread. Their
+records are put on a queue and written by one background thread per
+process, which handles whatever is queued in one batch and flushes the
+files once per batch. The message and its arguments are rendered when the
+record is queued (QueueHandler.prepare()), so later changes of mutable
+arguments do not show up in the log; the writer thread only applies the
+line format. Logging calls should pass their arguments lazily, e.g.
+logger.info('User %d logged in', user.id), so suppressed levels cost no
+formatting. The loggers do not propagate to the root logger, errors are
+written to stderr by the writer thread. The level and the format (text or
+json) are configured with LOG_LEVEL and LOG_FORMAT.
 """
 
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler
+
+TEXT_FORMAT = '%(asctime)s - %(name)s %(levelname)s - %(message)s'
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Formats a record as one JSON object per line.
+    """
+
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'pid': record.process,
+        }
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class BatchedRotatingFileHandler(RotatingFileHandler):
+    """
+    RotatingFileHandler which leaves flushing to the log writer, which
+    flushes once per batch instead of once per record.
+    """
+    deferred = True
+
+    def flush(self):
+        if not self.deferred:
+            RotatingFileHandler.flush(self)
+
+    def flush_batch(self):
+        RotatingFileHandler.flush(self)
+
+    def close(self):
+        self.flush_batch()
+        RotatingFileHandler.close(self)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    Puts records of a logger on the queue of the log writer. prepare()
+    renders the message with its arguments and the traceback in the
+    calling thread, the line format is applied by the writer.
+    """
+
+    def __init__(self, writer, name):
+        QueueHandler.__init__(self, None)
+        self.writer = writer
+        self.target = name
+
+    def enqueue(self, record):
+        self.writer.put(self.target, record)
+
+
+class LogWriter(object):
+    """
+    Background thread writing queued records to the handlers of their
+    logger. The thread and its queue are created lazily in every process,
+    so forked workers get their own writer. Unlike QueueListener it takes
+    what is queued in one batch and flushes the files once per batch.
+    """
+
+    def __init__(self, batch_size=500):
+        self.batch_size = batch_size
+        self.handlers = {}          # logger name -> list of handlers
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def register(self, name, handlers):
+        self.handlers[name] = handlers
+
+    def _ensure_started(self):
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue()
+            self._thread = threading.Thread(target=self._run,
+                                            args=(self._queue,),
+                                            name='log-writer')
+            self._thread.daemon = True
+            self._thread.start()
+            self._pid = os.getpid()
+
+    def put(self, name, record):
+        self._ensure_started()
+        self._queue.put((name, record))
+
+    def _run(self, q):
+        while True:
+            item = q.get()
+            batch = [item]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+            stop = self._write(batch)
+            if stop:
+                return
+
+    def _write(self, batch):
+        used = set()
+        stop = False
+        for item in batch:
+            if item is None:
+                stop = True
+                continue
+            name, record = item
+            for handler in self.handlers.get(name, ()):
+                if record.levelno >= handler.level:
+                    handler.handle(record)
+                    used.add(handler)
+        for handler in used:
+            try:
+                if isinstance(handler, BatchedRotatingFileHandler):
+                    handler.flush_batch()
+                else:
+                    handler.flush()
+            except Exception:
+                pass
+        return stop
+
+    def stop(self, timeout=5):
+        """
+        Writes the queued records and stops the writer thread.
+        :param timeout: seconds to wait for the writer.
+        """
+        if self._pid != os.getpid() or self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._pid = None
+
+
+log_writer = LogWriter()
+atexit.register(log_writer.stop)
+
+_settings = {'level': logging.INFO, 'format': 'text'}
+_loggers = {}
+
+
+def _formatter():
+    if _settings['format'] == 'json':
+        return JsonFormatter()
+    return logging.Formatter(TEXT_FORMAT)
+
+
+def configure_logging(app):
+    """
+    Applies LOG_LEVEL, LOG_FORMAT and LOG_BATCH_SIZE to the blueprint
+    loggers, including the ones set up later.
+    :param app: Flask application.
+    """
+    level = app.config.get('LOG_LEVEL', 'INFO')
+    _settings['level'] = logging.getLevelName(level) \
+        if not isinstance(level, int) else level
+    _settings['format'] = app.config.get('LOG_FORMAT', 'text')
+    log_writer.batch_size = app.config.get('LOG_BATCH_SIZE',
+                                           log_writer.batch_size)
+    for name, logger in _loggers.items():
+        logger.setLevel(_settings['level'])
+        for handler in log_writer.handlers.get(name, ()):
+            if isinstance(handler, BatchedRotatingFileHandler):
+                handler.setFormatter(_formatter())
+
 
 def setup_logging(name, filename, max_file_size, backup_files):
     """
@@ -12,32 +203,31 @@ def setup_logging(name, filename, max_file_size, backup_files):
     :param backup_files: number of backup files.
     :return:
     """
-    import os
-    import logging
-    from logging.handlers import RotatingFileHandler
-
     logger = logging.getLogger(name)
-    logger.setLevel(logging.INFO)
-
-    log_format = logging.Formatter('%(asctime)s - %(name)s '
-                                   '%(levelname)s - %(message)s')
+    logger.setLevel(_settings['level'])
+    if name in _loggers:
+        # Already set up, e.g. by an earlier create_app().
+        return logger
 
     if not os.path.exists(path=filename):
         super_make_dirs('/'.join(filename.split('/')[:-1]), 775)
 
-    log_fh = RotatingFileHandler(filename,
-                                 maxBytes=max_file_size,
-                                 backupCount=backup_files)
-    log_fh.setLevel(logging.INFO)
-    log_fh.setFormatter(log_format)
+    log_fh = BatchedRotatingFileHandler(filename,
+                                        maxBytes=max_file_size,
+                                        backupCount=backup_files)
+    log_fh.setFormatter(_formatter())
 
     # Set up stream handler for important logs
     log_stream = logging.StreamHandler()
     log_stream.setLevel(logging.ERROR)
 
-    # Add handlers
-    logger.addHandler(log_fh)
-    logger.addHandler(log_stream)
+    # Add handlers, the records are written by the log writer thread.
+    log_writer.register(name, [log_fh, log_stream])
+    logger.addHandler(_QueueHandler(log_writer, name))
+    # The root handlers (logging.basicConfig() in manage.py) would format
+    # and write the record again in the request thread.
+    logger.propagate = False
+    _loggers[name] = logger
 
     return logger
 
@@ -49,7 +239,6 @@ def super_make_dirs(path, mode):
     :param mode: permissions for the directory
     :return:
     """
-    import os
     if not path or os.path.exists(path):
         return []
     (head, tail) = os.path.split(path)
@@ -0,0 +1,275 @@
+"""
+In-process request metrics. For every request the wall time, the number of
+MongoDB commands and the time spent in them (pymongo command monitoring)
+and the template render time are recorded in histograms per endpoint. The
+histograms are exposed in Prometheus text format on /metrics, which only
+answers clients in METRICS_ALLOWED_IPS or sending METRICS_TOKEN as bearer
+token.
+
+Metrics are kept per process, every worker has to be scraped separately.
+"""
+
+import time
+import hmac
+import threading
+from flask import request
+
+try:
+    from pymongo import monitoring
+except ImportError:         # pragma: no cover
+    monitoring = None
+
+try:
+    from flask import before_render_template, template_rendered, \
+        signals_available
+except ImportError:         # pragma: no cover
+    signals_available = False
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+        .replace('\n', '\\n')
+
+
+def _labels(pairs):
+    if not pairs:
+        return ''
+    return '{' + ','.join('{0}="{1}"'.format(k, _escape(v))
+                          for k, v in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class Histogram(object):
+    """
+    Cumulative histogram with one series per label value.
+    """
+
+    def __init__(self, name, description, label, buckets):
+        self.name = name
+        self.description = description
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.series = {}            # label value -> [counts, sum, count]
+        self._lock = threading.Lock()
+
+    def observe(self, label_value, value):
+        with self._lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = [[0] * len(self.buckets), 0, 0]
+                self.series[label_value] = series
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def reset(self):
+        with self._lock:
+            self.series.clear()
+
+    def render(self):
+        """
+        Returns the histogram in Prometheus text format.
+        :return lines: list of String.
+        """
+        lines = ['# HELP {0} {1}'.format(self.name, self.description),
+                 '# TYPE {0} histogram'.format(self.name)]
+        with self._lock:
+            series = sorted((k, (list(v[0]), v[1], v[2]))
+                            for k, v in self.series.items())
+        for label_value, (counts, total, count) in series:
+            pairs = [(self.label, label_value)]
+            for bound, bucket_count in zip(self.buckets, counts):
+                lines.append('{0}_bucket{1} {2}'.format(
+                    self.name, _labels(pairs + [('le', _number(bound))]),
+                    bucket_count))
+            lines.append('{0}_bucket{1} {2}'.format(
+                self.name, _labels(pairs + [('le', '+Inf')]), count))
+            lines.append('{0}_sum{1} {2}'.format(self.name, _labels(pairs),
+                                                 _number(total)))
+            lines.append('{0}_count{1} {2}'.format(self.name, _labels(pairs),
+                                                   count))
+        return lines
+
+
+def render_gauge(name, description, samples, kind='gauge'):
+    """
+    Returns a gauge in Prometheus text format.
+    :param name: metric name.
+    :param description: help text.
+    :param samples: list of (label pairs, value).
+    :param kind: metric type, 'counter' for monotonic values.
+    :return lines: list of String.
+    """
+    lines = ['# HELP {0} {1}'.format(name, description),
+             '# TYPE {0} {1}'.format(name, kind)]
+    for pairs, value in samples:
+        lines.append('{0}{1} {2}'.format(name, _labels(pairs),
+                                         _number(value)))
+    return lines
+
+
+if monitoring is not None:
+    class _CommandListener(monitoring.CommandListener):
+        """
+        Adds the duration of every MongoDB command to the request issuing
+        it. pymongo calls the listener in the thread running the command.
+        """
+
+        def __init__(self, metrics):
+            self.metrics = metrics
+
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            self.metrics.record_command(event.command_name,
+                                        event.duration_micros)
+
+        def failed(self, event):
+            self.metrics.record_command(event.command_name,
+                                        event.duration_micros)
+
+
+class RequestMetrics(object):
+    """
+    Collects the request metrics of the application.
+    """
+
+    def __init__(self):
+        self.enabled = True
+        self.request_seconds = Histogram(
+            'http_request_duration_seconds',
+            'Wall time of requests per endpoint.', 'endpoint',
+            SECONDS_BUCKETS)
+        self.mongo_commands = Histogram(
+            'http_request_mongodb_commands',
+            'MongoDB commands issued per request.', 'endpoint',
+            COUNT_BUCKETS)
+        self.mongo_seconds = Histogram(
+            'http_request_mongodb_seconds',
+            'Time spent in MongoDB commands per request.', 'endpoint',
+            SECONDS_BUCKETS)
+        self.template_seconds = Histogram(
+            'http_request_template_seconds',
+            'Template render time per request.', 'endpoint',
+            SECONDS_BUCKETS)
+        self.command_seconds = Histogram(
+            'mongodb_command_duration_seconds',
+            'Duration of MongoDB commands per command name.', 'command',
+            SECONDS_BUCKETS)
+        self.allowed_ips = ()
+        self.token = None
+        self._local = threading.local()
+        self._listener = None
+
+    def init_app(self, app):
+        """
+        Registers the request hooks and the MongoDB command listener. Has to
+        be called before the database connection is created, pymongo only
+        notifies listeners registered before the client was created.
+        :param app: Flask application.
+        """
+        self.enabled = app.config.get('METRICS_ENABLED', self.enabled)
+        self.allowed_ips = app.config.get('METRICS_ALLOWED_IPS', ())
+        self.token = app.config.get('METRICS_TOKEN')
+        if not self.enabled:
+            return
+        if self._listener is None and monitoring is not None:
+            self._listener = _CommandListener(self)
+            monitoring.register(self._listener)
+        app.before_request(self._before_request)
+        app.teardown_request(self._teardown_request)
+        if signals_available:
+            before_render_template.connect(self._before_render, app,
+                                           weak=False)
+            template_rendered.connect(self._after_render, app, weak=False)
+
+    def allowed(self):
+        """
+        Checks whether the current request may read the metrics.
+        :return: True for allowed addresses and the metrics token.
+        """
+        if not self.enabled:
+            return False
+        if request.remote_addr in self.allowed_ips:
+            return True
+        auth = request.headers.get('Authorization', '')
+        return bool(self.token) and auth.startswith('Bearer ') and \
+            hmac.compare_digest(auth[7:].strip().encode('utf-8'),
+                                self.token.encode('utf-8'))
+
+    def _current(self):
+        return getattr(self._local, 'current', None)
+
+    def _before_request(self):
+        self._local.current = {'start': time.time(), 'commands': 0,
+                               'mongo': 0.0, 'template': 0.0,
+                               'renders': []}
+
+    def _teardown_request(self, exc=None):
+        current = self._current()
+        if current is None:
+            return
+        self._local.current = None
+        endpoint = request.endpoint or 'unknown'
+        self.request_seconds.observe(endpoint, time.time() - current['start'])
+        self.mongo_commands.observe(endpoint, current['commands'])
+        self.mongo_seconds.observe(endpoint, current['mongo'])
+        self.template_seconds.observe(endpoint, current['template'])
+
+    def _before_render(self, sender, template=None, context=None, **extra):
+        current = self._current()
+        if current is not None:
+            current['renders'].append(time.time())
+
+    def _after_render(self, sender, template=None, context=None, **extra):
+        current = self._current()
+        if current is not None and current['renders']:
+            started = current['renders'].pop()
+            if not current['renders']:
+                # Templates rendered from a template are counted once.
+                current['template'] += time.time() - started
+
+    def record_command(self, command_name, duration_micros):
+        """
+        Records a MongoDB command, called by the command listener.
+        :param command_name: name of the command, e.g. 'find'.
+        :param duration_micros: duration of the command.
+        """
+        seconds = duration_micros / 1000000.0
+        self.command_seconds.observe(command_name, seconds)
+        current = self._current()
+        if current is not None:
+            current['commands'] += 1
+            current['mongo'] += seconds
+
+    def render(self, extra=None):
+        """
+        Returns all metrics in Prometheus text format.
+        :param extra: additional lines, e.g. from render_gauge().
+        :return text: String
+        """
+        lines = []
+        for histogram in (self.request_seconds, self.mongo_commands,
+                          self.mongo_seconds, self.template_seconds,
+                          self.command_seconds):
+            lines.extend(histogram.render())
+        lines.extend(extra or [])
+        return '\n'.join(lines) + '\n'
+
+
+request_metrics = RequestMetrics()
@@ -0,0 +1,110 @@
+"""
+This module implements keyset (cursor) pagination for feeds ordered by
+timestamp. Instead of skip()/limit() plus a count(), every page is fetched
+with a range query on (timestamp, id) starting at a continuation token, so
+page N costs the same as page 1.
+"""
+
+from datetime import datetime
+from flask import current_app, request
+from mongoengine.queryset.visitor import Q
+
+CURSOR_TIME_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def encode_cursor(document):
+    """
+    Generates a continuation token for a document.
+    :param document: document with timestamp and id fields.
+    :return token: String e.g. 20170611100000123000_42
+    """
+    return '{0}_{1}'.format(document.timestamp.strftime(CURSOR_TIME_FORMAT),
+                            document.id)
+
+
+def decode_cursor(token):
+    """
+    Extracts (timestamp, id) from a continuation token.
+    :param token: continuation token generated by encode_cursor.
+    :return (timestamp, id): tuple or None if token is invalid.
+    """
+    try:
+        timestamp, doc_id = token.split('_', 1)
+        return datetime.strptime(timestamp, CURSOR_TIME_FORMAT), int(doc_id)
+    except (AttributeError, ValueError):
+        return None
+
+
+class KeysetPagination(object):
+    """
+    Newer/older pagination over a queryset using (timestamp, id)
+    continuation tokens. Any ordering of the queryset is replaced by
+    (timestamp, id).
+    """
+    keyset = True
+
+    def __init__(self, queryset, per_page, after=None, before=None):
+        """
+        :param queryset: filtered queryset of the feed.
+        :param per_page: number of items per page.
+        :param after: token of the last item seen, fetch older items.
+        :param before: token of the first item seen, fetch newer items.
+        """
+        self.per_page = per_page
+        after = decode_cursor(after) if after else None
+        before = decode_cursor(before) if before else None
+
+        if before is not None:
+            timestamp, doc_id = before
+            qs = queryset.filter(
+                Q(timestamp__gte=timestamp) &
+                (Q(timestamp__gt=timestamp) | Q(id__gt=doc_id)))\
+                .order_by('+timestamp', '+id')
+            items = list(qs.limit(per_page + 1))
+            self.has_prev = len(items) > per_page
+            self.has_next = True
+            self.items = list(reversed(items[:per_page]))
+        else:
+            qs = queryset
+            if after is not None:
+                timestamp, doc_id = after
+                qs = qs.filter(
+                    Q(timestamp__lte=timestamp) &
+                    (Q(timestamp__lt=timestamp) | Q(id__lt=doc_id)))
+            items = list(qs.order_by('-timestamp', '-id').limit(per_page + 1))
+            self.has_prev = after is not None
+            self.has_next = len(items) > per_page
+            self.items = items[:per_page]
+
+        self.prev_cursor = encode_cursor(self.items[0]) \
+            if self.items else None
+        self.next_cursor = encode_cursor(self.items[-1]) \
+            if self.items else None
+
+
+def use_keyset():
+    """
+    Checks whether the current request is paginated with continuation
+    tokens, i.e. CURSOR_PAGINATION is enabled or a token is provided.
+    :return: True if keyset pagination is used.
+    """
+    return bool(current_app.config.get('CURSOR_PAGINATION') or
+                request.args.get('after') or request.args.get('before'))
+
+
+def paginate(queryset, per_page, page=None):
+    """
+    Paginates a feed queryset with continuation tokens if use_keyset(),
+    page based pagination otherwise.
+    :param queryset: queryset of the feed ordered by '-timestamp'.
+    :param per_page: number of items per page.
+    :param page: page number, taken from the request if not provided.
+    :return pagination: KeysetPagination or flask_mongoengine Pagination.
+    """
+    if use_keyset():
+        return KeysetPagination(queryset, per_page,
+                                after=request.args.get('after'),
+                                before=request.args.get('before'))
+    if page is None:
+        page = request.args.get('page', 1, type=int)
+    return queryset.paginate(page, per_page=per_page, error_out=False)
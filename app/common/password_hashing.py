@@ -0,0 +1,112 @@
+"""
+Password hashing with configurable method and cost. Hashes are computed
+with Werkzeug using PASSWORD_HASH_METHOD (e.g. 'pbkdf2:sha256:50000') and
+PASSWORD_SALT_LENGTH. With PASSWORD_HASH_POOL_SIZE > 0 the key derivation
+runs in a bounded pool of worker processes, the request thread only waits
+for the result, so other threads of the worker keep serving pages.
+"""
+
+import os
+import logging
+import threading
+from flask import current_app
+from werkzeug.security import generate_password_hash, check_password_hash
+
+try:
+    from concurrent.futures import ProcessPoolExecutor
+except ImportError:         # pragma: no cover
+    ProcessPoolExecutor = None
+
+_pool = None
+_pool_pid = None
+_pool_slots = None
+_pool_lock = threading.Lock()
+_prefixes = {}
+
+
+def _settings():
+    config = current_app.config
+    return (config.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256'),
+            config.get('PASSWORD_SALT_LENGTH', 8),
+            config.get('PASSWORD_HASH_POOL_SIZE', 0))
+
+
+def _get_pool(size):
+    """
+    Returns the hashing pool of this process, pools are not shared with
+    forked worker processes.
+    :param size: number of hashing processes.
+    :return (pool, slots): executor and semaphore bounding queued jobs.
+    """
+    global _pool, _pool_pid, _pool_slots
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=size)
+            _pool_pid = os.getpid()
+            # At most two jobs per process are queued, further logins wait.
+            _pool_slots = threading.BoundedSemaphore(size * 2)
+        return _pool, _pool_slots
+
+
+def _run(func, *args):
+    """
+    Runs func(*args) in the hashing pool if enabled, inline otherwise.
+    """
+    global _pool
+    size = _settings()[2]
+    if not size or ProcessPoolExecutor is None:
+        return func(*args)
+    pool, slots = _get_pool(size)
+    with slots:
+        try:
+            return pool.submit(func, *args).result()
+        except Exception as el1:
+            logging.error('Password hashing pool failed, hashing inline. '
+                          'Error={0}'.format(el1))
+            with _pool_lock:
+                if _pool is pool:
+                    pool.shutdown(wait=False)
+                    _pool = None
+            return func(*args)
+
+
+def hash_password(password):
+    """
+    Generates the hash of a password with the configured method.
+    :param password: plain text password.
+    :return pwhash: String
+    """
+    method, salt_length, _ = _settings()
+    return _run(generate_password_hash, password, method, salt_length)
+
+
+def check_password(pwhash, password):
+    """
+    Checks a password against a stored hash.
+    :param pwhash: stored password hash.
+    :param password: plain text password.
+    :return: True if the password matches.
+    """
+    if not pwhash:
+        return False
+    return _run(check_password_hash, pwhash, password)
+
+
+def needs_rehash(pwhash):
+    """
+    Checks whether a hash was generated with other parameters than the
+    configured ones.
+    :param pwhash: stored password hash.
+    :return: True if the password should be hashed again.
+    """
+    if not pwhash or pwhash.count('$') < 2:
+        return True
+    method, salt_length, _ = _settings()
+    prefix = _prefixes.get(method)
+    if prefix is None:
+        # Werkzeug adds the default cost to the method, e.g. pbkdf2:sha256
+        # is stored as pbkdf2:sha256:50000.
+        prefix = generate_password_hash('', method, 1).split('$', 1)[0]
+        _prefixes[method] = prefix
+    stored_prefix, salt, _ = pwhash.split('$', 2)
+    return stored_prefix != prefix or len(salt) != salt_length
@@ -0,0 +1,43 @@
+"""
+Process local cache of the users loaded by Flask-Login for every
+authenticated request. Only a slim snapshot of the user (without the
+relation lists) is cached, every request gets its own User object built
+from the snapshot. Entries are dropped by User.save() in this process and
+expire after USER_CACHE_TTL seconds, which bounds how long other processes
+serve a stale snapshot.
+"""
+
+from app.common.caching import LRUCache
+
+
+class PrincipalCache(object):
+    """
+    Bounded TTL cache user id -> user snapshot (dict).
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.cache = LRUCache(maxsize, ttl)
+
+    def init_app(self, app):
+        """
+        Configures the cache from USER_CACHE_SIZE and USER_CACHE_TTL.
+        :param app: Flask application.
+        """
+        self.cache.maxsize = app.config.get('USER_CACHE_SIZE',
+                                            self.cache.maxsize)
+        self.cache.ttl = app.config.get('USER_CACHE_TTL', self.cache.ttl)
+
+    def get(self, user_id):
+        return self.cache.get(user_id)
+
+    def set(self, user_id, son):
+        self.cache.set(user_id, son)
+
+    def invalidate(self, user_id):
+        self.cache.pop(user_id)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+principal_cache = PrincipalCache()
@@ -0,0 +1,294 @@
+"""
+Bulk data generator for load testing the feeds. Documents are generated as
+raw dicts from precomputed text pools and written with insert_many, ids are
+reserved per batch and friendships are added with bulk $addToSet updates.
+Contents and timestamps (offsets from BASE_TIME) only depend on the seed.
+Ids, and the usernames and emails derived from them, are taken from the
+counters collection, so they differ between databases and runs.
+"""
+
+import time
+import random
+import hashlib
+import logging
+import forgery_py
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from app.common.password_hashing import hash_password
+
+# Number of distinct texts generated per pool.
+POOL_SIZE = 500
+# Documents are dated in the days before this time.
+BASE_TIME = datetime(2017, 1, 1)
+
+
+class _Pools(object):
+    """
+    Precomputed texts, forgery_py is far too slow to be called per document.
+    """
+
+    def __init__(self, rnd):
+        self.words = [forgery_py.lorem_ipsum.word() for _ in range(POOL_SIZE)]
+        self.sentences = [forgery_py.lorem_ipsum.sentence()
+                          for _ in range(POOL_SIZE)]
+        self.paragraphs = [forgery_py.lorem_ipsum.sentences(quantity=3)
+                           for _ in range(POOL_SIZE)]
+        self.first_names = [forgery_py.name.first_name()
+                            for _ in range(POOL_SIZE)]
+        self.last_names = [forgery_py.name.last_name()
+                           for _ in range(POOL_SIZE)]
+        self.streets = [forgery_py.address.street_address()
+                        for _ in range(POOL_SIZE)]
+        self.cities = [forgery_py.address.city() for _ in range(POOL_SIZE)]
+        self.countries = [forgery_py.address.country()
+                          for _ in range(POOL_SIZE)]
+        self.rnd = rnd
+
+    def pick(self, pool):
+        return pool[self.rnd.randrange(len(pool))]
+
+
+class Seeder(object):
+    """
+    Generates users, friendships, tags, posts, activities, diaries and
+    comments.
+    """
+
+    def __init__(self, seed=0, batch_size=1000, days=90, now=None):
+        """
+        :param seed: seed of the random generator.
+        :param batch_size: number of documents per insert_many.
+        :param days: documents are spread over this many past days.
+        :param now: time the documents are dated back from (BASE_TIME if
+        None).
+        """
+        # forgery_py uses the global generator.
+        random.seed(seed)
+        self.rnd = random.Random(seed)
+        self.pools = _Pools(self.rnd)
+        self.batch_size = batch_size
+        self.now = now or BASE_TIME
+        self.seconds = days * 24 * 3600
+        self.seed = seed
+        self.user_ids = []
+        self.tag_ids = []
+        self.post_ids = []
+        self.activity_ids = []
+
+    def _timestamp(self):
+        return self.now - timedelta(seconds=self.rnd.randrange(self.seconds))
+
+    def _sample(self, ids, low, high):
+        if not ids:
+            return []
+        return [ids[self.rnd.randrange(len(ids))]
+                for _ in range(self.rnd.randint(low, high))]
+
+    def _insert(self, model, count, make):
+        """
+        Inserts `count` documents built by make(id) in batches.
+        :return ids: ids of the inserted documents.
+        """
+        collection = model._get_collection()
+        ids = []
+        while len(ids) < count:
+            n = min(self.batch_size, count - len(ids))
+            batch_ids = model._fields['id'].reserve(n)
+            collection.insert_many([make(i) for i in batch_ids],
+                                   ordered=False)
+            ids.extend(batch_ids)
+        return ids
+
+    def users(self, count, password='password'):
+        from app.models import User, Permission
+        # Hashing is the slowest step of creating a user, all seeded users
+        # share one hash.
+        password_hash = hash_password(password)
+        p = self.pools
+
+        def make(user_id):
+            first, last = p.pick(p.first_names), p.pick(p.last_names)
+            email = 'seed{0}.{1}@example.com'.format(self.seed, user_id)
+            return {
+                '_id': user_id,
+                'username': 'seed{0}_{1}'.format(self.seed, user_id),
+                'email': email,
+                'password_hash': password_hash,
+                'confirmed': True,
+                'avatar_hash': hashlib.md5(email.encode('utf-8')).hexdigest(),
+                'permissions': Permission.PERM_STUDENT,
+                'role': self.rnd.randint(0, 3),
+                'first_name': first,
+                'last_name': last,
+                'address': {'street': p.pick(p.streets),
+                            'city': p.pick(p.cities),
+                            'country': p.pick(p.countries)},
+                'joined': self._timestamp(),
+                'parents': [], 'friends': [], 'teachers': [], 'kids': [],
+            }
+        self.user_ids = self._insert(User, count, make)
+        return len(self.user_ids)
+
+    def friendships(self, per_user):
+        """
+        Adds about `per_user` random friends to every seeded user, both
+        directions of a friendship are added with $addToSet.
+        :return count: number of friendships.
+        """
+        from app.models import User
+        collection = User._get_collection()
+        ids = self.user_ids
+        if len(ids) < 2:
+            return 0
+        count = 0
+        for start in range(0, len(ids), self.batch_size):
+            edges = {}
+            for user_id in ids[start:start + self.batch_size]:
+                for friend_id in self._sample(ids, per_user // 2,
+                                              per_user // 2):
+                    if friend_id == user_id:
+                        continue
+                    edges.setdefault(user_id, set()).add(friend_id)
+                    edges.setdefault(friend_id, set()).add(user_id)
+                    count += 1
+            if not edges:
+                continue
+            collection.bulk_write(
+                [UpdateOne({'_id': user_id},
+                           {'$addToSet': {'friends': {'$each':
+                                                      sorted(friends)}}})
+                 for user_id, friends in sorted(edges.items())],
+                ordered=False)
+        return count
+
+    def tags(self, count):
+        from app.models import Tag
+        p = self.pools
+
+        def make(tag_id):
+            return {'_id': tag_id, 'text': '{0}{1}'.format(p.pick(p.words),
+                                                           tag_id)}
+        self.tag_ids = self._insert(Tag, count, make)
+        return len(self.tag_ids)
+
+    def posts(self, count):
+        from app.models import Post
+        p = self.pools
+
+        def make(post_id):
+            return {'_id': post_id,
+                    'body': p.pick(p.paragraphs),
+                    'timestamp': self._timestamp(),
+                    'author_id': self.pick_user(),
+                    'comments': [], 'comment_count': 0,
+                    'tags': self._sample(self.tag_ids, 1, 5)}
+        self.post_ids = self._insert(Post, count, make)
+        return len(self.post_ids)
+
+    def activities(self, count):
+        from app.models import Activity
+        p = self.pools
+
+        def make(activity_id):
+            timestamp = self._timestamp()
+            going = set(self._sample(self.user_ids, 0, 5))
+            return {'_id': activity_id,
+                    'title': p.pick(p.sentences),
+                    'description': p.pick(p.paragraphs),
+                    'author_id': self.pick_user(),
+                    'timestamp': timestamp,
+                    'activity_time': timestamp + timedelta(
+                        days=self.rnd.randint(1, 7)),
+                    'tags': self._sample(self.tag_ids, 1, 5),
+                    'interested': sorted(
+                        set(self._sample(self.user_ids, 0, 7)) - going),
+                    'going': sorted(going),
+                    'comments': [], 'comment_count': 0}
+        self.activity_ids = self._insert(Activity, count, make)
+        return len(self.activity_ids)
+
+    def diaries(self, count):
+        from app.models import Diary
+        p = self.pools
+
+        def make(diary_id):
+            return {'_id': diary_id,
+                    'title': p.pick(p.sentences),
+                    'description': p.pick(p.paragraphs),
+                    'timestamp': self._timestamp(),
+                    'author_id': self.pick_user(),
+                    'tags': self._sample(self.tag_ids, 1, 3),
+                    's_activity': self._sample(p.words, 1, 3),
+                    's_time': float(self.rnd.randint(1, 6)),
+                    'o_activity': self._sample(p.words, 1, 3),
+                    'o_time': float(self.rnd.randint(1, 6))}
+        return len(self._insert(Diary, count, make))
+
+    def comments(self, count):
+        from flask import current_app
+        from app.models import Comment
+        c_types = current_app.config['COMMENT_TYPE']
+        parents = [(c_types['POST'], self.post_ids),
+                   (c_types['ACTIVITY'], self.activity_ids)]
+        parents = [(c_type, ids) for c_type, ids in parents if ids]
+        if not parents:
+            return 0
+        p = self.pools
+
+        def make(comment_id):
+            c_type, ids = parents[self.rnd.randrange(len(parents))]
+            return {'_id': comment_id,
+                    'body': p.pick(p.sentences),
+                    'timestamp': self._timestamp(),
+                    'commenter_id': self.pick_user(),
+                    'post_id': ids[self.rnd.randrange(len(ids))],
+                    'disabled': False,
+                    'c_type': c_type}
+        return len(self._insert(Comment, count, make))
+
+    def pick_user(self):
+        return self.user_ids[self.rnd.randrange(len(self.user_ids))] \
+            if self.user_ids else 0
+
+
+def seed(users=1000, friends=20, tags=200, posts=10000, activities=1000,
+         diaries=1000, comments=20000, seed_value=0, batch_size=1000,
+         timelines=True):
+    """
+    Generates a data set and rebuilds the derived data (comment counters,
+    home timelines).
+    :param users: number of users.
+    :param friends: average number of friends per user.
+    :param tags: number of tags.
+    :param posts: number of posts.
+    :param activities: number of activities.
+    :param diaries: number of diaries.
+    :param comments: number of comments (on posts and activities).
+    :param seed_value: seed of the random generator.
+    :param batch_size: number of documents per insert.
+    :param timelines: rebuild the home timelines of the seeded users.
+    :return counts: dict of collection -> (documents, seconds).
+    """
+    from app.models import Comment, Timeline
+    seeder = Seeder(seed_value, batch_size)
+    counts = {}
+    for name, step, count in (
+            ('users', seeder.users, users),
+            ('friendships', seeder.friendships, friends),
+            ('tags', seeder.tags, tags),
+            ('posts', seeder.posts, posts),
+            ('activities', seeder.activities, activities),
+            ('diaries', seeder.diaries, diaries),
+            ('comments', seeder.comments, comments)):
+        start = time.time()
+        created = step(count)
+        counts[name] = (created, time.time() - start)
+        logging.info('Seeded {0} {1} in {2:.1f} sec.'.format(
+            created, name, counts[name][1]))
+    start = time.time()
+    Comment.rebuild_comment_counts()
+    if timelines:
+        Timeline.rebuild(seeder.user_ids, batch_size=batch_size,
+                         mark_celebrities=True)
+    counts['derived'] = (len(seeder.user_ids), time.time() - start)
+    return counts
@@ -0,0 +1,174 @@
+"""
+Serializers converting Post, Activity, Diary and Comment documents to plain
+dicts for the JSON endpoints. Lists are serialized with a fixed number of
+queries: one for all authors/users, two for the comments and at most one
+for tags missing from the tag cache, independent of the number of items.
+Only the latest COMMENTS_PER_PAGE comments of a post/activity are embedded,
+the others are reached through comments_url.
+"""
+
+from flask import current_app, url_for, has_request_context
+from app.common.user_resolver import prefetch_users, resolve_user
+from app.common.tag_cache import tag_cache
+
+
+def _isoformat(value):
+    return value.isoformat() if value is not None else None
+
+
+def _username(user_id):
+    user = resolve_user(user_id)
+    return user.username if user is not None else ''
+
+
+def _tag_map(documents):
+    return tag_cache.get_map([i for d in documents for i in d.tags or []])
+
+
+def _comments_url(endpoint, **values):
+    if not has_request_context():
+        return None
+    return url_for(endpoint, _anchor='comments', **values)
+
+
+def _comments_of(c_type, documents):
+    """
+    Loads the latest COMMENTS_PER_PAGE enabled comments of given documents,
+    the ids are selected by one aggregation and loaded with one query.
+    :param c_type: comment type of the documents.
+    :param documents: list of posts or activities.
+    :return comments: dict of document id -> list of comments, oldest
+    first.
+    """
+    from app.models import Comment
+    comments = {d.id: [] for d in documents}
+    if not comments:
+        return comments
+    pipeline = [
+        {'$match': {'c_type': c_type, 'post_id': {'$in': list(comments)},
+                    'disabled': {'$ne': True}}},
+        {'$sort': {'post_id': 1, 'timestamp': -1}},
+        {'$group': {'_id': '$post_id', 'ids': {'$push': '$_id'}}},
+        {'$project': {'ids': {'$slice': [
+            '$ids', current_app.config['COMMENTS_PER_PAGE']]}}},
+    ]
+    ids = [i for row in Comment.objects.aggregate(*pipeline)
+           for i in row['ids']]
+    if ids:
+        for c in Comment.objects(id__in=ids).order_by('timestamp'):
+            comments[c.post_id].append(c)
+    return comments
+
+
+def serialize_comments(comments):
+    """
+    Serializes a list of comments.
+    :param comments: list of Comment objects.
+    :return comments: list of dicts.
+    """
+    prefetch_users(c.commenter_id for c in comments)
+    return [{
+        "id": c.id,
+        "body": c.body,
+        "timestamp": _isoformat(c.timestamp),
+        "commenter_id": c.commenter_id,
+        "commenter": _username(c.commenter_id),
+        "post_id": c.post_id,
+    } for c in comments]
+
+
+def serialize_posts(posts, with_comments=True):
+    """
+    Serializes a list of posts with their authors, tags and comments.
+    :param posts: list of Post objects.
+    :param with_comments: include the comments of the posts.
+    :return posts: list of dicts.
+    """
+    posts = list(posts)
+    comments = _comments_of(current_app.config['COMMENT_TYPE']['POST'],
+                            posts) if with_comments else {}
+    prefetch_users([p.author_id for p in posts] +
+                   [c.commenter_id for cl in comments.values() for c in cl])
+    tags = _tag_map(posts)
+    result = []
+    for p in posts:
+        item = {
+            "id": p.id,
+            "body": p.body,
+            "timestamp": _isoformat(p.timestamp),
+            "author": _username(p.author_id),
+            "author_id": p.author_id,
+            "comment_count": p.comment_count,
+            "tags": [tags[i] for i in p.tags or [] if i in tags],
+        }
+        if with_comments:
+            item["comments"] = serialize_comments(comments[p.id])
+            item["comments_url"] = _comments_url('post_app.post_page',
+                                                 id=p.id)
+        result.append(item)
+    return result
+
+
+def serialize_activities(activities, with_comments=True):
+    """
+    Serializes a list of activities with their authors, participants, tags
+    and comments.
+    :param activities: list of Activity objects.
+    :param with_comments: include the comments of the activities.
+    :return activities: list of dicts.
+    """
+    activities = list(activities)
+    comments = _comments_of(current_app.config['COMMENT_TYPE']['ACTIVITY'],
+                            activities) if with_comments else {}
+    user_ids = [c.commenter_id for cl in comments.values() for c in cl]
+    for a in activities:
+        user_ids.append(a.author_id)
+        user_ids.extend(a.interested or [])
+        user_ids.extend(a.going or [])
+    prefetch_users(user_ids)
+    tags = _tag_map(activities)
+    result = []
+    for a in activities:
+        item = {
+            "id": a.id,
+            "title": a.title,
+            "description": a.description,
+            "timestamp": _isoformat(a.timestamp),
+            "activity_time": _isoformat(a.activity_time),
+            "author": _username(a.author_id),
+            "author_id": a.author_id,
+            "comment_count": a.comment_count,
+            "tags": [tags[i] for i in a.tags or [] if i in tags],
+            "interested": [_username(i) for i in a.interested or []],
+            "going": [_username(i) for i in a.going or []],
+        }
+        if with_comments:
+            item["comments"] = serialize_comments(comments[a.id])
+            item["comments_url"] = _comments_url(
+                'activity_app.activity_page', a_id=a.id)
+        result.append(item)
+    return result
+
+
+def serialize_diaries(diaries):
+    """
+    Serializes a list of diaries with their authors and tags.
+    :param diaries: list of Diary objects.
+    :return diaries: list of dicts.
+    """
+    diaries = list(diaries)
+    prefetch_users(d.author_id for d in diaries)
+    tags = _tag_map(diaries)
+    return [{
+        "id": d.id,
+        "title": d.title,
+        "description": d.description,
+        "timestamp": _isoformat(d.timestamp),
+        "author": _username(d.author_id),
+        "author_id": d.author_id,
+        "tags": [tags[i] for i in d.tags or [] if i in tags],
+        "s_activity": d.s_activity,
+        "s_time": d.s_time,
+        "o_activity": d.o_activity,
+        "o_time": d.o_time,
+    } for d in diaries]
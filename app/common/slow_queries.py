@@ -0,0 +1,228 @@
+"""
+Slow query log. A pymongo command listener logs every MongoDB command
+taking longer than SLOW_QUERY_THRESHOLD_MS with the Flask endpoint issuing
+it and the shape of its filter (values replaced by '?'). A share of the
+slow reads given by SLOW_QUERY_EXPLAIN_RATE is explained in a background
+thread and the documents examined are logged next to the documents
+returned, a collection scan shows up as docsExamined >> nReturned.
+"""
+
+import queue
+import random
+import threading
+from bson.son import SON
+from flask import has_request_context, request
+from mongoengine.connection import get_connection
+from app.common.logging_module import setup_logging
+
+try:
+    from pymongo import monitoring
+except ImportError:         # pragma: no cover
+    monitoring = None
+
+# Commands with a filter, and where to find it in the command document
+FILTER_KEYS = {
+    'find': 'filter',
+    'count': 'query',
+    'distinct': 'query',
+    'findAndModify': 'query',
+    'aggregate': 'pipeline',
+    'update': 'updates',
+    'delete': 'deletes',
+}
+# Commands which can be explained with executionStats
+EXPLAINABLE = ('find', 'count', 'distinct', 'findAndModify', 'update',
+               'delete')
+# Options which are not accepted inside an explain command
+EXPLAIN_SKIP = ('writeConcern', 'readConcern', 'lsid', 'txnNumber',
+                'maxTimeMS')
+
+slow_query_logger = setup_logging('slow_queries', 'logs/slow_queries.log',
+                                  1000000, 5)
+
+
+def redact(value):
+    """
+    Returns the shape of a filter, field names and operators are kept and
+    values are replaced by '?' (regular expressions by '/?/').
+    :param value: filter document or value.
+    :return shape: redacted copy.
+    """
+    if isinstance(value, dict):
+        return dict((k, redact(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        if value and all(isinstance(v, dict) for v in value):
+            return [redact(v) for v in value]
+        return ['?'] if value else []
+    if hasattr(value, 'pattern'):
+        return '/?/'
+    return '?'
+
+
+def command_shape(command_name, command):
+    """
+    Returns the redacted filter of a command.
+    :param command_name: name of the command, e.g. 'find'.
+    :param command: command document.
+    :return shape: redacted filter or None.
+    """
+    key = FILTER_KEYS.get(command_name)
+    if key is None or key not in command:
+        return None
+    value = command[key]
+    if command_name in ('update', 'delete'):
+        # Bulk writes carry a list of statements, the filter is 'q'.
+        return [redact(statement.get('q', {})) for statement in value[:1]]
+    shape = {key: redact(value)}
+    if command_name == 'find' and command.get('sort'):
+        shape['sort'] = dict(command['sort'])
+    return shape
+
+
+def _explain_command(command_name, command):
+    cmd = SON((k, v) for k, v in command.items()
+              if not k.startswith('$') and k not in EXPLAIN_SKIP)
+    for key in ('updates', 'deletes'):
+        if key in cmd:
+            # Only one statement can be explained.
+            cmd[key] = cmd[key][:1]
+    return SON([('explain', cmd), ('verbosity', 'executionStats')])
+
+
+def _stages(plan):
+    """
+    Yields the stage names of a query plan.
+    """
+    while plan:
+        yield plan.get('stage')
+        for child in plan.get('inputStages', ()):
+            for stage in _stages(child):
+                yield stage
+        plan = plan.get('inputStage')
+
+
+class SlowQueryLog(object):
+    """
+    Registers the command listener and runs the sampled explains.
+    """
+
+    def __init__(self, threshold_ms=None, explain_rate=0.0):
+        """
+        :param threshold_ms: commands taking longer are logged (None
+        disables the log).
+        :param explain_rate: share of the slow commands which is explained.
+        """
+        self.threshold_ms = threshold_ms
+        self.explain_rate = explain_rate
+        self._pending = {}          # (connection, request id) -> command
+        self._local = threading.local()
+        self._explains = queue.Queue(maxsize=100)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._listener = None
+
+    def init_app(self, app):
+        """
+        Configures the log from SLOW_QUERY_THRESHOLD_MS and
+        SLOW_QUERY_EXPLAIN_RATE. Has to be called before the database
+        connection is created.
+        :param app: Flask application.
+        """
+        self.threshold_ms = app.config.get('SLOW_QUERY_THRESHOLD_MS',
+                                           self.threshold_ms)
+        self.explain_rate = app.config.get('SLOW_QUERY_EXPLAIN_RATE',
+                                           self.explain_rate)
+        if self.threshold_ms is None or monitoring is None or \
+                self._listener is not None:
+            return
+        self._listener = _SlowQueryListener(self)
+        monitoring.register(self._listener)
+
+    def started(self, event):
+        if self.threshold_ms is None or \
+                getattr(self._local, 'explaining', False) or \
+                event.command_name not in FILTER_KEYS:
+            return
+        endpoint = request.endpoint if has_request_context() else None
+        self._pending[(event.connection_id, event.request_id)] = \
+            (event.command, endpoint)
+
+    def finished(self, event, failed=False):
+        pending = self._pending.pop((event.connection_id, event.request_id),
+                                    None)
+        if pending is None:
+            return
+        duration_ms = event.duration_micros / 1000.0
+        if duration_ms < self.threshold_ms:
+            return
+        command, endpoint = pending
+        collection = command.get(event.command_name)
+        shape = command_shape(event.command_name, command)
+        slow_query_logger.warning(
+            'Slow %s on %s took %.1f ms%s endpoint=%s shape=%s',
+            event.command_name, collection, duration_ms,
+            ' (failed)' if failed else '', endpoint, shape)
+        if not failed and event.command_name in EXPLAINABLE and \
+                random.random() < self.explain_rate:
+            self._queue_explain(event.database_name, event.command_name,
+                                command, endpoint, shape)
+
+    def _queue_explain(self, database_name, command_name, command, endpoint,
+                       shape):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run,
+                                                name='slow-query-explain')
+                self._thread.daemon = True
+                self._thread.start()
+        try:
+            self._explains.put_nowait((database_name, command_name, command,
+                                       endpoint, shape))
+        except queue.Full:
+            pass
+
+    def _run(self):
+        # Commands of this thread are not logged, explains are slow too.
+        self._local.explaining = True
+        while True:
+            database_name, command_name, command, endpoint, shape = \
+                self._explains.get()
+            try:
+                result = get_connection()[database_name].command(
+                    _explain_command(command_name, command))
+            except Exception as el1:
+                slow_query_logger.error('Explain of %s on %s failed. '
+                                        'Error=%s', command_name,
+                                        command.get(command_name), el1)
+                continue
+            stats = result.get('executionStats', {})
+            plan = result.get('queryPlanner', {}).get('winningPlan', {})
+            slow_query_logger.warning(
+                'Explain %s on %s endpoint=%s shape=%s docsExamined=%s '
+                'keysExamined=%s nReturned=%s plan=%s',
+                command_name, command.get(command_name), endpoint, shape,
+                stats.get('totalDocsExamined'),
+                stats.get('totalKeysExamined'), stats.get('nReturned'),
+                '>'.join(s for s in _stages(plan) if s))
+
+
+if monitoring is not None:
+    class _SlowQueryListener(monitoring.CommandListener):
+        """
+        Forwards command events to the slow query log.
+        """
+
+        def __init__(self, log):
+            self.log = log
+
+        def started(self, event):
+            self.log.started(event)
+
+        def succeeded(self, event):
+            self.log.finished(event)
+
+        def failed(self, event):
+            self.log.finished(event, failed=True)
+
+
+slow_query_log = SlowQueryLog()
@@ -0,0 +1,172 @@
+"""
+Fingerprinted static assets. `manage.py build_static` copies the files of
+app/static to STATIC_ASSETS_DIR under names containing a hash of their
+content (styles.css -> styles.3f2a9c1e0b7d.css), with precompressed .gz
+and .br (if the brotli module is installed) variants and a manifest of the
+names. Templates refer to assets with static_url('styles.css'), which
+returns the fingerprinted url served under /assets with a far-future,
+immutable Cache-Control header. A changed file gets a new name, so clients
+never use an outdated copy.
+
+Without a manifest, e.g. during development, static_url() falls back to
+the plain static url.
+"""
+
+import os
+import json
+import gzip
+import shutil
+import hashlib
+import tempfile
+import mimetypes
+from flask import url_for, request, send_from_directory, abort
+
+try:
+    import brotli
+except ImportError:         # pragma: no cover
+    brotli = None
+
+MANIFEST = 'manifest.json'
+# Types worth compressing, images other than icons are compressed already
+COMPRESSIBLE = ('.css', '.js', '.html', '.svg', '.json', '.txt', '.ico')
+# (Content-Encoding, file suffix) in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+def _fingerprint(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def _write_compressed(path, data):
+    """
+    Writes the .gz and .br variants of a file if they are smaller.
+    """
+    variants = [('.gz', gzip.compress(data, 9))]
+    if brotli is not None:
+        variants.append(('.br', brotli.compress(data)))
+    for suffix, compressed in variants:
+        if len(compressed) < len(data):
+            with open(path + suffix, 'wb') as f:
+                f.write(compressed)
+
+
+def _mimetype(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def build_static(static_dir, out_dir):
+    """
+    Writes fingerprinted copies of the static files and the manifest.
+    Earlier builds are kept, pages rendered before a deployment may still
+    refer to them.
+    :param static_dir: directory of the static files.
+    :param out_dir: output directory (skipped if inside static_dir).
+    :return manifest: dict of file name -> fingerprinted file name.
+    """
+    static_dir = os.path.abspath(static_dir)
+    out_dir = os.path.abspath(out_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest = {}
+    for root, dirs, files in os.walk(static_dir):
+        dirs[:] = [d for d in dirs if os.path.join(root, d) != out_dir]
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            logical = os.path.relpath(source, static_dir).replace(os.sep, '/')
+            base, ext = os.path.splitext(logical)
+            hashed = '{0}.{1}{2}'.format(base, _fingerprint(source), ext)
+            target = os.path.join(out_dir, hashed)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copyfile(source, target)
+                if ext.lower() in COMPRESSIBLE:
+                    with open(source, 'rb') as f:
+                        _write_compressed(target, f.read())
+            manifest[logical] = hashed
+    fd, tmp = tempfile.mkstemp(dir=out_dir)
+    with os.fdopen(fd, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(tmp, os.path.join(out_dir, MANIFEST))
+    return manifest
+
+
+class StaticAssets(object):
+    """
+    Serves the fingerprinted assets and provides the static_url() template
+    helper.
+    """
+
+    def __init__(self, directory=None, max_age=31536000):
+        """
+        :param directory: directory written by build_static().
+        :param max_age: Cache-Control max-age of the assets in seconds.
+        """
+        self.directory = directory
+        self.max_age = max_age
+        self.manifest = {}
+
+    def init_app(self, app):
+        """
+        Loads the manifest from STATIC_ASSETS_DIR, registers the /assets
+        route and the static_url template global.
+        :param app: Flask application.
+        """
+        self.directory = app.config.get('STATIC_ASSETS_DIR', self.directory)
+        self.max_age = app.config.get('STATIC_ASSETS_MAX_AGE', self.max_age)
+        self.load()
+        app.add_url_rule('/assets/<path:filename>', 'static_asset',
+                         self.send)
+        app.add_template_global(self.url, 'static_url')
+
+    def load(self):
+        """
+        Reads the manifest of the last build, called on start up.
+        """
+        try:
+            with open(os.path.join(self.directory, MANIFEST)) as f:
+                self.manifest = json.load(f)
+        except (IOError, OSError, ValueError, TypeError):
+            self.manifest = {}
+
+    def url(self, filename):
+        """
+        Returns the url of a static file, fingerprinted if it has been
+        built.
+        :param filename: path of the file relative to app/static.
+        :return url: String
+        """
+        hashed = self.manifest.get(filename)
+        if hashed is None:
+            return url_for('static', filename=filename)
+        return url_for('static_asset', filename=hashed)
+
+    def send(self, filename):
+        """
+        View sending a fingerprinted file, precompressed if the client
+        accepts it.
+        """
+        if filename == MANIFEST or filename.endswith(
+                tuple(suffix for _, suffix in ENCODINGS)):
+            abort(404)
+        name, encoding = filename, None
+        for candidate, suffix in ENCODINGS:
+            if request.accept_encodings[candidate] and \
+                    os.path.isfile(os.path.join(self.directory,
+                                                filename + suffix)):
+                name, encoding = filename + suffix, candidate
+                break
+        response = send_from_directory(self.directory, name,
+                                       mimetype=_mimetype(filename),
+                                       cache_timeout=self.max_age)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        response.headers['Cache-Control'] = \
+            'public, max-age={0}, immutable'.format(self.max_age)
+        response.vary.add('Accept-Encoding')
+        return response
+
+
+static_assets = StaticAssets()
@@ -0,0 +1,104 @@
+"""
+In-process cache of the suggestion queries offered as frequent queries in
+the suggestion box. The cache is tagged with a version stamp stored in the
+counters collection, Suggestion.save()/delete() bump the stamp and every
+process reloads its copy once it sees a new stamp. The stamp itself is read
+at most every SUGGESTION_VERSION_CHECK seconds.
+"""
+
+import time
+import bisect
+import threading
+from pymongo import ReturnDocument
+from mongoengine.connection import get_db
+
+VERSION_ID = 'suggestion.version'
+
+
+class SuggestionChoices(object):
+    """
+    Suggestion queries sorted case-insensitively for prefix lookups.
+    """
+
+    def __init__(self, check_interval=5):
+        """
+        :param check_interval: seconds between two version stamp reads.
+        """
+        self.check_interval = check_interval
+        self.version = None
+        self.keys = []              # lower case queries, sorted
+        self.choices = []           # (id, query) in the order of keys
+        self._checked_at = 0
+        self._stamp = None
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configures the check interval from SUGGESTION_VERSION_CHECK.
+        :param app: Flask application.
+        """
+        self.check_interval = app.config.get('SUGGESTION_VERSION_CHECK',
+                                             self.check_interval)
+
+    @staticmethod
+    def _counters():
+        return get_db()['mongo_engine.counters']
+
+    def bump(self):
+        """
+        Marks the cached choices of all processes as stale, called after a
+        suggestion is saved or deleted.
+        :return version: new version stamp.
+        """
+        counter = self._counters().find_one_and_update(
+            {'_id': VERSION_ID}, {'$inc': {'next': 1}}, upsert=True,
+            return_document=ReturnDocument.AFTER)
+        with self._lock:
+            self._stamp = counter['next']
+            self._checked_at = time.time()
+        return self._stamp
+
+    def _current_stamp(self):
+        now = time.time()
+        if self._stamp is None or now - self._checked_at > \
+                self.check_interval:
+            counter = self._counters().find_one({'_id': VERSION_ID})
+            self._stamp = counter['next'] if counter else 0
+            self._checked_at = now
+        return self._stamp
+
+    def _ensure_loaded(self):
+        stamp = self._current_stamp()
+        if stamp == self.version:
+            return
+        from app.models import Suggestion
+        rows = sorted(((query or '').lower(), s_id, query or '')
+                      for s_id, query in Suggestion.objects.scalar('id',
+                                                                   'query'))
+        with self._lock:
+            self.keys = [row[0] for row in rows]
+            self.choices = [(row[1], row[2]) for row in rows]
+            self.version = stamp
+
+    def search(self, prefix='', page=1, per_page=20):
+        """
+        Returns a page of the suggestion queries starting with a prefix.
+        :param prefix: case-insensitive prefix ('' matches all queries).
+        :param page: page number starting from 1.
+        :param per_page: number of choices per page.
+        :return (choices, more): list of (id, query), True if there are
+        more pages.
+        """
+        self._ensure_loaded()
+        prefix = (prefix or '').strip().lower()
+        with self._lock:
+            keys, choices = self.keys, self.choices
+        start = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + u'\uffff') if prefix \
+            else len(keys)
+        first = start + (max(page, 1) - 1) * per_page
+        last = min(first + per_page, end)
+        return choices[first:last], last < end
+
+
+suggestion_choices = SuggestionChoices()
@@ -0,0 +1,213 @@
+"""
+In-process inverted index over Suggestion.query used to match user queries
+against the suggestion table. Queries are tokenized, stop words dropped and
+common English suffixes stripped, hits are ranked with TF-IDF. The index is
+loaded lazily from the database, updated by Suggestion.save()/delete() and
+reloaded every SUGGESTION_INDEX_TTL seconds to pick up changes made by other
+worker processes. Reloads run in one background thread at a time, searches
+keep using the old index meanwhile; only the very first load blocks.
+"""
+
+import re
+import math
+import time
+import heapq
+import logging
+import threading
+from collections import Counter
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+STOP_WORDS = frozenset((
+    'a', 'about', 'an', 'and', 'are', 'as', 'at', 'be', 'by', 'can', 'do',
+    'does', 'for', 'from', 'how', 'i', 'in', 'is', 'it', 'me', 'my', 'of',
+    'on', 'or', 'should', 'that', 'the', 'this', 'to', 'was', 'what', 'when',
+    'where', 'which', 'who', 'why', 'will', 'with', 'would', 'you', 'your'))
+
+# Longest suffixes first, a stem keeps at least 3 characters.
+SUFFIXES = ('ations', 'ation', 'ments', 'ment', 'ings', 'ing', 'ies', 'ied',
+            'es', 'ed', 'ly', 's')
+
+
+def stem(token):
+    """
+    Strips a common English suffix from a token, e.g. 'exams' -> 'exam'.
+    :param token: lower case token.
+    :return stem: String
+    """
+    for suffix in SUFFIXES:
+        if token.endswith(suffix) and len(token) - len(suffix) >= 3:
+            if suffix in ('ies', 'ied'):
+                return token[:-len(suffix)] + 'y'
+            token = token[:-len(suffix)]
+            break
+    # 'schedule' and 'scheduled' share the stem 'schedul'
+    if token.endswith('e') and len(token) > 3:
+        token = token[:-1]
+    return token
+
+
+def tokenize(text):
+    """
+    Splits a text into normalized index terms.
+    :param text: query text.
+    :return terms: list of terms.
+    """
+    return [stem(t) for t in TOKEN_RE.findall((text or '').lower())
+            if t not in STOP_WORDS]
+
+
+class SuggestionIndex(object):
+    """
+    Inverted index term -> {suggestion id: term frequency}.
+    """
+
+    def __init__(self, ttl=300):
+        """
+        :param ttl: seconds after which the index is reloaded (None = never).
+        """
+        self.ttl = ttl
+        self.postings = {}
+        self.lengths = {}           # id -> number of terms
+        self.queries = {}           # id -> query text
+        self.loaded_at = None
+        self._stale = False
+        self._reloading = False
+        self._lock = threading.RLock()
+        self._load_lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configures the reload interval from SUGGESTION_INDEX_TTL.
+        :param app: Flask application.
+        """
+        self.ttl = app.config.get('SUGGESTION_INDEX_TTL', self.ttl)
+
+    def _ensure_loaded(self):
+        if self.loaded_at is None:
+            # Nothing to serve yet, one thread loads and the others wait.
+            with self._load_lock:
+                if self.loaded_at is None:
+                    self.load()
+        elif self._stale or (self.ttl is not None and
+                             time.time() - self.loaded_at > self.ttl):
+            self._reload_in_background()
+
+    def _reload_in_background(self):
+        with self._lock:
+            if self._reloading:
+                return
+            self._reloading = True
+            self._stale = False
+
+        def _reload():
+            try:
+                with self._load_lock:
+                    self.load()
+            finally:
+                with self._lock:
+                    self._reloading = False
+
+        thread = threading.Thread(target=_reload,
+                                  name='suggestion-index-reload')
+        thread.daemon = True
+        thread.start()
+
+    def load(self):
+        """
+        (Re)builds the index from the suggestion table.
+        :return count: number of indexed suggestions.
+        """
+        from app.models import Suggestion
+        postings, lengths, queries = {}, {}, {}
+        try:
+            for s_id, query in Suggestion.objects.scalar('id', 'query'):
+                self._index(postings, lengths, queries, s_id, query)
+        except Exception as el1:
+            logging.error('Unable to load suggestion index. '
+                          'Error={0}'.format(el1))
+        with self._lock:
+            self.postings, self.lengths, self.queries = \
+                postings, lengths, queries
+            self.loaded_at = time.time()
+        logging.info('{0} suggestions loaded into suggestion '
+                     'index.'.format(len(queries)))
+        return len(queries)
+
+    @staticmethod
+    def _index(postings, lengths, queries, s_id, query):
+        terms = Counter(tokenize(query))
+        for term, tf in terms.items():
+            postings.setdefault(term, {})[s_id] = tf
+        lengths[s_id] = sum(terms.values())
+        queries[s_id] = query
+
+    def invalidate(self):
+        """
+        Reloads the index on the next search, e.g. after a bulk load.
+        """
+        self._stale = True
+
+    def add(self, s_id, query):
+        """
+        Adds or updates a suggestion in the index.
+        :param s_id: ID of the suggestion.
+        :param query: query text of the suggestion.
+        """
+        if self.loaded_at is None:
+            # Not loaded yet, the suggestion is picked up by the first load.
+            return
+        with self._lock:
+            self._remove(s_id)
+            self._index(self.postings, self.lengths, self.queries, s_id, query)
+
+    def remove(self, s_id):
+        """
+        Removes a suggestion from the index.
+        :param s_id: ID of the suggestion.
+        """
+        with self._lock:
+            self._remove(s_id)
+
+    def _remove(self, s_id):
+        query = self.queries.pop(s_id, None)
+        self.lengths.pop(s_id, None)
+        if query is None:
+            return
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if docs is not None:
+                docs.pop(s_id, None)
+                if not docs:
+                    del self.postings[term]
+
+    def search(self, text, k=5):
+        """
+        Returns the suggestions best matching a text.
+        :param text: user query.
+        :param k: maximum number of results.
+        :return results: list of (id, score, query) tuples, best first.
+        """
+        self._ensure_loaded()
+        terms = Counter(tokenize(text))
+        with self._lock:
+            n = len(self.queries)
+            scores = {}
+            for term, qtf in terms.items():
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                idf = math.log(1.0 + n / float(len(docs)))
+                weight = qtf * idf * idf
+                for s_id, tf in docs.items():
+                    scores[s_id] = scores.get(s_id, 0.0) + weight * tf
+            best = heapq.nlargest(
+                k, ((score / math.sqrt(self.lengths[s_id]), s_id)
+                    for s_id, score in scores.items()))
+            return [(s_id, score, self.queries[s_id]) for score, s_id in best]
+
+    def __len__(self):
+        return len(self.queries)
+
+
+suggestion_index = SuggestionIndex()
@@ -0,0 +1,314 @@
+"""
+TF-IDF similarity search over Suggestion.query backed by NumPy. Terms
+(stemmed words and character trigrams of the words) are hashed into a fixed
+number of features, every suggestion becomes an L2 normalized sparse row.
+The matrix is stored by column (postings of every feature, like CSC) as
+.npy files and memory-mapped, so worker processes share the pages and a
+user query only reads the postings of its own features.
+
+Builds are serialised with a lock file. Files are written to a new version
+directory and published by atomically replacing the CURRENT file, readers
+switch to a new version on the next search (CURRENT is only read again
+when its mtime changed). The previous version is kept for processes which
+have not switched yet, older ones are deleted. Rebuilds after edits are
+debounced, at most one runs per SUGGESTION_VECTORS_REBUILD_INTERVAL.
+
+If NumPy or the files are not available, search() returns None and the
+caller falls back to the inverted index in suggestion_index.
+"""
+
+import os
+import time
+import json
+import zlib
+import shutil
+import logging
+import threading
+from contextlib import contextmanager
+from collections import Counter
+from app.common.suggestion_index import tokenize
+
+try:
+    import numpy as np
+except ImportError:         # pragma: no cover
+    np = None
+
+try:
+    import fcntl
+except ImportError:         # pragma: no cover
+    fcntl = None
+
+ARRAYS = ('data', 'rows', 'indptr', 'ids', 'idf')
+# Number of published versions kept in the directory
+KEEP_VERSIONS = 2
+
+
+def features(text, n_features):
+    """
+    Returns the hashed term counts of a text.
+    :param text: query text.
+    :param n_features: number of hash buckets.
+    :return counts: Counter of feature -> count.
+    """
+    counts = Counter()
+    for token in tokenize(text):
+        counts[zlib.crc32(token.encode('utf-8')) % n_features] += 1
+        padded = '#{0}#'.format(token)
+        for i in range(len(padded) - 2):
+            counts[zlib.crc32(padded[i:i + 3].encode('utf-8')) %
+                   n_features] += 1
+    return counts
+
+
+@contextmanager
+def _build_lock(directory):
+    """
+    Holds an exclusive lock on the directory, builds of other processes
+    wait for it.
+    """
+    with open(os.path.join(directory, '.lock'), 'w') as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def build_vectors(directory, n_features=2 ** 18):
+    """
+    Builds the TF-IDF matrix of the suggestion table and publishes it in
+    given directory.
+    :param directory: directory of the vector files.
+    :param n_features: number of hash buckets.
+    :return count: number of suggestions in the matrix.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory, exist_ok=True)
+    with _build_lock(directory):
+        return _build_vectors(directory, n_features)
+
+
+def _build_vectors(directory, n_features):
+    from app.models import Suggestion
+    docs = [(s_id, features(query, n_features)) for s_id, query in
+            Suggestion.objects.scalar('id', 'query')]
+    df = np.zeros(n_features, dtype=np.float32)
+    for _, counts in docs:
+        df[list(counts)] += 1
+    idf = np.log1p(len(docs) / np.maximum(df, 1)).astype(np.float32)
+
+    data, indices, rows, ids = [], [], [], []
+    for row, (s_id, counts) in enumerate(docs):
+        cols = np.fromiter(counts.keys(), dtype=np.int32, count=len(counts))
+        weights = np.fromiter(counts.values(), dtype=np.float32,
+                              count=len(counts)) * idf[cols]
+        norm = np.linalg.norm(weights)
+        if norm:
+            weights /= norm
+        data.append(weights)
+        indices.append(cols)
+        rows.append(np.full(len(cols), row, dtype=np.int32))
+        ids.append(s_id)
+
+    def _concat(parts, dtype):
+        return np.concatenate(parts).astype(dtype) if parts \
+            else np.zeros(0, dtype=dtype)
+
+    # Sort the entries by feature, the postings of feature c are
+    # data/rows[indptr[c]:indptr[c + 1]].
+    indices = _concat(indices, np.int32)
+    order = np.argsort(indices, kind='mergesort')
+    indptr = np.zeros(n_features + 1, dtype=np.int64)
+    np.cumsum(np.bincount(indices, minlength=n_features), out=indptr[1:])
+    arrays = {
+        'data': _concat(data, np.float32)[order],
+        'rows': _concat(rows, np.int32)[order],
+        'indptr': indptr,
+        'ids': np.array(ids, dtype=np.int64),
+        'idf': idf,
+    }
+    version = 'v{0}'.format(int(time.time() * 1000000))
+    path = os.path.join(directory, version)
+    os.makedirs(path)
+    for name in ARRAYS:
+        np.save(os.path.join(path, name + '.npy'), arrays[name])
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({'n_features': n_features, 'count': len(ids)}, f)
+    current = os.path.join(directory, 'CURRENT')
+    with open(current + '.tmp', 'w') as f:
+        f.write(version)
+    os.replace(current + '.tmp', current)
+    # Builds hold the lock, so all versions but the one just written are
+    # older. The previous one is kept for processes which have not
+    # switched yet.
+    versions = sorted((name for name in os.listdir(directory)
+                       if name.startswith('v') and name[1:].isdigit()),
+                      key=lambda name: int(name[1:]))
+    for name in versions[:-KEEP_VERSIONS]:
+        shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+    return len(ids)
+
+
+class SuggestionVectors(object):
+    """
+    Memory-mapped TF-IDF matrix of the suggestion table.
+    """
+
+    def __init__(self):
+        self.directory = None
+        self.n_features = 2 ** 18
+        self.version = None
+        self.arrays = None
+        self.rebuild_interval = 60
+        self._lock = threading.Lock()
+        self._rebuilding = False
+        self._pending = False
+        self._last_build = 0
+        self._current_stat = None
+
+    def init_app(self, app):
+        """
+        Configures the index from SUGGESTION_VECTORS_DIR,
+        SUGGESTION_VECTORS_FEATURES and SUGGESTION_VECTORS_REBUILD_INTERVAL.
+        The matrix is built before the first request if no readable version
+        has been published.
+        :param app: Flask application.
+        """
+        self.directory = app.config.get('SUGGESTION_VECTORS_DIR')
+        self.n_features = app.config.get('SUGGESTION_VECTORS_FEATURES',
+                                         self.n_features)
+        self.rebuild_interval = app.config.get(
+            'SUGGESTION_VECTORS_REBUILD_INTERVAL', self.rebuild_interval)
+        if np is None or not self.directory:
+            return
+
+        @app.before_first_request
+        def load_suggestion_vectors():
+            self._load()
+            if self.arrays is None:
+                self.rebuild(app)
+
+    def _current_version(self):
+        try:
+            with open(os.path.join(self.directory, 'CURRENT')) as f:
+                return f.read().strip() or None
+        except (IOError, OSError, TypeError):
+            return None
+
+    def _load(self):
+        try:
+            st = os.stat(os.path.join(self.directory, 'CURRENT'))
+            stat = (st.st_ino, st.st_mtime_ns)
+        except (IOError, OSError, TypeError):
+            return
+        if stat == self._current_stat and self.arrays is not None:
+            return
+        version = self._current_version()
+        if version is None:
+            return
+        if version == self.version:
+            self._current_stat = stat
+            return
+        path = os.path.join(self.directory, version)
+        try:
+            arrays = {name: np.load(os.path.join(path, name + '.npy'),
+                                    mmap_mode='r') for name in ARRAYS}
+            with open(os.path.join(path, 'meta.json')) as f:
+                n_features = json.load(f)['n_features']
+        except (IOError, OSError, ValueError, KeyError) as el1:
+            logging.error('Unable to load suggestion vectors={0}. '
+                          'Error={1}'.format(path, el1))
+            return
+        with self._lock:
+            self.arrays, self.version = arrays, version
+            self.n_features = n_features
+            self._current_stat = stat
+
+    def rebuild(self, app):
+        """
+        Rebuilds the matrix in a background thread, e.g. after a suggestion
+        has been saved. Concurrent requests for a rebuild are merged and a
+        build starts at least rebuild_interval seconds after the previous
+        one, so a series of edits results in few builds.
+        :param app: Flask application (the thread needs an app context).
+        """
+        if np is None or not self.directory:
+            return
+        with self._lock:
+            self._pending = True
+            if self._rebuilding:
+                # The running rebuild starts over once it is finished.
+                return
+            self._rebuilding = True
+
+        def _rebuild():
+            while True:
+                with self._lock:
+                    if not self._pending:
+                        self._rebuilding = False
+                        return
+                    wait = self._last_build + self.rebuild_interval - \
+                        time.time()
+                if wait > 0:
+                    # Edits made meanwhile are covered by this build.
+                    time.sleep(wait)
+                with self._lock:
+                    self._pending = False
+                    self._last_build = time.time()
+                try:
+                    with app.app_context():
+                        count = build_vectors(self.directory, self.n_features)
+                    logging.info('{0} suggestions written to suggestion '
+                                 'vectors.'.format(count))
+                except Exception as el1:
+                    logging.error('Unable to build suggestion vectors. '
+                                  'Error={0}'.format(el1))
+
+        thread = threading.Thread(target=_rebuild)
+        thread.daemon = True
+        thread.start()
+
+    def search(self, text, k=5):
+        """
+        Ranks the suggestions by cosine similarity to a text.
+        :param text: user query.
+        :param k: maximum number of results.
+        :return results: list of (id, score) tuples, best first, or None if
+        the vector index is not available.
+        """
+        if np is None or not self.directory:
+            return None
+        self._load()
+        arrays = self.arrays
+        if arrays is None:
+            return None
+        counts = features(text, self.n_features)
+        if not counts or not len(arrays['ids']):
+            return []
+        cols = np.array(sorted(counts), dtype=np.int64)
+        weights = np.array([counts[c] for c in cols], dtype=np.float32) * \
+            arrays['idf'][cols]
+        # Only the postings of the query features are read.
+        indptr = arrays['indptr']
+        spans = [(s, e, w) for s, e, w in zip(indptr[cols], indptr[cols + 1],
+                                              weights) if e > s]
+        if not spans:
+            return []
+        rows = np.concatenate([arrays['rows'][s:e] for s, e, _ in spans])
+        contrib = np.concatenate([arrays['data'][s:e] * w
+                                  for s, e, w in spans])
+        candidates, inverse = np.unique(rows, return_inverse=True)
+        scores = np.bincount(inverse, weights=contrib)
+        norm = np.linalg.norm(weights)
+        if norm:
+            scores /= norm
+        k = min(k, len(scores))
+        best = np.argpartition(-scores, k - 1)[:k]
+        best = best[np.argsort(-scores[best])]
+        return [(int(arrays['ids'][candidates[i]]), float(scores[i]))
+                for i in best if scores[i] > 0]
+
+
+suggestion_vectors = SuggestionVectors()
@@ -0,0 +1,127 @@
+"""
+Process local id <-> text cache for Tag documents. Tags are small and
+practically immutable, so rendering tags and resolving tag lists can be
+served from memory. The cache is warmed with the first request and kept
+up to date by Tag.save()/Tag.delete().
+"""
+
+import logging
+from app.common.caching import LRUCache
+
+
+class TagCache(object):
+    """
+    Bounded two-way mapping between tag ids and tag texts.
+    """
+
+    def __init__(self, maxsize=10000):
+        self.texts = LRUCache(maxsize)          # id -> text
+        self.ids = LRUCache(maxsize)            # text -> id
+
+    def init_app(self, app):
+        """
+        Configures the cache size and warms the cache before the first
+        request is served.
+        :param app: Flask application.
+        """
+        maxsize = app.config.get('TAG_CACHE_SIZE', self.texts.maxsize)
+        self.texts.maxsize = self.ids.maxsize = maxsize
+
+        @app.before_first_request
+        def warm_tag_cache():
+            self.warm(maxsize)
+
+    def warm(self, limit):
+        """
+        Loads up to `limit` tags into the cache.
+        :param limit: maximum number of tags to be loaded.
+        :return count: number of tags loaded.
+        """
+        from app.models import Tag
+        count = 0
+        try:
+            for tag_id, text in Tag.objects.scalar('id', 'text').limit(limit):
+                self.add(tag_id, text)
+                count += 1
+        except Exception as el1:
+            logging.error('Unable to warm tag cache. Error={0}'.format(el1))
+        logging.info('{0} tags loaded into tag cache.'.format(count))
+        return count
+
+    def add(self, tag_id, text):
+        """
+        Adds a tag to the cache, e.g. after it is created.
+        :param tag_id: ID of the tag.
+        :param text: text of the tag.
+        """
+        if tag_id is None or text is None:
+            return
+        self.texts.set(tag_id, text)
+        self.ids.set(text, tag_id)
+
+    def remove(self, tag_id, text=None):
+        """
+        Removes a tag from the cache, e.g. after it is deleted.
+        :param tag_id: ID of the tag.
+        :param text: text of the tag (looked up if not provided).
+        """
+        cached = self.texts.pop(tag_id)
+        text = text if text is not None else cached
+        if text is not None:
+            self.ids.pop(text)
+
+    def get_map(self, tag_ids):
+        """
+        Returns the texts of given tags as a mapping. Tags missing from the
+        cache are loaded with a single query.
+        :param tag_ids: iterable of tag ids.
+        :return texts: dict of id -> text (unknown tags are skipped).
+        """
+        found = {}
+        missing = []
+        for tag_id in tag_ids:
+            text = self.texts.get(tag_id)
+            if text is not None:
+                found[tag_id] = text
+            elif tag_id not in missing:
+                missing.append(tag_id)
+        if missing:
+            from app.models import Tag
+            for tag_id, text in Tag.objects(id__in=missing).scalar('id',
+                                                                   'text'):
+                self.add(tag_id, text)
+                found[tag_id] = text
+        return found
+
+    def get_texts(self, tag_ids):
+        """
+        Returns the texts of given tags. Tags missing from the cache are
+        loaded with a single query.
+        :param tag_ids: list of tag ids.
+        :return texts: list of tag texts (unknown tags are skipped).
+        """
+        found = self.get_map(tag_ids)
+        return [found[i] for i in tag_ids if i in found]
+
+    def get_ids(self, texts):
+        """
+        Looks up the ids of given tag texts in the cache only.
+        :param texts: list of tag texts.
+        :return ids: dict of text -> id for the cached tags.
+        """
+        found = {}
+        for text in texts:
+            tag_id = self.ids.get(text)
+            if tag_id is not None:
+                found[text] = tag_id
+        return found
+
+    def stats(self):
+        """
+        Returns hit/miss statistics of the cache.
+        :return stats: dict with stats of id->text and text->id lookups.
+        """
+        return {'texts': self.texts.stats(), 'ids': self.ids.stats()}
+
+
+tag_cache = TagCache()
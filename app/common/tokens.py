@@ -0,0 +1,118 @@
+"""
+Signed token helpers. Serializers are created once per application and
+expiry, and verified authentication tokens are cached together with a slim
+snapshot of their user, so token authenticated API requests are served
+without verifying the signature and reading the user again.
+"""
+
+import time
+import hashlib
+import threading
+from flask import current_app
+from itsdangerous import TimedJSONWebSignatureSerializer as Serializer
+from app.common.caching import LRUCache
+
+
+def token_serializer(expires_in=None):
+    """
+    Returns the token serializer of the current application for given
+    expiry, creating it on first use.
+    :param expires_in: validity of generated tokens in seconds (None for
+    the serializer default), only affects dumps().
+    :return serializer: TimedJSONWebSignatureSerializer
+    """
+    app = current_app._get_current_object()
+    serializers = app.extensions.setdefault('token_serializers', {})
+    serializer = serializers.get(expires_in)
+    if serializer is None:
+        if expires_in is None:
+            serializer = Serializer(app.config['SECRET_KEY'])
+        else:
+            serializer = Serializer(app.config['SECRET_KEY'],
+                                    expires_in=expires_in)
+        serializers[expires_in] = serializer
+    return serializer
+
+
+def token_digest(token):
+    """
+    Returns the cache key of a token, tokens are not kept in memory as is.
+    :param token: signed token (str or bytes).
+    :return digest: String
+    """
+    if not isinstance(token, bytes):
+        token = token.encode('utf-8')
+    return hashlib.sha256(token).hexdigest()
+
+
+class TokenCache(object):
+    """
+    Bounded cache token digest -> (user id, user snapshot). Entries live
+    until the token expires or TOKEN_CACHE_TTL passes, whichever is first,
+    and are dropped when the user is saved.
+    """
+
+    def __init__(self, maxsize=10000, ttl=60):
+        self.cache = LRUCache(maxsize, ttl)
+        self._by_user = {}          # user id -> set of digests
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        """
+        Configures the cache from TOKEN_CACHE_SIZE and TOKEN_CACHE_TTL.
+        :param app: Flask application.
+        """
+        self.cache.maxsize = app.config.get('TOKEN_CACHE_SIZE',
+                                            self.cache.maxsize)
+        self.cache.ttl = app.config.get('TOKEN_CACHE_TTL', self.cache.ttl)
+
+    def get(self, digest):
+        """
+        Returns the cached user snapshot of a token.
+        :param digest: token digest.
+        :return son: user snapshot (dict) or None.
+        """
+        entry = self.cache.get(digest)
+        return entry[1] if entry is not None else None
+
+    def set(self, digest, user_id, son, expires_at):
+        """
+        Caches the user snapshot of a verified token.
+        :param digest: token digest.
+        :param user_id: ID of the token owner.
+        :param son: user snapshot (dict).
+        :param expires_at: expiry of the token (unix time).
+        """
+        ttl = expires_at - time.time()
+        if self.cache.ttl is not None:
+            ttl = min(self.cache.ttl, ttl)
+        if ttl <= 0:
+            return
+        self.cache.set(digest, (user_id, son), ttl=ttl)
+        with self._lock:
+            self._by_user.setdefault(user_id, set()).add(digest)
+            if len(self._by_user) > self.cache.maxsize:
+                # Forget digests which have been evicted from the cache.
+                for uid in list(self._by_user):
+                    digests = set(d for d in self._by_user[uid]
+                                  if d in self.cache)
+                    if digests:
+                        self._by_user[uid] = digests
+                    else:
+                        del self._by_user[uid]
+
+    def invalidate_user(self, user_id):
+        """
+        Drops all cached tokens of a user, e.g. after a password change.
+        :param user_id: ID of the user.
+        """
+        with self._lock:
+            digests = self._by_user.pop(user_id, ())
+        for digest in digests:
+            self.cache.pop(digest)
+
+    def stats(self):
+        return self.cache.stats()
+
+
+token_cache = TokenCache()
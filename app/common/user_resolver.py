@@ -0,0 +1,61 @@
+"""
+Request scoped resolver for user names rendered in Jinja2 templates.
+
+Views register every author/commenter id shown on a page with
+prefetch_users(); the first template lookup then loads all of them with a
+single `$in` query. Ids that were not prefetched are still loaded lazily.
+"""
+
+from flask import g, has_app_context
+
+# Fields needed by the template helpers, nothing else is loaded.
+USER_FIELDS = ('id', 'username', 'first_name', 'last_name')
+
+
+def _state():
+    """
+    Returns the (users, pending) pair stored on the application context.
+    :return (users, pending): dict of id -> user, set of ids to be loaded.
+    """
+    if not has_app_context():
+        return {}, set()
+    if getattr(g, '_user_resolver', None) is None:
+        g._user_resolver = ({}, set())
+    return g._user_resolver
+
+
+def prefetch_users(user_ids):
+    """
+    Registers user ids which are going to be rendered on the current page.
+    Nothing is queried until a template asks for one of the users.
+    :param user_ids: iterable of user ids (None values are ignored).
+    """
+    users, pending = _state()
+    pending.update(i for i in user_ids if i is not None and i not in users)
+
+
+def _load(user_ids):
+    from app.models import User
+    users, pending = _state()
+    ids = set(user_ids) | pending
+    for user in User.objects(id__in=list(ids)).only(*USER_FIELDS):
+        users[user.id] = user
+    for i in ids:
+        # Remember missing users as well, so they are not queried again.
+        users.setdefault(i, None)
+    pending.clear()
+
+
+def resolve_user(user_id):
+    """
+    Returns the (slim) user document for given id, loading all pending ids
+    in one query on a cache miss.
+    :param user_id: ID of the user.
+    :return user: User object or None if user does not exist.
+    """
+    if user_id is None:
+        return None
+    users, pending = _state()
+    if user_id not in users:
+        _load([user_id])
+    return users.get(user_id)
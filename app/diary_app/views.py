@@ -5,6 +5,11 @@ from datetime import datetime
 from . import diary_app, da_logger
 from .forms import DiaryForm
 from app.models import Diary, Tag
+from app.common.user_resolver import prefetch_users
+from app.common.pagination import paginate
+from app.common.tag_cache import tag_cache
+from app.common.conditional import page_etag, is_not_modified, \
+    not_modified, with_validators
 from flask_login import login_required, current_user
 from flask import redirect, url_for, request, current_app, render_template, \
     abort, flash
@@ -14,12 +19,10 @@ from flask import redirect, url_for, request, current_app, render_template, \
 @diary_app.route('/index', methods=['GET', 'POST'])
 @login_required
 def index():
-    page = request.args.get('page', 1, type=int)
     qs = Diary.objects(author_id=current_user.id).order_by('-timestamp')
-    pagination = qs.paginate(page,
-                             per_page=current_app.config["DIARIES_PER_PAGE"],
-                             error_out=False)
+    pagination = paginate(qs, current_app.config["DIARIES_PER_PAGE"])
     diaries = pagination.items
+    prefetch_users(d.author_id for d in diaries)
     return render_template('diary/index.html', diaries=diaries,
                            pagination=pagination)
 
@@ -29,10 +32,14 @@ def index():
 def diary_page(d_id):
     d = Diary.objects(id=d_id).get_or_404()
     if d.author_id != current_user.id:
-        da_logger.warn('user={0} tried to edit inaccessible '
-                       'diary={1}'.format(current_user.id, d.id))
+        da_logger.warn('user=%s tried to edit inaccessible '
+                       'diary=%s', current_user.id, d.id)
         abort(403)
-    return render_template('diary/diary.html', diary=d)
+    etag = page_etag('diary', d.id, d.timestamp)
+    if is_not_modified(etag):
+        return not_modified(etag, d.timestamp)
+    return with_validators(render_template('diary/diary.html', diary=d),
+                           etag, d.timestamp)
 
 
 @diary_app.route('/edit/<int:d_id>', methods=['GET', 'POST'])
@@ -40,8 +47,8 @@ def diary_page(d_id):
 def edit_diary(d_id):
     d = Diary.objects(id=d_id).get_or_404()
     if d is not None and d.author_id != current_user.id:
-        da_logger.warn('user={0} tried to edit inaccessible '
-                       'diary={1}'.format(current_user.id, d.id))
+        da_logger.warn('user=%s tried to edit inaccessible '
+                       'diary=%s', current_user.id, d.id)
         abort(403)
     form = DiaryForm()
     if form.validate_on_submit():
@@ -52,16 +59,9 @@ def edit_diary(d_id):
         d.s_time = form.s_time.data
         d.o_activity = [o_a.strip() for o_a in form.o_activity.data.split(',')]
         d.o_time = form.o_time.data
-        tag_data = form.tags.data
-        if tag_data != '':
-            tags = [t.strip() for t in tag_data.split(',')]
-            for tag in tags:
-                if Tag.objects(text=tag.strip()).first() is not None:
-                    d.tags.append(Tag.objects(text=tag).first().id)
-                else:
-                    t = Tag(text=tag).save()
-                    d.tags.append(t.id)
-            d.tags = list(set(d.tags))               # avoid repeated tags
+        # keep the existing tags, avoid repeated tags
+        d.tags = list(set(d.tags + Tag.resolve_ids(
+            form.tags.data.split(','))))
         d.author_id = current_user.id
         d.save()
         flash('Diary is updated')
@@ -72,8 +72,7 @@ def edit_diary(d_id):
     form.s_time.data = d.s_time
     form.o_activity.data = ','.join([o_a for o_a in d.o_activity])
     form.o_time.data = d.o_time
-    form.tags.data = ','.join([Tag.objects(id=i).first().text
-                               for i in d.tags])
+    form.tags.data = ','.join(tag_cache.get_texts(d.tags))
     return render_template('diary/edit_diary.html', form=form)
 
 
@@ -90,16 +89,7 @@ def add_diary():
         d.s_time = form.s_time.data
         d.o_activity = [o_a.strip() for o_a in form.o_activity.data.split(',')]
         d.o_time = form.o_time.data
-        tag_data = form.tags.data
-        if tag_data != '':
-            tags = [t.strip() for t in tag_data.split(',')]
-            for tag in tags:
-                if Tag.objects(text=tag.strip()).first() is not None:
-                    d.tags.append(Tag.objects(text=tag).first().id)
-                else:
-                    t = Tag(text=tag).save()
-                    d.tags.append(t.id)
-            d.tags = list(set(d.tags))            # avoid repeated tags
+        d.tags = Tag.resolve_ids(form.tags.data.split(','))
         d.author_id = current_user.id
         d.save()
         flash('Diary is updated')
@@ -2,6 +2,9 @@
 Module containing blueprints for application models.
 """
 
+import io
+import csv
+import time
 import random
 import hashlib
 import logging
@@ -9,12 +12,23 @@ import forgery_py
 from datetime import datetime, timedelta
 from mongoengine import ValidationError
 from mongoengine.queryset import NotUniqueError
+from mongoengine.queryset.visitor import Q
+from pymongo import UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError
 from flask import current_app, request, url_for, jsonify
 from flask_login import UserMixin, AnonymousUserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from itsdangerous import TimedJSONWebSignatureSerializer as Serializer, \
-    BadSignature, SignatureExpired
+from itsdangerous import BadSignature, SignatureExpired
 from app import db, login_manager
+from app.common.tag_cache import tag_cache
+from app.common.id_allocator import BlockSequenceField
+from app.common.tokens import token_serializer, token_digest, token_cache
+from app.common.principal_cache import principal_cache
+from app.common.password_hashing import hash_password, check_password, \
+    needs_rehash
+from app.common.suggestion_index import suggestion_index
+from app.common.suggestion_vectors import suggestion_vectors
+from app.common.suggestion_choices import suggestion_choices
+from app.common.fragment_cache import fragment_cache
 from helper.regex_strings import EMAIL, USERNAME
 from helper.helper_functions import isEmail
 from config import Config
@@ -115,9 +129,18 @@ class Tag(db.Document):
     comments, activities etc.
     """
     __collectionname__ = "Tag"
-    id = db.SequenceField(primary_key=True)
+    id = BlockSequenceField(primary_key=True)
     text = db.StringField(unique=True)
 
+    def save(self, *args, **kwargs):
+        result = super(Tag, self).save(*args, **kwargs)
+        tag_cache.add(self.id, self.text)
+        return result
+
+    def delete(self, *args, **kwargs):
+        tag_cache.remove(self.id, self.text)
+        return super(Tag, self).delete(*args, **kwargs)
+
     def to_json(self):
         """
         Returns a JSON representation of Tag object.
@@ -155,6 +178,56 @@ class Tag(db.Document):
                           'Error={0}'.format(el1))
             return None
 
+    @staticmethod
+    def resolve_ids(texts):
+        """
+        Resolves a list of tag texts to tag ids, creating the missing tags.
+        Tags are served from the tag cache, the remaining ones are looked up
+        with one $in query and missing tags are upserted with a single bulk
+        write.
+        :param texts: list of tag texts (surrounding spaces are ignored).
+        :return ids: list of tag ids, in order of first appearance.
+        """
+        unique = []
+        for text in texts:
+            text = text.strip() if text else ''
+            if text and text not in unique:         # avoid repeated tags
+                unique.append(text)
+        texts = unique
+        if not texts:
+            return []
+        found = tag_cache.get_ids(texts)
+        uncached = [t for t in texts if t not in found]
+        if uncached:
+            found.update(Tag.objects(text__in=uncached).scalar('text', 'id'))
+        missing = [t for t in texts if t not in found]
+        if missing:
+            requests = [UpdateOne({'text': text},
+                                  {'$setOnInsert': {'_id': tag_id}},
+                                  upsert=True)
+                        for text, tag_id in
+                        zip(missing,
+                            Tag._fields['id'].reserve(len(missing)))]
+            try:
+                result = Tag._get_collection().bulk_write(requests,
+                                                          ordered=False)
+                upserted = result.upserted_ids
+            except BulkWriteError as el1:
+                # Tags created concurrently by another request.
+                logging.warning('Bulk upsert of tags partially failed. '
+                                'Error={0}'.format(el1))
+                upserted = dict((u['index'], u['_id'])
+                                for u in el1.details.get('upserted', []))
+            for index, tag_id in upserted.items():
+                found[missing[index]] = tag_id
+            lost = [t for t in missing if t not in found]
+            if lost:
+                found.update(Tag.objects(text__in=lost).scalar('text', 'id'))
+        for text in texts:
+            if text in found:
+                tag_cache.add(found[text], text)
+        return [found[t] for t in texts if t in found]
+
     @staticmethod
     def generate_fake(count=10):
         """
@@ -174,38 +247,66 @@ class Tag(db.Document):
                 pass
 
 
+def _bump_version(document):
+    """
+    Atomically increments the version of a saved post/activity. The $inc
+    runs after the save, a concurrent update_comment_count can therefore
+    never leave two different documents under the same version.
+    :param document: saved Post or Activity.
+    """
+    updated = document._get_collection().find_one_and_update(
+        {'_id': document.id}, {'$inc': {'version': 1}},
+        projection={'version': True}, return_document=ReturnDocument.AFTER)
+    if updated is not None:
+        # Not marked as changed, a later save must not $set the version.
+        document._data['version'] = updated['version']
+
+
 class Post(db.Document):
     """
     This blueprint represents a post object. Posts are written by
     users and other users can comment on these Posts.
     """
     __collectionname__ = "Post"
-    id = db.SequenceField(primary_key=True)
+    id = BlockSequenceField(primary_key=True)
     body = db.StringField()
-    timestamp = db.DateTimeField(default=datetime.utcnow())
+    timestamp = db.DateTimeField(default=datetime.utcnow)
     author_id = db.IntField(min_value=0)
     comments = db.ListField(db.IntField(), default=[])
+    # Number of enabled comments, maintained by Comment.update_comment_count
+    comment_count = db.IntField(default=0)
+    # Time of the latest comment, part of the ETag of the post page
+    last_comment_at = db.DateTimeField()
     tags = db.ListField(db.IntField())
+    # Incremented by every change, rendered fragments are keyed by version
+    version = db.IntField(default=0)
+
+    meta = {
+        'index_background': True,
+        'indexes': [
+            ('-timestamp', '-id'),
+            ('author_id', '-timestamp', '-id'),
+        ],
+    }
+
+    def save(self, *args, **kwargs):
+        result = super(Post, self).save(*args, **kwargs)
+        _bump_version(self)
+        fragment_cache.invalidate('post', self.id)
+        return result
 
     def to_json(self):
         """
-        Convert post object to JSON formatted string.
-        :return post: JSON object.
+        Convert post object to a dict, see serializers.serialize_posts for
+        serializing lists of posts.
+        :return post: dict.
         """
         try:
-            return jsonify({
-                "id": self.id,
-                "body": self.body,
-                "timestamp": self.timestamp,
-                "author": User.objects(id=self.author_id).username or '',
-                "author_id": self.author_id,
-                "comments": [Comment.objects(id=i).first().body for i in
-                             self.comments] or [],
-                "tags": [Tag.objects(id=i) for i in self.tags] or []
-            })
+            from app.common.serializers import serialize_posts
+            return serialize_posts([self])[0]
         except Exception as el1:
-            logging.error('Unable to convert post object to json. '
-                          'Error={0}'.format(el1))
+            logging.error('Unable to convert post object={0} to dict. '
+                          'Error={1}'.format(self.id, el1))
             return None
 
     @staticmethod
@@ -268,38 +369,224 @@ class Post(db.Document):
                 pass
 
 
+def _batches(values, size):
+    """
+    Splits an iterable into lists of at most size values, keeping $in
+    queries and their results well below the document size limit.
+    :param values: iterable, e.g. user ids.
+    :param size: maximum length of a batch.
+    """
+    batch = []
+    for value in values:
+        batch.append(value)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+class TimelineEntry(db.EmbeddedDocument):
+    """
+    A post on a home timeline, the timestamp is kept for ordering.
+    """
+    post_id = db.IntField()
+    timestamp = db.DateTimeField()
+
+
+class Timeline(db.Document):
+    """
+    Precomputed home timeline of a user, i.e. the most recent posts of the
+    user and his/her friends, newest first. Timelines are written when a
+    post is created (fan-out-on-write). Posts of users with more friends
+    than TIMELINE_FANOUT_LIMIT are not written to the timelines, they are
+    merged in when the timeline is read (fan-out-on-read).
+    """
+    __collectionname__ = "Timeline"
+    user_id = db.IntField(primary_key=True)
+    entries = db.ListField(db.EmbeddedDocumentField(TimelineEntry),
+                           default=[])
+
+    @staticmethod
+    def _push(user_ids, entries):
+        """
+        Pushes entries to the existing timelines of given users with a
+        single bulk write, keeping every timeline sorted and capped at
+        TIMELINE_LENGTH. Missing timelines are not created, a timeline
+        holding only the new entries would hide the older posts.
+        :param user_ids: IDs of the timeline owners.
+        :param entries: list of {'post_id': .., 'timestamp': ..} dicts.
+        :return matched: number of timelines written.
+        """
+        if not user_ids or not entries:
+            return 0
+        update = {'$push': {'entries': {
+            '$each': entries,
+            '$sort': {'timestamp': -1, 'post_id': -1},
+            '$slice': current_app.config['TIMELINE_LENGTH'],
+        }}}
+        result = Timeline._get_collection().bulk_write(
+            [UpdateOne({'_id': user_id}, update) for user_id in user_ids],
+            ordered=False)
+        return result.matched_count
+
+    @staticmethod
+    def fan_out(post):
+        """
+        Writes a new post to the timelines of its author and the author's
+        friends. Authors with more than TIMELINE_FANOUT_LIMIT friends are
+        marked for fan-out-on-read and only their own timeline is written.
+        An author without a timeline gets it built from the stored posts.
+        :param post: newly created post.
+        """
+        try:
+            entry = {'post_id': post.id, 'timestamp': post.timestamp}
+            pipeline = {'$project': {
+                'friends': {'$size': {'$ifNull': ['$friends', []]}},
+                'fanout_on_read': 1}}
+            author = next(User.objects(id=post.author_id).aggregate(pipeline),
+                          None)
+            if author is None:
+                return
+            celebrity = author['friends'] > \
+                current_app.config['TIMELINE_FANOUT_LIMIT']
+            if celebrity and not author.get('fanout_on_read'):
+                # Cleared by rebuild_timelines only, the friends' timelines
+                # do not hold the earlier posts of the author.
+                User.objects(id=post.author_id).update_one(
+                    set__fanout_on_read=True)
+            celebrity = celebrity or bool(author.get('fanout_on_read'))
+            if not Timeline._push([post.author_id], [entry]):
+                Timeline.rebuild([post.author_id])
+            if not celebrity:
+                Timeline._push(User.objects(id=post.author_id).scalar(
+                    'friends').first() or [], [entry])
+        except Exception as el1:
+            logging.error('Unable to fan out post={0} to timelines. '
+                          'Error={1}'.format(post.id, el1))
+
+    @staticmethod
+    def post_ids(user):
+        """
+        Returns the ids of the posts on the home timeline of a user, merging
+        the stored timeline with the recent posts of friends who use
+        fan-out-on-read. These friends are looked up on every read, so
+        friendships made after an author switched to fan-out-on-read are
+        covered.
+        :param user: owner of the timeline.
+        :return ids: list of post ids, newest first, or None if the user
+        has no timeline yet (see rebuild_timelines).
+        """
+        length = current_app.config['TIMELINE_LENGTH']
+        timeline = Timeline.objects(user_id=user.id).only('entries').first()
+        if timeline is None:
+            return None
+        entries = [(e.timestamp, e.post_id) for e in timeline.entries]
+        friends = User.objects(id=user.id).scalar('friends').first() or []
+        celebrities = list(User.objects(id__in=friends, fanout_on_read=True)
+                           .scalar('id')) if friends else []
+        if celebrities:
+            entries += Post.objects(author_id__in=celebrities)\
+                .order_by('-timestamp').limit(length)\
+                .scalar('timestamp', 'id')
+        entries.sort(reverse=True)
+        ids, seen = [], set()
+        for _, post_id in entries:
+            if post_id not in seen:
+                seen.add(post_id)
+                ids.append(post_id)
+        return ids[:length]
+
+    @staticmethod
+    def rebuild(user_ids=None, batch_size=500, mark_celebrities=None):
+        """
+        Rebuilds home timelines from the stored posts, e.g. after bulk
+        loading data or changing friendships. Users are processed in
+        batches of ids.
+        :param user_ids: IDs of the users to rebuild (all users if None).
+        :param batch_size: number of user ids queried at once.
+        :param mark_celebrities: first set fanout_on_read from the friend
+        counts of all users (default: when rebuilding all timelines).
+        :return count: number of timelines rebuilt.
+        """
+        if mark_celebrities or (mark_celebrities is None and
+                                user_ids is None):
+            Timeline._mark_celebrities()
+        if user_ids is None:
+            user_ids = User.objects().scalar('id')
+        length = current_app.config['TIMELINE_LENGTH']
+        count = 0
+        for batch in _batches(user_ids, batch_size):
+            users = list(User.objects(id__in=batch).scalar('id', 'friends'))
+            friend_ids = set(f for _, friends in users for f in friends or ())
+            celebrities = set(User.objects(id__in=friend_ids,
+                                           fanout_on_read=True).scalar('id'))\
+                if friend_ids else set()
+            for user_id, friends in users:
+                authors = [user_id] + [f for f in friends or ()
+                                       if f not in celebrities]
+                entries = [{'post_id': post_id, 'timestamp': timestamp}
+                           for post_id, timestamp in
+                           Post.objects(author_id__in=authors)
+                           .order_by('-timestamp').limit(length)
+                           .scalar('id', 'timestamp')]
+                Timeline._get_collection().replace_one(
+                    {'_id': user_id}, {'_id': user_id, 'entries': entries},
+                    upsert=True)
+                count += 1
+        return count
+
+    @staticmethod
+    def _mark_celebrities():
+        """
+        Sets fanout_on_read on the users with more than
+        TIMELINE_FANOUT_LIMIT friends and clears it on the others.
+        """
+        pipeline = [
+            {'$project': {'friends': {'$size': {'$ifNull': ['$friends',
+                                                            []]}}}},
+            {'$match': {'friends': {'$gt': current_app.config[
+                'TIMELINE_FANOUT_LIMIT']}}}]
+        celebrities = [row['_id'] for row in
+                       User.objects().aggregate(*pipeline)]
+        User.objects(id__in=celebrities).update(set__fanout_on_read=True)
+        User.objects(id__nin=celebrities, fanout_on_read=True)\
+            .update(set__fanout_on_read=False)
+
+
 class Comment(db.Document):
     """
     This document is the blue print for a comment. A comment may be
     associated to wallpost, activity_app, or any other kind of post.
     """
     __collectionname__ = "Comment"
-    id = db.SequenceField(primary_key=True)
+    id = BlockSequenceField(primary_key=True)
     body = db.StringField()
-    timestamp = db.DateTimeField(default=datetime.utcnow())
+    timestamp = db.DateTimeField(default=datetime.utcnow)
     commenter_id = db.IntField(min_value=0)
     post_id = db.IntField()
     disabled = db.BooleanField(default=False)
     # type of comment = 1:post, 2:activity_app
     c_type = db.IntField(default=Config.COMMENT_TYPE['POST'])
 
+    meta = {
+        'index_background': True,
+        'indexes': [
+            ('c_type', 'post_id', '-timestamp', '-id'),
+        ],
+    }
+
     def to_json(self):
         """
-        Convert a Comment object to json.
-        :return comment: str in json format.
+        Convert a Comment object to a dict.
+        :return comment: dict.
         """
         try:
-            return jsonify({
-                "id": self.id,
-                "body": self.body,
-                "commenter_id": self.commenter_id,
-                "commenter": User.objects(id=self.commenter_id).first().username
-                             or '',
-                "post_id": self.post_id
-            })
+            from app.common.serializers import serialize_comments
+            return serialize_comments([self])[0]
         except Exception as el1:
-            logging.error('Unable to convert comment object to json. Error={'
-                          '0}'.format(el1))
+            logging.error('Unable to convert comment object={0} to dict. '
+                          'Error={1}'.format(self.id, el1))
             return None
 
     @staticmethod
@@ -328,6 +615,93 @@ class Comment(db.Document):
                           'data. Error={}'.format(el1))
             return
 
+    @staticmethod
+    def parent_document(c_type):
+        """
+        Returns the document class a comment of given type belongs to.
+        :param c_type: type of comment (see Config.COMMENT_TYPE).
+        :return document class: Post or Activity
+        """
+        if c_type == Config.COMMENT_TYPE['ACTIVITY']:
+            return Activity
+        return Post
+
+    @staticmethod
+    def update_comment_count(c_type, post_id, delta, timestamp=None):
+        """
+        Atomically adjusts the comment counter of the post/activity a
+        comment belongs to.
+        :param c_type: type of comment (see Config.COMMENT_TYPE).
+        :param post_id: ID of the post/activity.
+        :param delta: value added to the counter (e.g. 1 or -1).
+        :param timestamp: timestamp of a new comment, kept as
+        last_comment_at if it is the latest one.
+        """
+        update = {'inc__comment_count': delta, 'inc__version': 1}
+        if timestamp is not None:
+            update['max__last_comment_at'] = timestamp
+        parent = Comment.parent_document(c_type)
+        parent.objects(id=post_id).update_one(**update)
+        fragment_cache.invalidate(parent.__name__.lower(), post_id)
+
+    @staticmethod
+    def set_disabled(comment_id, disabled):
+        """
+        Enables/disables a comment and keeps the comment counter of its
+        post/activity in sync. The counter is only changed if the state of
+        the comment actually changed.
+        :param comment_id: ID of the comment.
+        :param disabled: True to disable the comment, False to enable it.
+        :return comment: Comment object or None if comment does not exist.
+        """
+        # A missing field means enabled, only real transitions match.
+        state = {'disabled__ne': True} if disabled else {'disabled': True}
+        changed = Comment.objects(id=comment_id, **state)\
+            .update_one(set__disabled=disabled)
+        comment = Comment.objects(id=comment_id).first()
+        if changed and comment is not None:
+            Comment.update_comment_count(comment.c_type, comment.post_id,
+                                         -1 if disabled else 1)
+        return comment
+
+    @staticmethod
+    def rebuild_comment_counts():
+        """
+        Recomputes the comment counters of all posts and activities from
+        the comment collection, e.g. after a bulk import. The counts are
+        computed first and only differing counters are set, each on the
+        condition that it did not move meanwhile, so readers never see
+        reset counters and concurrent $inc updates are kept.
+        :return counts: dict with number of documents updated per type.
+        """
+        expected = {Post: {}, Activity: {}}
+        pipeline = [
+            {'$match': {'disabled': {'$ne': True}}},
+            {'$group': {'_id': {'c_type': '$c_type', 'post_id': '$post_id'},
+                        'count': {'$sum': 1}}}
+        ]
+        for row in Comment.objects.aggregate(*pipeline):
+            parent = Comment.parent_document(row['_id'].get('c_type'))
+            expected[parent][row['_id'].get('post_id')] = row['count']
+        counts = {}
+        for parent, by_id in expected.items():
+            # Parents without enabled comments are set to 0 explicitly.
+            requests = (UpdateOne({'_id': doc_id, 'comment_count': stored},
+                                  {'$set': {'comment_count':
+                                            by_id.get(doc_id, 0)},
+                                   '$inc': {'version': 1}})
+                        for doc_id, stored in
+                        parent.objects.scalar('id', 'comment_count')
+                        if stored != by_id.get(doc_id, 0))
+            updated = 0
+            for batch in _batches(requests, 1000):
+                result = parent._get_collection().bulk_write(batch,
+                                                             ordered=False)
+                updated += result.modified_count
+            counts[parent.__name__] = updated
+        logging.info('Comment counters rebuilt. {0}'.format(counts))
+        return counts
+
     @staticmethod
     def generate_fake(count=10):
         """
@@ -366,10 +740,10 @@ class Diary(db.Document):
     can keep as a journal and later use for reflection purposes.
     """
     __collectionname__ = 'diary'
-    id = db.SequenceField(primary_key=True)
+    id = BlockSequenceField(primary_key=True)
     title = db.StringField()
     description = db.StringField()
-    timestamp = db.DateTimeField(default=datetime.utcnow())
+    timestamp = db.DateTimeField(default=datetime.utcnow)
     author_id = db.IntField(min_value=0)
     tags = db.ListField(db.IntField())
     s_activity = db.ListField(db.StringField())         # Study activity_app
@@ -378,26 +752,23 @@ class Diary(db.Document):
     o_time = db.FloatField(default=0)
     # No comments for personal diary
 
+    meta = {
+        'index_background': True,
+        'indexes': [
+            ('author_id', '-timestamp', '-id'),
+        ],
+    }
+
     def to_json(self):
         """
-        This function converts diary document to json object.
-        :return activity_app object: in JSON format
+        This function converts diary document to a dict.
+        :return diary object: dict
         """
         try:
-            return jsonify({
-                "id": self.id,
-                "title": self.title,
-                "description": self.description,
-                "timestamp": self.timestamp,
-                "author_id": User.objects(id=self.author_id).first().username,
-                "tags": [Tag.objects(id=i).first().text for i in self.tags],
-                "s_activity": self.s_activity,
-                "s_time": self.s_time,
-                "o_activity": self.o_activity,
-                "o_time": self.o_time
-            })
+            from app.common.serializers import serialize_diaries
+            return serialize_diaries([self])[0]
         except Exception as el1:
-            logging.error('Unable to convert diary object={0} to JSON format. '
+            logging.error('Unable to convert diary object={0} to dict. '
                           'Error={1}'.format(self.id, el1))
             return None
 
@@ -415,14 +786,7 @@ class Diary(db.Document):
             diary.author_id = data.get('author_id') or 0
             # FIXME: All tags will be saved even if the post is not saved in db.
             if data.get('tags') and len(data.get('tags')) > 0:
-                for tag in data.get('tags'):
-                    if Tag.objects(text=tag).count() != 0:
-                        diary.tags.append(Tag.objects(text=tag).first().id)
-                    else:
-                        t = Tag.from_json({'text': tag})
-                        if t is not None:
-                            t.save()
-                            diary.tags.append(t.id)
+                diary.tags = Tag.resolve_ids(data.get('tags'))
             if data.get('s_activity') and len(data.get('s_activity')) > 0:
                 diary.s_activities = data.get('s_activity')
             diary.s_time = data.get('s_time') or 0
@@ -476,40 +840,49 @@ class Activity(db.Document):
     join to show their interest in the activities.
     """
     __collectionname__ = 'activity_app'
-    id = db.SequenceField(primary_key=True)
+    id = BlockSequenceField(primary_key=True)
     title = db.StringField()
     description = db.StringField()
     author_id = db.IntField(min_value=0)
-    timestamp = db.DateTimeField(default=datetime.utcnow())
+    timestamp = db.DateTimeField(default=datetime.utcnow)
     activity_time = db.DateTimeField()
     tags = db.ListField(db.IntField())
     interested = db.ListField(db.IntField(min_value=1))
     going = db.ListField(db.IntField(min_value=1))
     comments = db.ListField(db.IntField(), default=[])     # string must be Comment:json
+    # Number of enabled comments, maintained by Comment.update_comment_count
+    comment_count = db.IntField(default=0)
+    # Time of the latest comment, part of the ETag of the activity page
+    last_comment_at = db.DateTimeField()
+    # Incremented by every change, rendered fragments are keyed by version
+    version = db.IntField(default=0)
+
+    meta = {
+        'index_background': True,
+        'indexes': [
+            ('-timestamp', '-id'),
+            ('author_id', '-timestamp', '-id'),
+            'activity_time',
+        ],
+    }
+
+    def save(self, *args, **kwargs):
+        result = super(Activity, self).save(*args, **kwargs)
+        _bump_version(self)
+        fragment_cache.invalidate('activity', self.id)
+        return result
 
     def to_json(self):
         """
-        This function returns the json representation of activity_app object.
-        :return:
+        This function returns the dict representation of activity_app object.
+        :return activity object: dict
         """
         try:
-            return jsonify({
-                "id": self.id,
-                "title": self.title,
-                "description": self.description,
-                "timestamp": self.timestamp,
-                "activity_time": self.activity_time,
-                "tags": [Tag.objects(id=i).first().text for i in self.tags],
-                "interested": [User.objects(id=i).first().username
-                               for i in self.interested],
-                "going": [User.objects(id=i).first().username
-                          for i in self.going],
-                "comments": [Comment.objects(id=i).first().body
-                             for i in self.comments]
-            })
+            from app.common.serializers import serialize_activities
+            return serialize_activities([self])[0]
         except Exception as el1:
-            logging.error('Unable to convert activity_app object={0} to JSON. '
-                          'Error{1}'.format(self.id, el1))
+            logging.error('Unable to convert activity object={0} to dict. '
+                          'Error={1}'.format(self.id, el1))
             return None
 
     @staticmethod
@@ -526,13 +899,7 @@ class Activity(db.Document):
             activity.activity_time = data.get('activity_time') or ''
             # FIXME: All tags will be saved even if the post is not saved in db.
             if data.get('tags') and len(data.get('tags')) > 0:
-                for tag in data.get('tags'):
-                    if Tag.objects(text=tag).count() != 0:
-                        activity.tags.append(Tag.objects(text=tag).first().id)
-                    else:
-                        t = Tag.from_json({'text': tag})
-                        t.save()
-                        activity.tags.append(t.id)
+                activity.tags = Tag.resolve_ids(data.get('tags'))
             if data.get('interested') and len(data.get('interested')) > 0:
                 activity.interested = data.get('interested')
             if data.get('going') and len(data.get('going')) > 0:
@@ -552,6 +919,44 @@ class Activity(db.Document):
                           'Error={0}'.format(el1))
             return None
 
+    @staticmethod
+    def rsvp(activity_id, user_id, status):
+        """
+        Records the RSVP of a user for an activity with a single atomic
+        update, without loading the activity.
+        :param activity_id: ID of the activity.
+        :param user_id: ID of the user.
+        :param status: 'interested', 'going' or None to cancel the RSVP.
+        :return: True if the activity exists, False otherwise.
+        """
+        if status == 'interested':
+            update = {'add_to_set__interested': user_id}
+        elif status == 'going':
+            update = {'add_to_set__going': user_id,
+                      'pull__interested': user_id}
+        else:
+            update = {'pull__going': user_id, 'pull__interested': user_id}
+        # The RSVP lists are part of the activity page, see its ETag.
+        update['inc__version'] = 1
+        return Activity.objects(id=activity_id).update_one(**update) == 1
+
+    @staticmethod
+    def rsvp_counts(activity_id):
+        """
+        Returns the RSVP counts of an activity, computed by the database
+        so the member lists are not transferred.
+        :param activity_id: ID of the activity.
+        :return counts: dict with interested and going counts or None if
+        activity does not exist.
+        """
+        pipeline = {'$project': {
+            'interested': {'$size': {'$ifNull': ['$interested', []]}},
+            'going': {'$size': {'$ifNull': ['$going', []]}}}}
+        for row in Activity.objects(id=activity_id).aggregate(pipeline):
+            return {'id': row['_id'], 'interested': row['interested'],
+                    'going': row['going']}
+        return None
+
     @staticmethod
     def generate_fake(count=10):
         """
@@ -598,10 +1003,24 @@ class Suggestion(db.Document):
     user depending on the matched query.
     """
     __collectionname__ = 'suggestion'
-    id = db.SequenceField(primary_key=True)
+    id = BlockSequenceField(primary_key=True)
     query = db.StringField()
     responses = db.ListField(db.StringField(), default=[])
 
+    def save(self, *args, **kwargs):
+        result = super(Suggestion, self).save(*args, **kwargs)
+        suggestion_index.add(self.id, self.query)
+        suggestion_choices.bump()
+        suggestion_vectors.rebuild(current_app._get_current_object())
+        return result
+
+    def delete(self, *args, **kwargs):
+        suggestion_index.remove(self.id)
+        result = super(Suggestion, self).delete(*args, **kwargs)
+        suggestion_choices.bump()
+        suggestion_vectors.rebuild(current_app._get_current_object())
+        return result
+
     def to_json(self):
         """
         This function converts suggestions item to JSON representation to
@@ -660,30 +1079,92 @@ class Suggestion(db.Document):
                 pass
 
     @staticmethod
-    def load_data_from_csv(filepath):
-        """
-        This function reads a .csv file containing possible queries and their
-         possible answers.
-        :param filepath: path to csv file for lading
-        :return:
-        """
-        count = 0
+    def load_data_from_csv(filepath, batch_size=None, rebuild_vectors=True):
+        """
+        This function streams a .csv file containing possible queries and
+        their possible answers (query,response1,response2,...) into the
+        suggestion table. The first line is a header. Rows are inserted
+        with insert_many in batches of CSV_BATCH_SIZE rows, ids are reserved
+        once per batch.
+        :param filepath: path to csv file for loading
+        :param batch_size: number of rows per insert, overrides
+        CSV_BATCH_SIZE.
+        :param rebuild_vectors: schedule a background rebuild of the
+        suggestion vectors. Command line callers pass False and build the
+        vectors themselves, the background thread dies with the process.
+        :return stats: dict with loaded, rejected, seconds and rows_per_sec
+        or None if the file could not be read.
+        """
+        batch_size = batch_size or current_app.config['CSV_BATCH_SIZE']
+        collection = Suggestion._get_collection()
+        stats = {'loaded': 0, 'rejected': 0}
+        start = time.time()
+
+        def _insert(batch):
+            ids = Suggestion._fields['id'].reserve(len(batch))
+            docs = [{'_id': s_id, 'query': query, 'responses': responses}
+                    for s_id, (query, responses) in zip(ids, batch)]
+            try:
+                collection.insert_many(docs, ordered=False)
+                stats['loaded'] += len(docs)
+            except BulkWriteError as el2:
+                stats['loaded'] += el2.details.get('nInserted', 0)
+                stats['rejected'] += len(el2.details.get('writeErrors', []))
+
         try:
-            with open(filepath, 'r') as f:
-                next(f)
-                for line in f:
-                    data = line.split(',')
+            with io.open(filepath, 'r', encoding='utf-8', newline='') as f:
+                reader = csv.reader(f)
+                next(reader, None)                  # header
+                batch = []
+                while True:
                     try:
-                        Suggestion(query=data[0], responses=data[1:]).save()
-                        count += 1
-                    except Exception:
-                        pass
-            logging.info('{0} entries read to suggestion table from csv '
-                         'file.'.format(count))
-            return count
-        except Exception as el1:
+                        row = next(reader)
+                    except StopIteration:
+                        break
+                    except csv.Error as el2:
+                        stats['rejected'] += 1
+                        logging.warning('Rejected line={0} of {1}. '
+                                        'Error={2}'.format(reader.line_num,
+                                                           filepath, el2))
+                        continue
+                    query = row[0].strip() if row else ''
+                    if not query:
+                        stats['rejected'] += 1
+                        continue
+                    batch.append((query, [r.strip() for r in row[1:]
+                                          if r.strip()]))
+                    if len(batch) >= batch_size:
+                        _insert(batch)
+                        batch = []
+                if batch:
+                    _insert(batch)
+        except (IOError, OSError, UnicodeDecodeError) as el1:
             logging.error('Unable to load suggestion data from csv file. '
                           'Error={0}'.format(el1))
+            return None
+        finally:
+            if stats['loaded']:
+                # Documents were inserted without Suggestion.save()
+                suggestion_index.invalidate()
+                suggestion_choices.bump()
+                if rebuild_vectors:
+                    suggestion_vectors.rebuild(
+                        current_app._get_current_object())
+        stats['seconds'] = time.time() - start
+        stats['rows_per_sec'] = stats['loaded'] / stats['seconds'] \
+            if stats['seconds'] else 0
+        logging.info('{0} entries read to suggestion table from csv file, '
+                     '{1} rejected ({2:.0f} rows/sec).'.format(
+                         stats['loaded'], stats['rejected'],
+                         stats['rows_per_sec']))
+        return stats
+
+
+# Fields needed to authenticate a user.
+CREDENTIAL_FIELDS = ('id', 'username', 'email', 'password_hash', 'confirmed',
+                     'permissions', 'role')
+# Relation lists, not needed for authentication and possibly long.
+RELATION_FIELDS = ('parents', 'friends', 'teachers', 'kids')
 
 
 class User(UserMixin, db.Document):
@@ -692,7 +1173,7 @@ class User(UserMixin, db.Document):
     """
     # FIXME: Decide a schema and move to Document instead of Dynamic document.
     __collectionname__ = 'user'
-    id = db.SequenceField(primary_key=True)
+    id = BlockSequenceField(primary_key=True)
     # FIXME: ensure uniqueness of email and username in business logic.
     email = db.EmailField(regex=EMAIL, max_length=64, required=True,
                           unique=True)
@@ -710,13 +1191,15 @@ class User(UserMixin, db.Document):
     last_name = db.StringField(max_length=64)
     phone = db.StringField(max_length=20)
     address = db.EmbeddedDocumentField(document_type=Address)
-    joined = db.DateTimeField(default=datetime.utcnow())
+    joined = db.DateTimeField(default=datetime.utcnow)
 
     # Relations 
     parents = db.ListField(db.IntField(min_value=1), default=[])
     friends = db.ListField(db.IntField(min_value=1), default=[])
     teachers = db.ListField(db.IntField(min_value=1), default=[])
     kids = db.ListField(db.IntField(min_value=1), default=[])
+    # Posts are not fanned out to the timelines of friends, see Timeline.
+    fanout_on_read = db.BooleanField(default=False)
 
     # Define indexes
     # FIXME: Check the tradeoff between hashed and plain-text indexes.
@@ -739,20 +1222,129 @@ class User(UserMixin, db.Document):
             self.avatar_hash = hashlib.md5(self.email.encode('utf-8'))\
                                       .hexdigest()
 
+    @staticmethod
+    def find_by_login(username_or_email, fields=None,
+                      exclude=RELATION_FIELDS):
+        """
+        Looks up a user by username or email address with a single $or
+        query. An email address match wins over a username match.
+        :param username_or_email: username or email address.
+        :param fields: fields to be loaded (overrides exclude).
+        :param exclude: fields not to be loaded, the relation lists
+        (friends, parents, ...) by default.
+        :return user: User object or None.
+        """
+        if not username_or_email:
+            return None
+        qs = User.objects(Q(email=username_or_email) |
+                          Q(username=username_or_email))
+        if fields:
+            qs = qs.only(*fields)
+        elif exclude:
+            qs = qs.exclude(*exclude)
+        users = list(qs.limit(2))
+        for user in users:
+            if user.email == username_or_email:
+                return user
+        return users[0] if users else None
+
+    @staticmethod
+    def find_duplicates(username=None, email=None):
+        """
+        Checks with a single query whether a username and/or an email
+        address is already registered.
+        :param username: username to be checked.
+        :param email: email address to be checked.
+        :return (username_taken, email_taken): tuple of booleans.
+        """
+        query = None
+        for q in (Q(username=username) if username else None,
+                  Q(email=email) if email else None):
+            if q is not None:
+                query = q if query is None else query | q
+        if query is None:
+            return False, False
+        taken = list(User.objects(query).only('username', 'email').limit(2))
+        return (any(u.username == username for u in taken),
+                any(u.email == email for u in taken))
+
+    # Relation lists not loaded yet, see partial().
+    _unloaded = ()
+
+    def __getattribute__(self, name):
+        if name in RELATION_FIELDS and \
+                object.__getattribute__(self, '_unloaded'):
+            object.__getattribute__(self, '_load_relations')()
+        return super(User, self).__getattribute__(name)
+
+    @staticmethod
+    def partial(user):
+        """
+        Marks a user loaded without the relation lists (RELATION_FIELDS).
+        The lists are read from the database on first access instead of
+        reading as empty lists.
+        :param user: User object or the son of a cached snapshot.
+        :return user: User object or None.
+        """
+        if user is None:
+            return None
+        if not isinstance(user, User):
+            user = User._from_son(dict(user))
+        user._unloaded = RELATION_FIELDS
+        return user
+
+    def _load_relations(self):
+        unloaded, self._unloaded = self._unloaded, ()
+        son = User.objects(id=self.id).only(*unloaded).as_pymongo()\
+            .first() or {}
+        for field in unloaded:
+            if field in self._changed_fields:
+                continue            # assigned before it was read
+            # Not marked as changed, save() must not $set the lists.
+            self._data[field] = self._fields[field].to_python(
+                son.get(field) or [])
+
+    def save(self, *args, **kwargs):
+        result = super(User, self).save(*args, **kwargs)
+        self.invalidate_caches()
+        return result
+
+    def invalidate_caches(self):
+        """
+        Drops the cached snapshots of the user (token and principal cache),
+        called after every write to the user document.
+        """
+        # Cached snapshots are stale, e.g. after a password change.
+        token_cache.invalidate_user(self.id)
+        principal_cache.invalidate(self.id)
+
     def set_password(self, password):
         """
         Generate and store password hash for the user.
         :param password: user provided password.
         """
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = hash_password(password)
 
     def verify_password(self, password):
         """
-        Verify user password against the hash stored in database.
+        Verify user password against the hash stored in database. If the
+        hash was generated with other parameters than the configured ones,
+        the password is hashed again and stored.
         :param password: user password.
         :return: True if verified else False.
         """
-        return check_password_hash(self.password_hash, password)
+        if not check_password(self.password_hash, password):
+            return False
+        if needs_rehash(self.password_hash):
+            try:
+                self.password_hash = hash_password(password)
+                User.objects(id=self.id).update_one(
+                    set__password_hash=self.password_hash)
+                self.invalidate_caches()
+            except Exception as el1:
+                logging.error('Unable to rehash password of user={0}. '
+                              'Error={1}'.format(self.id, el1))
+        return True
 
     def can(self, permission):
         """
@@ -768,22 +1360,36 @@ class User(UserMixin, db.Document):
         :param expiration: expiry of token.
         :return: authentication token.
         """
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
+        s = token_serializer(expiration)
         return s.dumps({'id': self.id})
 
     @staticmethod
     def verify_auth_token(token):
         """
         Verify the authentication token generated for the user authentication.
+        Verified tokens are cached with a snapshot of the user (without the
+        relation lists), so repeated requests need no database read. The
+        relation lists of the returned user are loaded on first access.
         :param token: authentication token.
         :return: User object if token is valid/not-expired.
         """
-        s = Serializer(current_app.config['SECRET_KEY'])
+        digest = token_digest(token)
+        son = token_cache.get(digest)
+        if son is not None:
+            return User.partial(son)
+        s = token_serializer()
         try:
-            data = s.loads(token)
+            data, header = s.loads(token, return_header=True)
         except (SignatureExpired, BadSignature):
             return None
-        return User.objects(id=data['id']).first()
+        user = User.objects(id=data.get('id')).exclude(
+            *RELATION_FIELDS).first()
+        if user is not None and header.get('exp'):
+            son = user.to_mongo().to_dict()
+            for field in RELATION_FIELDS:
+                son.pop(field, None)
+            token_cache.set(digest, user.id, son, header['exp'])
+        return User.partial(user)
 
     def generate_pwd_reset_token(self, expiration=3600):
         """
@@ -791,7 +1397,7 @@ class User(UserMixin, db.Document):
         :param expiration: validity for the token (default=3600sec).
         :return: password reset token.
         """
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
+        s = token_serializer(expiration)
         return s.dumps({'reset': self.id})
 
     @staticmethod
@@ -801,7 +1407,7 @@ class User(UserMixin, db.Document):
         :param pwd_reset_token: password reset token.
         :return: User object if token is valid/not-expired.
         """
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = token_serializer()
         try:
             data = s.loads(pwd_reset_token)
         except (SignatureExpired, BadSignature):
@@ -816,7 +1422,7 @@ class User(UserMixin, db.Document):
         :return: True if successful, False otherwise.
                  None if token is bad/expired.
         """
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = token_serializer()
         try:
             data = s.loads(pwd_reset_token)
         except (SignatureExpired, BadSignature):
@@ -832,7 +1438,7 @@ class User(UserMixin, db.Document):
         Generates a account confirmation token for the user.`
         :return: account confirmation token.
         """
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
+        s = token_serializer(expiration)
         return s.dumps({'confirm': self.id})
 
     def confirm(self, confirmation_token):
@@ -842,7 +1448,7 @@ class User(UserMixin, db.Document):
         :return: True if successful, False otherwise.
                  None if token is bad/expired.
         """
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = token_serializer()
         try:
             data = s.loads(confirmation_token)
         except (SignatureExpired, BadSignature):
@@ -855,7 +1461,7 @@ class User(UserMixin, db.Document):
 
     @staticmethod
     def verify_confirmation_token(confirmation_token):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = token_serializer()
         try:
             data = s.loads(confirmation_token)
         except (SignatureExpired, BadSignature):
@@ -878,12 +1484,12 @@ class User(UserMixin, db.Document):
         :param expiration: expiry time of token (default=3600).
         :return:
         """
-        s = Serializer(current_app.config['SECRET_KEY'], expires_in=expiration)
+        s = token_serializer(expiration)
         return s.dumps({'change_login': self.id,
                         'new_login': username_or_email})
 
     def change_login(self, login_change_token):
-        s = Serializer(current_app.config['SECRET_KEY'])
+        s = token_serializer()
         try:
             data = s.loads(login_change_token)
         except (SignatureExpired, BadSignature):
@@ -1052,6 +1658,60 @@ class User(UserMixin, db.Document):
                 pass
 
 
+# Queries served by the indexes declared in the document meta, reported by
+# `manage.py ensure_indexes`.
+INDEX_QUERIES = {
+    'Post': {
+        'timestamp_-1__id_-1': 'post_app.index: Post.objects().order_by('
+                               '"-timestamp") and its keyset pages',
+        'author_id_1_timestamp_-1__id_-1': 'post_app.my_posts: Post.objects('
+                                           'author_id=...).order_by('
+                                           '"-timestamp")',
+    },
+    'Comment': {
+        'c_type_1_post_id_1_timestamp_-1__id_-1': 'post_page/activity_page: '
+                                                  'Comment.objects(c_type=..'
+                                                  '., post_id=...).order_by('
+                                                  '"-timestamp") and its '
+                                                  'count()',
+    },
+    'Timeline': {
+        '_id_': 'post_app.index: Timeline.objects(user_id=...), one lookup '
+                'per home timeline page',
+    },
+    'Diary': {
+        'author_id_1_timestamp_-1__id_-1': 'diary_app.index: Diary.objects('
+                                           'author_id=...).order_by('
+                                           '"-timestamp")',
+    },
+    'Activity': {
+        'timestamp_-1__id_-1': 'activity_app.index: Activity.objects()'
+                               '.order_by("-timestamp")',
+        'author_id_1_timestamp_-1__id_-1': 'activity_app.my_activities: '
+                                           'Activity.objects(author_id=...)'
+                                           '.order_by("-timestamp")',
+        'activity_time_1': 'range/sort queries on Activity.activity_time',
+    },
+}
+
+
 @login_manager.user_loader
 def load_user(user_id):
-    return User.objects(id=int(user_id)).first()
+    """
+    Loads the user of the session, from the principal cache if possible.
+    The relation lists are loaded on first access, see User.partial().
+    """
+    try:
+        user_id = int(user_id)
+    except (TypeError, ValueError):
+        return None
+    son = principal_cache.get(user_id)
+    if son is not None:
+        return User.partial(son)
+    user = User.objects(id=user_id).exclude(*RELATION_FIELDS).first()
+    if user is not None:
+        son = user.to_mongo().to_dict()
+        for field in RELATION_FIELDS:
+            son.pop(field, None)
+        principal_cache.set(user_id, son)
+    return User.partial(user)
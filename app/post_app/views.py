@@ -4,10 +4,17 @@ View controller for post app view.
 from datetime import datetime
 from . import post_app, pa_logger
 from .forms import PostForm, CommentForm
-from app.models import Post, Tag, Comment
+from app.models import Post, Tag, Comment, Timeline
+from app.common.user_resolver import prefetch_users
+from app.common.pagination import paginate, use_keyset
+from app.common.tag_cache import tag_cache
+from app.common.conditional import page_etag, is_not_modified, \
+    not_modified, with_validators
+from app.common.serializers import serialize_posts
 from flask_login import login_required, current_user
 from flask import redirect, url_for, request, current_app, \
-    render_template, abort, flash
+    render_template, abort, flash, jsonify
+from flask_mongoengine import Pagination
 
 
 @post_app.route('/', methods=['GET', 'POST'])
@@ -18,31 +25,64 @@ def index():
     if form.validate_on_submit():
         post = Post(body=form.body.data,
                     author_id=current_user.id)
-        tag_data = form.tags.data
-        if tag_data != '':
-            tags = [t.strip() for t in tag_data.split(',')]
-            for tag in tags:
-                if Tag.objects(text=tag).first() is not None:
-                    post.tags.append(Tag.objects(text=tag).first().id)
-                else:
-                    t = Tag(text=tag).save()
-                    post.tags.append(t.id)
-                post.tags = list(set(post.tags))        # avoid repeated tags
+        post.tags = Tag.resolve_ids(form.tags.data.split(','))
         post.save()
+        Timeline.fan_out(post)
         return redirect(url_for('.index'))
 
-    page = request.args.get('page', 1, type=int)
-    qs = Post.objects().order_by('-timestamp')
-    pagination = qs.paginate(page,
-                             per_page=current_app.config['POSTS_PER_PAGE'],
-                             error_out=False)
+    pagination = _timeline_pagination(current_user) \
+        if current_app.config['HOME_TIMELINE'] else None
+    if pagination is None:
+        qs = Post.objects().order_by('-timestamp')
+        pagination = paginate(qs, current_app.config['POSTS_PER_PAGE'])
     posts = pagination.items
-    pa_logger.info('Index page displaying {0} post items to user='
-                   '{1}'.format(len(posts), current_user.id))
+    prefetch_users(p.author_id for p in posts)
+    pa_logger.info('Index page displaying %s post items to user='
+                   '%s', len(posts), current_user.id)
     return render_template('post/index.html', form=form, posts=posts,
                            pagination=pagination)
 
 
+def _timeline_pagination(user):
+    """
+    Paginates the home timeline of a user. The post ids of the page come
+    from the timeline and the posts are fetched with a single query.
+    :param user: owner of the timeline.
+    :return pagination: Pagination with posts of the requested page or
+    None if the user has no timeline.
+    """
+    post_ids = Timeline.post_ids(user)
+    if post_ids is None:
+        return None
+    page = request.args.get('page', 1, type=int)
+    pagination = Pagination(post_ids, page,
+                            current_app.config['POSTS_PER_PAGE'])
+    posts = Post.objects.in_bulk(pagination.items)
+    pagination.items = [posts[i] for i in pagination.items if i in posts]
+    return pagination
+
+
+@post_app.route('/json')
+@login_required
+def posts_json():
+    """
+    Returns a page of the post feed as JSON. The page is selected like on
+    the index page, with ?page= or with ?after=/?before= tokens.
+    """
+    qs = Post.objects().order_by('-timestamp')
+    pagination = paginate(qs, current_app.config['POSTS_PER_PAGE'])
+    result = {'posts': serialize_posts(pagination.items)}
+    if getattr(pagination, 'keyset', False):
+        result['prev'] = pagination.prev_cursor \
+            if pagination.has_prev else None
+        result['next'] = pagination.next_cursor \
+            if pagination.has_next else None
+    else:
+        result['page'] = pagination.page
+        result['pages'] = pagination.pages
+    return jsonify(result)
+
+
 @post_app.route('/my_posts', methods=['GET', 'POST'])
 @login_required
 def my_posts():
@@ -50,27 +90,17 @@ def my_posts():
     if form.validate_on_submit():
         post = Post(body=form.body.data,
                     author_id=current_user.id)
-        tag_data = form.tags.data
-        if tag_data != '':
-            tags = [t.strip() for t in tag_data.split(',')]
-            for tag in tags:
-                if Tag.objects(text=tag).first() is not None:
-                    post.tags.append(Tag.objects(text=tag).first().id)
-                else:
-                    t = Tag(text=tag).save()
-                    post.tags.append(t.id)
-                post.tags = list(set(post.tags))        # avoid repeated tags
+        post.tags = Tag.resolve_ids(form.tags.data.split(','))
         post.save()
+        Timeline.fan_out(post)
         return redirect(url_for('.my_posts'))
 
-    page = request.args.get('page', 1, type=int)
     qs = Post.objects(author_id=current_user.id).order_by('-timestamp')
-    pagination = qs.paginate(page,
-                             per_page=current_app.config['POSTS_PER_PAGE'],
-                             error_out=False)
+    pagination = paginate(qs, current_app.config['POSTS_PER_PAGE'])
     posts = pagination.items
-    pa_logger.info('Index page displaying {0} personal posts to user='
-                   '{1}'.format(len(posts), current_user.id))
+    prefetch_users(p.author_id for p in posts)
+    pa_logger.info('Index page displaying %s personal posts to user='
+                   '%s', len(posts), current_user.id)
     return render_template('post/my_posts.html', form=form, posts=posts,
                            pagination=pagination)
 
@@ -80,29 +110,21 @@ def my_posts():
 def edit(id):
     post = Post.objects(id=id).first_or_404()
     if current_user.id != post.author_id:
-        pa_logger.warn('user={0} tried to edit inaccessible '
-                       'post={1}'.format(current_user.id, post.id))
+        pa_logger.warn('user=%s tried to edit inaccessible '
+                       'post=%s', current_user.id, post.id)
         abort(403)
     form = PostForm()
     if form.validate_on_submit():
         post.body = form.body.data
         post.timestamp = datetime.utcnow()
-        tag_data = form.tags.data
-        if tag_data != '':
-            tags = [t.strip() for t in tag_data.split(',')]
-            for tag in tags:
-                if Tag.objects(text=tag.strip()).first() is not None:
-                    post.tags.append(Tag.objects(text=tag).first().id)
-                else:
-                    t = Tag(text=tag).save()
-                    post.tags.append(t.id)
-            post.tags = list(set(post.tags))            # avoid repeated tags
+        # keep the existing tags, avoid repeated tags
+        post.tags = list(set(post.tags + Tag.resolve_ids(
+            form.tags.data.split(','))))
         post.save()
         flash('Post has been updated.')
         return redirect(url_for('.post_page', id=post.id))
     form.body.data = post.body
-    form.tags.data = ','.join([Tag.objects(id=i).first().text for i in
-                               post.tags])
+    form.tags.data = ','.join(tag_cache.get_texts(post.tags))
     return render_template('post/edit_post.html', form=form)
 
 
@@ -117,10 +139,18 @@ def post_page(id):
                           c_type=current_app.config["COMMENT_TYPE"]["POST"],
                           post_id=post.id)
         comment.save()
+        Comment.update_comment_count(comment.c_type, post.id, 1,
+                                     comment.timestamp)
         flash('Your comment has been posted.')
         return redirect(url_for('.post_page', id=post.id, page=-1))
+    last_modified = max(filter(None, (post.timestamp, post.last_comment_at)),
+                        default=None)
+    etag = page_etag('post', post.id, post.version, post.timestamp,
+                     post.last_comment_at, post.comment_count)
+    if is_not_modified(etag):
+        return not_modified(etag, last_modified)
     page = request.args.get('page', 1, type=int)
-    if page == -1:
+    if page == -1 and not use_keyset():
         page = (Comment.objects(
             c_type=current_app.config["COMMENT_TYPE"]["POST"],
             post_id=post.id).count() - 1) // \
@@ -128,26 +158,28 @@ def post_page(id):
     qs = Comment.objects(
         c_type=current_app.config["COMMENT_TYPE"]["POST"],
         post_id=post.id).all().order_by('-timestamp')
-    pagination = qs.paginate(
-        page, per_page=current_app.config['POSTS_PER_PAGE'], error_out=False)
+    pagination = paginate(qs, current_app.config['POSTS_PER_PAGE'], page=page)
     comments = pagination.items
-    return render_template('post/post.html', posts=[post], form=form,
-                           comments=comments, pagination=pagination)
+    prefetch_users([post.author_id] + [c.commenter_id for c in comments])
+    return with_validators(
+        render_template('post/post.html', posts=[post], form=form,
+                        comments=comments, pagination=pagination),
+        etag, last_modified)
 
 
 @post_app.route('/moderate/enable/<int:id>')
 def moderate_enable(id):
-    comment = Comment.objects.first_or_404(id)
-    comment.disabled = False
-    comment.save()
-    return redirect(url_for('.moderate',
+    comment = Comment.set_disabled(id, False)
+    if comment is None:
+        abort(404)
+    return redirect(url_for('.post_page', id=comment.post_id,
                             page=request.args.get('page', 1, type=int)))
 
 
 @post_app.route('/moderate/disable/<int:id>')
 def moderate_disable(id):
-    comment = Comment.objects.get_or_404(id)
-    comment.disabled = True
-    comment.save()
-    return redirect(url_for('.moderate',
+    comment = Comment.set_disabled(id, True)
+    if comment is None:
+        abort(404)
+    return redirect(url_for('.post_page', id=comment.post_id,
                             page=request.args.get('page', 1, type=int)))
@@ -3,7 +3,16 @@ Defining forms for suggestion box application
 """
 from flask_wtf import FlaskForm
 from wtforms import StringField, SubmitField, SelectField
-from app.models import Suggestion
+
+
+class RemoteSelectField(SelectField):
+    """
+    Select field whose options are loaded by the browser from a JSON source,
+    so any integer choice is accepted here and checked by the view.
+    """
+
+    def pre_validate(self, form):
+        pass
 
 
 class SuggestionBox(FlaskForm):
@@ -11,8 +20,6 @@ class SuggestionBox(FlaskForm):
     Form template for Suggestion box.
     """
     query = StringField('What would you like to know?')
-    common = SelectField(
-        'Frequent queries', coerce=int,
-        choices=[(0, 'Select an query')]
-                 + list(Suggestion.objects.values_list('id', 'query')))
+    common = RemoteSelectField('Frequent queries', coerce=int,
+                               choices=[(0, 'Select an query')], default=0)
     submit = SubmitField('Ask')
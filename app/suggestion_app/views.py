@@ -4,37 +4,76 @@ View controller for suggestion box application
 from . import sugg_app, sa_logger
 from .forms import SuggestionBox
 from app.models import Suggestion
+from app.common.suggestion_index import suggestion_index
+from app.common.suggestion_vectors import suggestion_vectors
+from app.common.suggestion_choices import suggestion_choices
 from flask_login import login_required
-from flask import render_template, flash
+from flask import render_template, flash, current_app, request, jsonify
+
+
+def _match(text, k):
+    """
+    Returns the ids of the suggestions best matching a query, ranked by the
+    TF-IDF vectors or by the inverted index if the vectors are missing.
+    :param text: user query.
+    :param k: maximum number of results.
+    :return ids: list of suggestion ids, best first.
+    """
+    hits = suggestion_vectors.search(text, k)
+    if hits is None:
+        hits = suggestion_index.search(text, k)
+    return [hit[0] for hit in hits]
 
 
 @sugg_app.route('/', methods=['GET', 'POST'])
 @login_required
 def index():
     form = SuggestionBox()
-    # populate the common queries available in database already.
-    form.common.choices = [(0, 'Select an query')] + list(
-        Suggestion.objects.values_list('id', 'query'))
     if form.validate_on_submit():
+        similar = []
         if form.query.data.strip():
-            s = Suggestion.objects(
-                query__icontains=form.query.data.strip()).first()
-        elif form.common.data != 0:
+            ids = _match(form.query.data,
+                         current_app.config['SIMILAR_SUGGESTIONS'] + 1)
+            found = Suggestion.objects.in_bulk(ids)
+            hits = [found[i] for i in ids if i in found]
+            s = hits[0] if hits else None
+            similar = [h.query for h in hits[1:]]
+        elif form.common.data:
             s = Suggestion.objects(id=form.common.data).first()
+            if s is not None:
+                # keep the selected query in the dropdown, the choices list
+                # of the field is shared by all forms and must not change
+                form.common.choices = [(0, 'Select an query'),
+                                       (s.id, s.query)]
         else:
             flash('Please enter or choose a valid query.')
             return render_template('suggestion/suggestion_box.html', form=form)
         if s is None:
             flash('Unable to find related responses')
             sa_logger.info('Unable to find any responses for query='
-                           '{0}'.format(form.query.data))
+                           '%s', form.query.data)
             return render_template('suggestion/suggestion_box.html',
                                    message='Unable to find matching '
                                            'responses',
                                    form=form)
         else:
             flash('Responses retrieved')
-            print(s.responses)
             return render_template('suggestion/suggestion_box.html',
-                                   responses=s.responses, form=form)
+                                   responses=s.responses, similar=similar,
+                                   form=form)
     return render_template('suggestion/suggestion_box.html', form=form)
+
+
+@sugg_app.route('/choices')
+@login_required
+def choices():
+    """
+    JSON source of the frequent queries dropdown, filtered by the prefix
+    ?q= and paginated with ?page=.
+    """
+    items, more = suggestion_choices.search(
+        request.args.get('q', ''), request.args.get('page', 1, type=int),
+        current_app.config['SUGGESTION_CHOICES_PER_PAGE'])
+    return jsonify({'results': [{'id': s_id, 'text': query}
+                                for s_id, query in items],
+                    'more': more})
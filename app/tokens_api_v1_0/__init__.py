@@ -13,4 +13,4 @@ tokens_api = Blueprint('tokens_api', __name__)
 tokens_api_logger = setup_logging(__name__, 'logs/tokens_api.log', 10000000, 5)
 
 
-from app.tokens_api_v_1_0 import authentication, views
+from app.tokens_api_v1_0 import authentication, views
@@ -3,9 +3,9 @@ Authentication module for token authentication.
 """
 
 from flask import g, request, current_app
-from flask.ext.httpauth import HTTPBasicAuth
+from flask_httpauth import HTTPBasicAuth
 from app.models import User, AnonymousUser
-from app.tokens_api_v_1_0 import tokens_api
+from app.tokens_api_v1_0 import tokens_api
 from app.api_errors import unauthorized
 
 auth = HTTPBasicAuth()
@@ -19,15 +19,14 @@ def verify_password(email_or_username_or_token, password):
         return False
 
     # username/email-address used
-    subscriber = Subscriber.objects(email=email_or_username_or_token).first() \
-            or Subscriber.objects(username=email_or_username_or_token).first()
+    subscriber = User.find_by_login(email_or_username_or_token)
     if subscriber is not None:
         g.current_user = subscriber
         g.token_used = False
         return subscriber.verify_password(password)
 
     # token used
-    g.current_user = Subscriber.verify_auth_token(email_or_username_or_token)
+    g.current_user = User.verify_auth_token(email_or_username_or_token)
     g.token_used = True
     return g.current_user is not None
 
@@ -45,7 +44,7 @@ def login_exempt(f):
 login_required_dummy_view = auth.login_required(lambda: None)
 
 
-@tokensapi.before_request
+@tokens_api.before_request
 def before_request():
     # make sure that endpoints are exempted from login
     # use split to handle blueprint static routes as well.
@@ -7,7 +7,7 @@ from flask import jsonify, request, g
 from werkzeug.exceptions import BadRequest
 from app.tokens_api_v1_0 import tokens_api, tokens_api_logger
 from app.tokens_api_v1_0.authentication import login_exempt
-from app.models import User
+from app.models import User, CREDENTIAL_FIELDS
 from app.api_errors import bad_request, unauthorized, custom_error
 
 
@@ -21,12 +21,12 @@ def get_auth_token():
     if g.current_user.is_anonymous or g.token_used:
         # g.token_used in the condition, so that users can not
         # use the previous token to generate a new one.
-        tokens_api_logger.warning('User %d used token to get a new token.'
-                                  % g.current_user.id)
+        tokens_api_logger.warning('User %d used token to get a new token.',
+                                  g.current_user.id)
         return unauthorized('invalid credentials provided for authentication '
                             'token generation.')
     tokens_api_logger.info('Authentication token successfully generated '
-                           'for User %d' % g.current_user.id)
+                           'for User %d', g.current_user.id)
     return jsonify({
         'auth-token': g.current_user.generate_auth_token(expiration=3600),
         'expiration': 3600})
@@ -45,7 +45,7 @@ def get_confirmation_token():
         return unauthorized('invalid credentials used for confirmation token '
                             'generation.')
     tokens_api_logger.info('Confirmation token successfully generated for '
-                           'user %d' % g.current_user.id)
+                           'user %d', g.current_user.id)
     return jsonify({
         'conf_token': g.current_user.generate_confirmation_token(
             expiration=3600),
@@ -81,8 +81,8 @@ def get_login_change_token():
         request_data = json.loads(request.data)
         username_or_email = request_data.get('username') or \
             request_data.get('email')
-        tokens_api_logger.info('Returning login change token for User %d'
-                              % g.current_user.id)
+        tokens_api_logger.info('Returning login change token for User %d',
+                              g.current_user.id)
         return jsonify({
             'login_change_token': g.current_user.generate_login_change_token(
                 username_or_email=username_or_email,
@@ -90,8 +90,8 @@ def get_login_change_token():
             'expiration': 3600}), 200
     except (BadRequest, AttributeError, ValueError):
         tokens_api_logger.warning('Invalid data provided with request to '
-                                  'generate login change token by User %d'
-                                  % g.current_user.id)
+                                  'generate login change token by User %d',
+                                  g.current_user.id)
         return custom_error(error='Invalid json',
                             message='Invalid data provided with generate '
                                     'login change token',
@@ -111,18 +111,18 @@ def get_change_password_token():
         username_or_email = request_data.get('username') or \
             request_data.get('email')
         tokens_api_logger.debug('login data retrieved from json data')
-        user = User.objects(username=username_or_email).first() or \
-            User.objects(email=username_or_email).first()
+        user = User.find_by_login(username_or_email,
+                                  fields=CREDENTIAL_FIELDS)
         if user is not None:
             tokens_api_logger.info('Returning password change token for'
-                                   ' User %d' % user.id)
+                                   ' User %d', user.id)
             return jsonify({
                 'pwd_change_token': user.generate_pwd_reset_token(
                     expiration=3600),
                 'expiration': 3600
             })
         tokens_api_logger.debug('User %d successfully retrieved from '
-                                'database.' % user.id)
+                                'database.', user.id)
         tokens_api_logger.warning('Password change token requested for '
                                   'non-existing user.')
         return bad_request('User registered with given login '
@@ -19,8 +19,7 @@ def verify_password(email_or_username_or_token, password):
         return False
 
     # username/email-address used
-    subscriber = User.objects(email=email_or_username_or_token).first() \
-        or User.objects(username=email_or_username_or_token).first()
+    subscriber = User.find_by_login(email_or_username_or_token)
     if subscriber is not None:
         g.current_user = subscriber
         g.token_used = False
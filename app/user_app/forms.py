@@ -89,12 +89,12 @@ class EditProfileAdminForm(Form):
 
     def validate_email(self, field):
         if field.data != self.user.email \
-                and User.objects(email=field.data).first() is not None:
+                and User.find_duplicates(email=field.data)[1]:
             raise ValidationError('Email address is already registered.')
 
     def validate_username(self, field):
         if field.data != self.user.username \
-                and User.objects(username=field.data).first() is not None:
+                and User.find_duplicates(username=field.data)[0]:
             raise ValidationError('Username already exists.')
 
 
@@ -120,9 +120,9 @@ class RegistrationForm(Form):
     submit = SubmitField('Register')
 
     def validate_email(self, field):
-        if User.objects(email=field.data).first():
+        if User.find_duplicates(email=field.data)[1]:
             raise ValidationError('Email already registered.')
 
     def validate_username(self, field):
-        if User.objects(username=field.data).first():
+        if User.find_duplicates(username=field.data)[0]:
             raise ValidationError('Username already exists.')
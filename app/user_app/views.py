@@ -6,6 +6,7 @@ from flask_login import login_required, current_user
 from app.user_app import user_app, user_app_logger
 from app.user_app.forms import EditProfileForm, RegistrationForm
 from app.models import User, Address, Permission
+from app.common.user_resolver import prefetch_users
 from helper.countries import countries, get_country_key
 
 
@@ -53,27 +54,26 @@ def profile_page(username_or_email):
     whose profile page is accessed.
     :return:
     """
-    user = User.objects(username=username_or_email).first() or \
-        User.objects(username=username_or_email).first()
+    user = User.find_by_login(username_or_email, exclude=None)
     if user is None:
         user_app_logger.warning('User %d request for info page of '
-                                'non existing user %s' % (current_user.id,
-                                                          username_or_email))
+                                'non existing user %s', current_user.id,
+                                                          username_or_email)
         return render_template('errors/404.html')
     """
     If the logged in user is trying to access some other user's
     profile, minimal information is presented.
     """
     if user.id != current_user.id and \
-        User.objects(id=current_user.id).first().permissions != \
-            Permission.PERM_ADMIN:
+            current_user.permissions != Permission.PERM_ADMIN:
         user_app_logger.info('Displaying user %d profile page for '
-                             'user %d' % (user.id, current_user.id))
+                             'user %d', user.id, current_user.id)
         return render_template('user/profile_minimal.html',
                                user=user)
     # Full information is provided to the user for his own profile view.
     user_app_logger.info('displaying profile page with full information to '
-                         'user %d' % user.id)
+                         'user %d', user.id)
+    prefetch_users(user.friends + user.teachers + user.parents)
     return render_template('user/profile.html', user=user)
 
 
@@ -89,7 +89,7 @@ def profile_page_id(user_id):
     user = User.objects(id=user_id).first()
     if user is None:
         user_app_logger.error('User %d requested profile page for non'
-                              ' existing user %d' % (current_user.id, user_id))
+                              ' existing user %d', current_user.id, user_id)
         return render_template('errors/404.html')
     return redirect(url_for('user_app.profile_page',
                             username_or_email=user.username))
@@ -108,10 +108,10 @@ def edit_profile():
         phone=current_user.phone,
         country=get_country_key(current_user.address.country) if
         current_user.address else None)
-    user_app_logger.debug('edit profile form populated for user %d' %
+    user_app_logger.debug('edit profile form populated for user %d',
                           current_user.id)
     if form.validate_on_submit():
-        user_app_logger.debug('edit profile form submitted by user %d' %
+        user_app_logger.debug('edit profile form submitted by user %d',
                               current_user.id)
         current_user.first_name = form.first_name.data
         current_user.last_name = form.last_name.data
@@ -119,7 +119,7 @@ def edit_profile():
         # If there is no address previously, create address object.
         if current_user.address is None:
             user_app_logger.debug('No address previously registered to '
-                                  'user={0}'.format(current_user.id))
+                                  'user=%s', current_user.id)
             current_user.address = Address()
         current_user.address.street = form.street.data
         current_user.address.postal_code = form.postal_code.data
@@ -127,12 +127,12 @@ def edit_profile():
         current_user.address.state = form.state.data
         current_user.address.country = countries.get(form.country.data)
         current_user.save()
-        user_app_logger.info('user %d profile updated successfully' %
+        user_app_logger.info('user %d profile updated successfully',
                              current_user.id)
         flash('Profile information has been updated.')
         user_app_logger.debug(
-            'user={0} being redirected to profile page after profile '
-            'update'.format(current_user.id))
+            'user=%s being redirected to profile page after profile '
+            'update', current_user.id)
         return redirect(url_for('user_app.profile_page',
                                 username_or_email=current_user.username))
     # Populate the form for GET request.
@@ -142,5 +142,5 @@ def edit_profile():
         form.city.data = current_user.address.city or ''
         form.state.data = current_user.address.state or ''
     user_app_logger.info('Edit profile form being displayed to user='
-                         '{0}'.format(current_user.id))
+                         '%s', current_user.id)
     return render_template('user/edit_profile.html', form=form)
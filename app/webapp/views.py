@@ -2,9 +2,18 @@
 Module containing generic functions for Jinja2 Template.
 """
 
-from flask import render_template, current_app, abort, request
+from flask import render_template, current_app, abort, request, Response
+from flask_login import current_user
+from jinja2 import Markup
+from pymongo import UpdateOne
 from app.webapp import webapp, webapp_logger
 from app.models import User, Comment, Tag
+from app.common.user_resolver import resolve_user
+from app.common.tag_cache import tag_cache
+from app.common.tokens import token_cache
+from app.common.principal_cache import principal_cache
+from app.common.metrics import request_metrics, render_gauge
+from app.common.fragment_cache import fragment_cache
 
 
 @webapp.route('/')
@@ -23,6 +32,32 @@ def server_shutdown():
     shutdown()
     return 'Shutting down...'
 
+
+@webapp.route('/metrics')
+def metrics():
+    """
+    Returns the request metrics and cache statistics of this process in
+    Prometheus text format, to allowed clients only.
+    """
+    if not request_metrics.allowed():
+        abort(404)
+    caches = [('tag_texts', tag_cache.texts.stats()),
+              ('tag_ids', tag_cache.ids.stats()),
+              ('tokens', token_cache.stats()),
+              ('users', principal_cache.stats()),
+              ('fragments', fragment_cache.stats())]
+    extra = []
+    for name, key, description, kind in (
+            ('cache_hits_total', 'hits', 'Cache hits.', 'counter'),
+            ('cache_misses_total', 'misses', 'Cache misses.', 'counter'),
+            ('cache_size', 'size', 'Number of cached entries.', 'gauge')):
+        extra.extend(render_gauge(
+            name, description,
+            [([('cache', cache)], stats[key]) for cache, stats in caches],
+            kind))
+    return Response(request_metrics.render(extra),
+                    mimetype='text/plain; version=0.0.4')
+
 """
 Helper functions for JINJA2 templates. These functions are used to performs
 lightweight functionality inside JINJA2 template without providing full
@@ -37,12 +72,12 @@ def get_fullname_from_id(user_id):
     :param user_id: ID of the subscriber whose first and last name is required.
     :return (firstname, lastname): String tuple
     """
-    user = User.objects(id=user_id).first()
+    user = resolve_user(user_id)
     if user is not None:
-        webapp_logger.debug('Returning subscriber %d name' % user.id)
+        webapp_logger.debug('Returning subscriber %d name', user.id)
         return user.first_name, user.last_name
     else:
-        webapp_logger.warning('Subscriber %d not found in database.' % user_id)
+        webapp_logger.warning('Subscriber %s not found in database.', user_id)
         return ''
 
 
@@ -53,53 +88,58 @@ def get_username_from_id(user_id):
     :param user_id: ID of the subscriber whose first and last name is required.
     :return username: String.
     """
-    user = User.objects(id=user_id).first()
-    if user_id is not None:
+    user = resolve_user(user_id)
+    if user is not None:
         webapp_logger.debug('Returning user %d username to jinja2 '
-                            'template.' % user.id)
+                            'template.', user.id)
         return user.username
     else:
-        webapp_logger.warning('User %d not found in database.' % user_id)
+        webapp_logger.warning('User %s not found in database.', user_id)
         return ''
 
 
 @webapp.add_app_template_global
-def get_post_comment_count(post_id):
-    """
-    Returns the count for comments on given post.
-    :param user_id: ID of the subscriber whose first and last name is required.
-    :return username: String.
-    """
-    return Comment.objects(c_type=current_app.config["COMMENT_TYPE"][
-        "POST"], post_id=post_id).count()
-
-@webapp.add_app_template_global
-def get_activity_comment_count(activity_id):
+def get_tag_text(tag_id):
     """
-    Returns the count for comments on given activity.
-    :param user_id: ID of the subscriber whose first and last name is required.
-    :return username: String.
+    Returns the text of a tag from the tag cache.
+    :param tag_id: ID of the tag.
+    :return text of tag: String.
     """
-    return Comment.objects(c_type=current_app.config["COMMENT_TYPE"][
-        "ACTIVITY"], post_id=activity_id).count()
+    texts = tag_cache.get_texts([tag_id])
+    return texts[0] if texts else ''
 
 
 @webapp.add_app_template_global
-def get_tag_text(tag_id):
+def get_tag_text_list(tag_id_list):
     """
+    Returns the text of tags from the tag cache.
+    :param tag_id: list of tag_ids.
+    :return list of tags (text): String.
     """
-    return Tag.objects(id=tag_id).first().text or ''
+    return ','.join(tag_cache.get_texts(tag_id_list))
 
 
 @webapp.add_app_template_global
-def get_tag_text_list(tag_id_list):
+def cached_fragment(template_name, kind, doc):
     """
-    Returns the text of tag from the database.
-    :param tag_id: list of tag_ids.
-    :return list of tags (text): String.
+    Renders a list item from the fragment cache. The template gets the
+    document as `item`, its output may only depend on the document and on
+    whether the current user is the author.
+    :param template_name: template of the item.
+    :param kind: kind of the document, e.g. 'post'.
+    :param doc: Post or Activity object.
+    :return html: Markup.
     """
-    return ','.join([Tag.objects(id=i).first().text
-                     for i in tag_id_list])
+    is_author = current_user.is_authenticated and \
+        current_user.id == doc.author_id
+    if not fragment_cache.enabled:
+        return Markup(render_template(template_name, item=doc))
+    key = fragment_cache.key(kind, doc.id, doc.version, is_author)
+    html = fragment_cache.get(key)
+    if html is None:
+        html = render_template(template_name, item=doc)
+        fragment_cache.set(key, html)
+    return Markup(html)
 
 
 def _add_user_associations():
@@ -198,13 +238,13 @@ def _add_user_associations():
     user.teachers = [teacher.id]
     user.save()
 
-    # Add friendships
-    uid = User.objects.filter(role__ne=2).values_list('id')
-    for user in User.objects.all():
-        for i in uid:
-            if user.id != i:
-                user.friends.append(i)
-                user.save()
+    # Add friendships with one bulk write instead of a save per friendship
+    uid = list(User.objects.filter(role__ne=2).scalar('id'))
+    User._get_collection().bulk_write(
+        [UpdateOne({'_id': i},
+                   {'$addToSet': {'friends': {'$each': [
+                       j for j in uid if j != i]}}})
+         for i in User.objects.scalar('id')], ordered=False)
 
 
 def _generate_dummy_data():
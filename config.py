@@ -13,6 +13,8 @@ class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or generate_secret_key()
     SSL_DISABLE = False
     APP_ADMIN = 'admin@example.com'
+    # Plain static urls are not cached, fingerprinted ones (see
+    # STATIC_ASSETS_DIR) are cached for STATIC_ASSETS_MAX_AGE seconds
     SEND_FILE_MAX_AGE_DEFAULT = 0       # Disable browser cache
     # WTF_CSRF_ENABLED = True
     POSTS_PER_PAGE = 10
@@ -22,6 +24,67 @@ class Config:
         "ACTIVITY": 2
     }
     DIARIES_PER_PAGE = 10
+    # Use newer/older continuation tokens instead of page numbers for feeds
+    CURSOR_PAGINATION = False
+    # Maximum number of tags kept in the in-process tag cache
+    TAG_CACHE_SIZE = 10000
+    # Number of document ids reserved at once by each worker process
+    ID_BLOCK_SIZE = 50
+    # Show the precomputed friend timeline instead of all posts on post index,
+    # enable after running manage.py rebuild_timelines. Users without a
+    # timeline see all posts.
+    HOME_TIMELINE = False
+    # Number of post ids kept on every home timeline
+    TIMELINE_LENGTH = 500
+    # Posts of users with more friends are merged into timelines on read
+    TIMELINE_FANOUT_LIMIT = 1000
+    # Seconds after which the suggestion index is reloaded from the database
+    SUGGESTION_INDEX_TTL = 300
+    # Number of similar queries shown with the responses of a suggestion
+    SIMILAR_SUGGESTIONS = 5
+    # Memory-mapped TF-IDF matrix of the suggestion table (requires numpy)
+    SUGGESTION_VECTORS_DIR = os.path.join(basedir, 'data',
+                                          'suggestion_vectors')
+    SUGGESTION_VECTORS_FEATURES = 2 ** 18
+    # Minimum seconds between two rebuilds of the matrix after edits
+    SUGGESTION_VECTORS_REBUILD_INTERVAL = 60
+    # Seconds between two checks of the suggestion version stamp
+    SUGGESTION_VERSION_CHECK = 5
+    SUGGESTION_CHOICES_PER_PAGE = 20
+    # Number of rows inserted at once by the csv loaders
+    CSV_BATCH_SIZE = 1000
+    # Verified API tokens cached per process, seconds an entry is trusted
+    TOKEN_CACHE_SIZE = 10000
+    TOKEN_CACHE_TTL = 60
+    # Werkzeug hash method and cost, hashes are upgraded on the next login
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:50000'
+    PASSWORD_SALT_LENGTH = 8
+    # Processes hashing passwords outside the request thread (0 = inline)
+    PASSWORD_HASH_POOL_SIZE = 0
+    # Session users cached per process, seconds an entry is trusted
+    USER_CACHE_SIZE = 10000
+    USER_CACHE_TTL = 60
+    # Blueprint loggers: level, 'text' or 'json' lines, records per write
+    LOG_LEVEL = 'INFO'
+    LOG_FORMAT = 'text'
+    LOG_BATCH_SIZE = 500
+    # Record request, MongoDB and template timings, exposed on /metrics to
+    # the listed addresses and to requests with 'Bearer <METRICS_TOKEN>'
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED') == '1'
+    METRICS_ALLOWED_IPS = ('127.0.0.1', '::1')
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+    # MongoDB commands slower than this are logged (None disables the log)
+    SLOW_QUERY_THRESHOLD_MS = 100
+    # Share of the slow reads which is explained in the background
+    SLOW_QUERY_EXPLAIN_RATE = 0.1
+    # Rendered post/activity list items cached per process (0 disables),
+    # seconds a fragment is served, optional directory shared by workers
+    FRAGMENT_CACHE_SIZE = 5000
+    FRAGMENT_CACHE_TTL = 300
+    FRAGMENT_CACHE_DIR = None
+    # Output of manage.py build_static, served under /assets
+    STATIC_ASSETS_DIR = os.path.join(basedir, 'app', 'static', 'dist')
+    STATIC_ASSETS_MAX_AGE = 365 * 24 * 3600
 
     @staticmethod
     def init_app(app):
@@ -33,6 +96,7 @@ class DevelopmentConfig(Config):
     Application configuration for development phase.
     """
     DEBUG = True
+    METRICS_ENABLED = True
     MONGODB_DB = 'development_db'
     MONGODB_HOST = '127.0.0.1'
     MONGODB_PORT = 27017
@@ -46,6 +110,7 @@ class TestingConfig(Config):
     TESTING = True
     WTF_CSRF_ENABLED = False
     PRESERVE_CONTEXT_ON_EXCEPTION = False
+    PASSWORD_HASH_METHOD = 'pbkdf2:sha256:1000'
     MONGODB_DB = 'testing_db'
     MONGODB_HOST = '127.0.0.1'
     MONGODB_PORT = 27017
@@ -63,6 +128,11 @@ class ProductionConfig(Config):
         'username': os.environ.get('MONGODB_USERNAME') or 'username',
         'password': os.environ.get('MONGODB_PASSWORD') or 'password'
     }
+    PASSWORD_HASH_POOL_SIZE = 2
+    # DEBUG/INFO records are not even created
+    LOG_LEVEL = 'WARNING'
+    LOG_FORMAT = 'json'
+    SLOW_QUERY_EXPLAIN_RATE = 0.01
 
     @classmethod
     def init_app(app):
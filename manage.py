@@ -3,10 +3,11 @@ Main module for managing Alfred-PAEdu application
 """
 import os
 import sys
+import time
 import logging
 from app import create_app, db
 from app.models import User, Permission, Tag, Post, Comment, Diary, Activity,\
-    Suggestion
+    Suggestion, Timeline
 from flask_script import Manager, Shell
 
 logging.basicConfig(level=logging.DEBUG,
@@ -51,6 +52,165 @@ def test(coverage=False, test_name=None):
     unittest.TextTestRunner(verbosity=2).run(tests)
 
 
+@manager.command
+def rebuild_comment_counts():
+    """
+    Recompute the comment counters of posts and activities, e.g. after a
+    bulk import of comments.
+    """
+    counts = Comment.rebuild_comment_counts()
+    for name, count in counts.items():
+        logger.info('{0} comment counters set for {1} documents.'.format(
+            name, count))
+
+
+@manager.command
+def rebuild_timelines():
+    """
+    Rebuild the home timelines of all users from the stored posts, e.g.
+    after bulk loading posts or friendships.
+    """
+    count = Timeline.rebuild()
+    logger.info('{0} home timelines rebuilt.'.format(count))
+
+
+@manager.command
+def build_suggestion_vectors():
+    """
+    Build and publish the TF-IDF matrix used to rank suggestions.
+    """
+    from app.common.suggestion_vectors import build_vectors
+    directory = app.config['SUGGESTION_VECTORS_DIR']
+    count = build_vectors(directory, app.config['SUGGESTION_VECTORS_FEATURES'])
+    logger.info('{0} suggestions written to {1}.'.format(count, directory))
+
+
+@manager.command
+def build_static():
+    """
+    Write fingerprinted and precompressed copies of the static files, served
+    with far-future caching after the next restart.
+    """
+    from app.common.static_assets import build_static as build
+    directory = app.config['STATIC_ASSETS_DIR']
+    manifest = build(app.static_folder, directory)
+    logger.info('{0} static files written to {1}.'.format(len(manifest),
+                                                          directory))
+
+
+@manager.command
+def ensure_indexes():
+    """
+    Build the indexes declared on the models (in the background) and report
+    which queries each of them serves.
+    """
+    from app.models import INDEX_QUERIES
+    for model in (Post, Timeline, Comment, Diary, Activity):
+        model.ensure_indexes()
+        queries = INDEX_QUERIES.get(model.__name__, {})
+        info = model._get_collection().index_information()
+        for name in sorted(info):
+            logger.info('{0}.{1} {2} -> {3}'.format(
+                model.__name__, name, info[name]['key'],
+                queries.get(name, 'primary key/unique constraint')))
+
+
+@manager.option('-w', '--workers', dest='workers', type=int, default=4)
+@manager.option('-n', '--inserts', dest='inserts', type=int, default=2000)
+@manager.option('-b', '--block-size', dest='block_size', type=int,
+                default=None)
+def benchmark_ids(workers, inserts, block_size):
+    """
+    Compare insert throughput of concurrent workers using one counter
+    update per document against block reserved ids.
+    """
+    from app.common.benchmarks import benchmark_id_allocation
+    block_size = block_size or app.config['ID_BLOCK_SIZE']
+    results = benchmark_id_allocation(app.config, workers=workers,
+                                      inserts=inserts, block_size=block_size)
+    logger.info('{0} workers x {1} inserts, block size {2}'.format(
+        workers, inserts, block_size))
+    for mode in ('sequence', 'block'):
+        logger.info('{0:>8} ids: {1:10.1f} inserts/sec'.format(
+            mode, results[mode]))
+
+
+@manager.option('-f', '--file', dest='filepath', required=True)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=None)
+def load_suggestions(filepath, batch_size):
+    """
+    Load suggestion queries and responses from a csv file.
+    """
+    stats = Suggestion.load_data_from_csv(filepath, batch_size,
+                                          rebuild_vectors=False)
+    if stats is None:
+        logger.error('Unable to load {0}.'.format(filepath))
+        return
+    logger.info('{0} suggestions loaded, {1} rows rejected in {2:.1f} sec '
+                '({3:.0f} rows/sec).'.format(stats['loaded'],
+                                             stats['rejected'],
+                                             stats['seconds'],
+                                             stats['rows_per_sec']))
+    from app.common.suggestion_vectors import np
+    if stats['loaded'] and np is not None:
+        # Built here, a background rebuild would be killed on exit.
+        build_suggestion_vectors()
+
+
+@manager.option('-u', '--users', dest='users', type=int, default=1000)
+@manager.option('-f', '--friends', dest='friends', type=int, default=20)
+@manager.option('-t', '--tags', dest='tags', type=int, default=200)
+@manager.option('-p', '--posts', dest='posts', type=int, default=10000)
+@manager.option('-a', '--activities', dest='activities', type=int,
+                default=1000)
+@manager.option('-d', '--diaries', dest='diaries', type=int, default=1000)
+@manager.option('-c', '--comments', dest='comments', type=int, default=20000)
+@manager.option('-s', '--seed', dest='seed_value', type=int, default=0)
+@manager.option('-b', '--batch-size', dest='batch_size', type=int,
+                default=None)
+@manager.option('--no-timelines', dest='timelines', action='store_false',
+                default=True)
+def seed(users, friends, tags, posts, activities, diaries, comments,
+         seed_value, batch_size, timelines):
+    """
+    Generate a data set for load testing, contents and timestamps depend
+    only on the seed.
+    """
+    from app.common.seed import seed as seed_data
+    start = time.time()
+    counts = seed_data(users=users, friends=friends, tags=tags, posts=posts,
+                       activities=activities, diaries=diaries,
+                       comments=comments, seed_value=seed_value,
+                       batch_size=batch_size or app.config['CSV_BATCH_SIZE'],
+                       timelines=timelines)
+    total = sum(c for name, (c, _) in counts.items()
+                if name not in ('friendships', 'derived'))
+    elapsed = time.time() - start
+    logger.info('{0} documents seeded in {1:.1f} sec ({2:.0f} '
+                'docs/sec).'.format(total, elapsed,
+                                    total / elapsed if elapsed else 0))
+
+
+@manager.option('-m', '--method', dest='method', default=None)
+@manager.option('-w', '--workers', dest='workers', type=int, default=None)
+@manager.option('-n', '--logins', dest='logins', type=int, default=200)
+def benchmark_passwords(method, workers, logins):
+    """
+    Report password checks (logins) per second and per core for the
+    configured or given hash method.
+    """
+    from app.common.benchmarks import benchmark_password_hashing
+    method = method or app.config['PASSWORD_HASH_METHOD']
+    results = benchmark_password_hashing(method,
+                                         app.config['PASSWORD_SALT_LENGTH'],
+                                         workers=workers, logins=logins)
+    logger.info('{0}: {1} logins on {2} cores, {3:.1f} logins/sec, '
+                '{4:.1f} logins/sec per core.'.format(
+                    method, results['logins'], results['workers'],
+                    results['total'], results['per_core']))
+
+
 @manager.command
 def secureserver():
     """